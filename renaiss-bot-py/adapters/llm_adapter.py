@@ -4,9 +4,38 @@ LLM Adapter to interact with the AI model for chat functionalities.
 
 import openai
 import json
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
 from config import config, Config
+from utils.metrics import metrics
+from utils.rate_limit import ConcurrencyGate, Overloaded
+from utils.tracing import span
 from utils.logger import logger
 
+LLM_SECONDS = metrics.histogram("llm_request_seconds", "Latency of LLM calls.", ["call"])
+LLM_FIRST_TOKEN_SECONDS = metrics.histogram("llm_first_token_seconds", "Time to the first streamed token.")
+LLM_ERRORS = metrics.counter("llm_errors_total", "Failed LLM calls.", ["call"])
+LLM_TOKENS = metrics.counter("llm_tokens_total", "LLM token usage reported by the API.", ["call", "kind"])
+
+# Shared by every adapter instance, so the cap holds for the whole process
+llm_gate = ConcurrencyGate("llm", config.LLM_MAX_CONCURRENCY, config.LLM_MAX_WAITING, config.CHAT_DEADLINE_SECONDS)
+
+def _log_payload(message: str, payload: Any):
+    """
+    Full prompts and responses are logged at DEBUG, plus a sampled share at INFO.
+    The payload is a format argument, so loguru only renders it when the record is emitted.
+    """
+    if random.random() < config.LLM_PAYLOAD_LOG_SAMPLE_RATE:
+        logger.info(message, payload)
+    else:
+        logger.debug(message, payload)
+
+def _record_usage(call: str, usage):
+    if usage is not None:
+        LLM_TOKENS.inc(usage.prompt_tokens or 0, call=call, kind="prompt")
+        LLM_TOKENS.inc(usage.completion_tokens or 0, call=call, kind="completion")
+
 class LLMAdapter:
     '''Adapter for the Large Language Model.'''
 
@@ -16,35 +45,100 @@ class LLMAdapter:
         self.model = cfg.LLM_MODEL_NAME
         self.personality = cfg.BOT_PERSONALITY
 
-    async def generate_response(self, system_prompt: str, user_prompt: str) -> str:
+    async def generate_response(self, system_prompt: str, user_prompt: str,
+                                history: Optional[List[Dict[str, str]]] = None) -> str:
         '''
         Generates a response from the LLM based on a system and user prompt.
 
         Args:
             system_prompt: The system prompt defining the bot's personality and context.
             user_prompt: The user's message.
+            history: Earlier chat messages ({"role", "content"}), oldest first.
 
         Returns:
             The generated response string.
+
+        Raises:
+            Overloaded: No LLM slot freed up in time; no request was made.
         '''
-        logger.info(f"Generating LLM response for prompt: {user_prompt}")
+        _log_payload("Generating LLM response for prompt: {}", user_prompt)
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=500,
-            )
+            async with llm_gate.slot():
+                with span("llm.generate_response", LLM_SECONDS, call="generate_response"):
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            *(history or []),
+                            {"role": "user", "content": user_prompt}
+                        ],
+                        temperature=0.7,
+                        max_tokens=500,
+                    )
+            _record_usage("generate_response", response.usage)
             text_response = response.choices[0].message.content.strip()
-            logger.info(f"LLM generated response: {text_response}")
+            _log_payload("LLM generated response: {}", text_response)
             return text_response
+        except Overloaded:
+            raise
         except Exception as e:
+            LLM_ERRORS.inc(call="generate_response")
             logger.error(f"Error generating LLM response: {e}")
             return "抱歉，我的大脑好像断线了... 🧠💥 能稍等一下再问我吗？"
 
+    async def stream_response(self, system_prompt: str, user_prompt: str,
+                              history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+        '''
+        Streams a response from the LLM chunk by chunk.
+
+        Args:
+            system_prompt: The system prompt defining the bot's personality and context.
+            user_prompt: The user's message.
+            history: Earlier chat messages ({"role", "content"}), oldest first.
+
+        Yields:
+            Text deltas as they arrive. If the request fails before any text was
+            produced, a single apology message is yielded instead.
+
+        Raises:
+            Overloaded: No LLM slot freed up in time; nothing was yielded.
+        '''
+        _log_payload("Streaming LLM response for prompt: {}", user_prompt)
+        produced = False
+        started = time.perf_counter()
+        try:
+            async with llm_gate.slot():
+                with span("llm.stream_response", LLM_SECONDS, call="stream_response"):
+                    stream = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            *(history or []),
+                            {"role": "user", "content": user_prompt}
+                        ],
+                        temperature=0.7,
+                        max_tokens=500,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    )
+                    async for chunk in stream:
+                        _record_usage("stream_response", getattr(chunk, "usage", None))
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if not produced:
+                                LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+                            produced = True
+                            yield delta
+        except Overloaded:
+            raise
+        except Exception as e:
+            LLM_ERRORS.inc(call="stream_response")
+            logger.error(f"Error streaming LLM response: {e}")
+            if not produced:
+                yield "抱歉，我的大脑好像断线了... 🧠💥 能稍等一下再问我吗？"
+
     async def parse_intent(self, user_message: str) -> dict:
         '''
         Uses the LLM to parse the user's intent and extract entities.
@@ -54,8 +148,11 @@ class LLMAdapter:
 
         Returns:
             A dictionary with "intent" and "entities".
+
+        Raises:
+            Overloaded: No LLM slot freed up in time; no request was made.
         '''
-        logger.info(f"Parsing intent for message: {user_message}")
+        _log_payload("Parsing intent for message: {}", user_message)
         prompt = f'''
         Analyze the user message below and identify the primary intent and any relevant entities (like card names or numbers).
 
@@ -78,18 +175,25 @@ class LLMAdapter:
         {{"intent": "compare_cards", "entities": ["路飞", "索隆"]}}
         '''
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an expert at classifying user intent and extracting entities. Respond only in JSON format."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                response_format={"type": "json_object"}
-            )
+            async with llm_gate.slot():
+                with span("llm.parse_intent", LLM_SECONDS, call="parse_intent"):
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": "You are an expert at classifying user intent and extracting entities. Respond only in JSON format."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=0.1,
+                        response_format={"type": "json_object"}
+                    )
+            _record_usage("parse_intent", response.usage)
             intent_data = json.loads(response.choices[0].message.content)
-            logger.info(f"Parsed intent: {intent_data}")
+            _log_payload("Parsed intent: {}", intent_data)
             return intent_data
+        except Overloaded:
+            raise
         except Exception as e:
+            LLM_ERRORS.inc(call="parse_intent")
             logger.error(f"Error parsing intent: {e}")
-            return {"intent": "general_chat", "entities": [user_message]} # Default to general chat on error
+            # Default to general chat on error; "error" keeps the fallback out of the intent cache
+            return {"intent": "general_chat", "entities": [user_message], "error": True}
@@ -0,0 +1,71 @@
+
+import importlib
+import json
+from typing import List, Dict, Any, Iterable, Optional
+from utils.logger import logger
+
+class MarketAdapter:
+    """
+    Base class for a marketplace whose listings are compared against Renaiss.
+
+    Subclasses set `source` and their fees, and implement fetch_listings().
+    Listings are plain dicts with these keys (None when unknown):
+        source_id, name, set_name, grade, cert, ask_price, bid_price, link, image_url
+    """
+
+    source = ""
+    buy_fee_percent = 0.0  # Added on top of the ask when buying here
+    sell_fee_percent = 0.0  # Taken off the sale price when selling here
+
+    async def fetch_listings(self) -> List[Dict[str, Any]]:
+        """Returns every current listing on this market."""
+        raise NotImplementedError
+
+    async def close(self):
+        """Releases any pooled connections."""
+
+class FixtureMarketAdapter(MarketAdapter):
+    """Serves a fixed set of listings, for local testing and benchmarks."""
+
+    def __init__(self, source: str, listings: List[Dict[str, Any]],
+                 buy_fee_percent: float = 0.0, sell_fee_percent: float = 0.0):
+        self.source = source
+        self.listings = listings
+        self.buy_fee_percent = buy_fee_percent
+        self.sell_fee_percent = sell_fee_percent
+
+    @classmethod
+    def from_json(cls, path: str) -> "FixtureMarketAdapter":
+        """Loads {"source": ..., "buy_fee_percent": ..., "sell_fee_percent": ..., "listings": [...]}."""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["source"], data.get("listings", []),
+                   data.get("buy_fee_percent", 0.0), data.get("sell_fee_percent", 0.0))
+
+    async def fetch_listings(self) -> List[Dict[str, Any]]:
+        return list(self.listings)
+
+def load_market_adapter(spec: str) -> Optional[MarketAdapter]:
+    """
+    Builds an adapter from a config entry: 'package.module:ClassName' for a
+    class with a no-argument constructor, or 'fixture:path/to/listings.json'.
+    """
+    try:
+        kind, _, target = spec.strip().partition(":")
+        if kind == "fixture":
+            return FixtureMarketAdapter.from_json(target)
+        adapter = getattr(importlib.import_module(kind), target)()
+        if not isinstance(adapter, MarketAdapter) or not adapter.source:
+            raise TypeError(f"{target} is not a MarketAdapter with a source name")
+        return adapter
+    except Exception as e:
+        logger.error(f"Could not load market adapter '{spec}': {e}")
+        return None
+
+def load_market_adapters(specs: Iterable[str]) -> List[MarketAdapter]:
+    """Builds every configured adapter, skipping entries that fail to load."""
+    adapters = [adapter for adapter in map(load_market_adapter, specs) if adapter is not None]
+    sources = [adapter.source for adapter in adapters]
+    if "renaiss" in sources or len(set(sources)) != len(sources):
+        raise ValueError(f"Market adapter sources must be unique and not 'renaiss': {sources}")
+    return adapters
@@ -1,20 +1,138 @@
 
+import asyncio
+import itertools
+import random
 import aiohttp
 import json
-from typing import List, Dict, Any
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from typing import List, Dict, Any, AsyncIterator, Iterable, NamedTuple, Optional, Tuple, Union
 from config import config
+from utils.feed_log import FeedLogWriter
+from utils.json_stream import JsonArrayStream
+from utils.metrics import metrics
 from utils.logger import logger
 
+RENAISS_REQUEST_SECONDS = metrics.histogram("renaiss_request_seconds", "Latency of Renaiss API page requests.", ["outcome"])
+
+CARD_BASE_URL = "https://www.renaiss.xyz"
+_WEI_PER_CENT = 10 ** 16  # USDT amounts come in 18-decimal wei
+_STREAM_CHUNK_BYTES = 64 * 1024
+
+def to_cents(value: Union[str, int, None], units_per_cent: int = 1) -> Optional[int]:
+    """
+    Converts an integer amount string (e.g. wei) to whole cents, rounding half up,
+    without going through a float. Empty amounts and amounts that round to zero
+    cents mean no price, however the API encodes them.
+    """
+    if value is None or value == "":
+        return None
+    try:
+        amount = int(value)
+    except ValueError:
+        amount = Decimal(value)  # A decimal string; still exact
+        cents = int((amount / units_per_cent).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    else:
+        cents = (amount + units_per_cent // 2) // units_per_cent if units_per_cent > 1 else amount
+    return cents or None
+
+class CrawlIncomplete(Exception):
+    """A crawl stopped at a page that still failed after all retries, so later pages are missing."""
+
+class ListedCard(NamedTuple):
+    """One normalized Renaiss listing. Prices are integer cents; the *_price properties give dollars."""
+
+    renaiss_id: str
+    token_id: str
+    name: str
+    grade: Optional[str]
+    image_url: Optional[str]
+    ask_cents: Optional[int]
+    fmv_cents: Optional[int]
+    offer_cents: Optional[int]
+
+    @property
+    def ask_price(self) -> Optional[float]:
+        return None if self.ask_cents is None else self.ask_cents / 100
+
+    @property
+    def fmv_price(self) -> Optional[float]:
+        return None if self.fmv_cents is None else self.fmv_cents / 100
+
+    @property
+    def offer_price(self) -> Optional[float]:
+        return None if self.offer_cents is None else self.offer_cents / 100
+
+    @property
+    def link(self) -> str:
+        return f"{CARD_BASE_URL}/card/{self.token_id}"
+
 class RenaissAdapter:
     """Adapter for the Renaiss platform API."""
 
     def __init__(self):
         self.api_url = config.RENAISS_API_URL
-        self.base_url = "https://www.renaiss.xyz"
+        self.base_url = CARD_BASE_URL
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Optional log of raw page responses, replayed offline by services.feed_replay
+        self.recorder: Optional[FeedLogWriter] = None
+        if config.FEED_RECORD_DIR:
+            self.recorder = FeedLogWriter(config.FEED_RECORD_DIR, config.FEED_RECORD_SEGMENT_BYTES,
+                                          config.FEED_RECORD_MAX_SEGMENTS)
 
-    async def get_all_listed_cards(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
-        """Fetches all listed cards from the Renaiss API."""
-        logger.info(f"Fetching {limit} listed cards from Renaiss, offset {offset}")
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Returns the shared pooled HTTP session, creating it on first use."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=config.RENAISS_MAX_CONNECTIONS,
+                keepalive_timeout=config.RENAISS_KEEPALIVE_SECONDS,
+                ttl_dns_cache=300,
+            )
+            timeout = aiohttp.ClientTimeout(total=config.RENAISS_REQUEST_TIMEOUT_SECONDS)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self):
+        """Closes the shared HTTP session and the feed recorder."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self.recorder is not None:
+            await asyncio.to_thread(self.recorder.close)
+
+    def parse_page(self, body: bytes) -> List[ListedCard]:
+        """Normalizes a complete, already downloaded page body, e.g. a recorded one."""
+        decoder = JsonArrayStream("collection")
+        items = decoder.feed(body) + decoder.close()
+        return [card for card in map(self._normalize_card, items) if card is not None]
+
+    async def _record(self, crawl_id: int, offset: int, limit: int, body: bytes):
+        try:
+            await asyncio.to_thread(self.recorder.append, crawl_id, offset, limit, body)
+        except OSError as e:
+            logger.error(f"Could not record Renaiss page at offset {offset}: {e}")
+
+    async def _fetch_page(self, limit: int, offset: int,
+                          crawl_id: Optional[int] = None) -> Tuple[List[ListedCard], int]:
+        """
+        Fetches and normalizes a single page. Raises on HTTP or network errors.
+
+        Returns the normalized cards and the number of raw items on the page,
+        malformed ones included, which is what tells a short page apart.
+        """
+        items = [card async for card in self._stream_page(limit, offset, crawl_id)]
+        return [card for card in items if card is not None], len(items)
+
+    async def _stream_page(self, limit: int, offset: int, crawl_id: Optional[int] = None) -> AsyncIterator[Optional[ListedCard]]:
+        """
+        Yields the cards of one page while the response is still downloading.
+        A malformed item yields None, so callers can still count raw items.
+
+        The body is decoded incrementally, one `collection` item at a time, so
+        memory does not grow with the page size. Raises on HTTP or network errors.
+        With a recorder, the complete raw body is also appended to the feed log
+        under `crawl_id`, which groups the pages of one crawl.
+        """
         params = {
             "0": {
                 "json": {
@@ -26,14 +144,71 @@ class RenaissAdapter:
                 }
             }
         }
+        session = await self._get_session()
+        # The input parameter needs to be a JSON string
+        query = {"batch": "1", "input": json.dumps(params)}
+        started = time.perf_counter()
+        outcome = "error"
+        decoder = JsonArrayStream("collection")
+        normalized = 0
+        chunks: Optional[List[bytes]] = [] if self.recorder is not None else None
         try:
-            async with aiohttp.ClientSession() as session:
-                # The input parameter needs to be a JSON string
-                input_str = json.dumps(params)
-                async with session.get(f"{self.api_url}?batch=1&input={input_str}") as response:
-                    response.raise_for_status() # Raise an exception for bad status codes
-                    data = await response.json()
-                    return self._normalize_cards(data)
+            async with session.get(self.api_url, params=query) as response:
+                response.raise_for_status() # Raise an exception for bad status codes
+                async for chunk in response.content.iter_chunked(_STREAM_CHUNK_BYTES):
+                    if chunks is not None:
+                        chunks.append(chunk)
+                    for item in decoder.feed(chunk):
+                        card = self._normalize_card(item)
+                        if card is not None:
+                            normalized += 1
+                        yield card
+                try:
+                    items = decoder.close()
+                except ValueError as e:
+                    if decoder.found:
+                        # Truncated body; a payload error lets the caller retry the page
+                        raise aiohttp.ClientPayloadError(f"Renaiss page at offset {offset} is truncated: {e}") from e
+                    logger.warning(f"Renaiss API returned empty or invalid data format: {e}")
+                    items = []
+                for item in items:
+                    card = self._normalize_card(item)
+                    if card is not None:
+                        normalized += 1
+                    yield card
+                outcome = "ok"
+        finally:
+            RENAISS_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+        if chunks is not None:
+            await self._record(time.time_ns() if crawl_id is None else crawl_id, offset, limit, b"".join(chunks))
+        logger.info(f"Successfully normalized {normalized} cards.")
+
+    async def _fetch_page_with_retry(self, limit: int, offset: int,
+                                     crawl_id: Optional[int] = None) -> Optional[Tuple[List[ListedCard], int]]:
+        """Fetches a page, retrying with jittered exponential backoff. Returns None if all attempts fail."""
+        attempts = config.RENAISS_MAX_RETRIES + 1
+        for attempt in range(attempts):
+            try:
+                return await self._fetch_page(limit, offset, crawl_id)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == attempts - 1:
+                    logger.error(f"Giving up on Renaiss page at offset {offset} after {attempts} attempts: {e}")
+                    return None
+                delay = config.RENAISS_RETRY_BASE_DELAY_SECONDS * (2 ** attempt)
+                delay = random.uniform(0, delay)  # Full jitter
+                logger.warning(f"Renaiss page at offset {offset} failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logger.error(f"An unexpected error occurred fetching Renaiss page at offset {offset}: {e}")
+                return None
+        return None
+
+    async def get_all_listed_cards(self, limit: int = 100, offset: int = 0) -> List[ListedCard]:
+        """Fetches all listed cards from the Renaiss API."""
+        logger.info(f"Fetching {limit} listed cards from Renaiss, offset {offset}")
+        try:
+            cards, _ = await self._fetch_page(limit, offset)
+            return cards
         except aiohttp.ClientError as e:
             logger.error(f"Error fetching data from Renaiss API: {e}")
             return []
@@ -41,35 +216,94 @@ class RenaissAdapter:
             logger.error(f"An unexpected error occurred in RenaissAdapter: {e}")
             return []
 
-    def _normalize_cards(self, raw_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Normalizes the raw card data from the API into a structured format."""
-        normalized_cards = []
-        if not raw_data or not isinstance(raw_data, list) or not raw_data[0].get("result"):
-            logger.warning("Renaiss API returned empty or invalid data format.")
-            return []
+    async def crawl_listed_cards(self, page_size: Optional[int] = None,
+                                 concurrency: Optional[int] = None,
+                                 max_pages: Optional[int] = None,
+                                 pages: Optional[Iterable[int]] = None) -> AsyncIterator[Tuple[int, List[ListedCard]]]:
+        """
+        Walks every offset page of the listing endpoint with bounded concurrency.
 
-        collection = raw_data[0]["result"]["data"]["json"]["collection"]
-        
-        for item in collection:
-            try:
-                ask_price = float(item.get("askPriceInUSDT", 0)) / 1e18 if item.get("askPriceInUSDT") else None
-                fmv_price = float(item.get("fmvPriceInUSD", 0)) / 100 if item.get("fmvPriceInUSD") else None
-                offer_price = float(item.get("offerPriceInUSDT", 0)) / 1e18 if item.get("offerPriceInUSDT") else None
-
-                normalized_cards.append({
-                    "renaiss_id": item["id"],
-                    "token_id": item["tokenId"],
-                    "name": item["name"],
-                    "ask_price": round(ask_price, 2) if ask_price is not None else None,
-                    "fmv_price": round(fmv_price, 2) if fmv_price is not None else None,
-                    "offer_price": round(offer_price, 2) if offer_price is not None else None,
-                    "grade": item.get("grade"),
-                    "image_url": item.get("frontImageUrl"),
-                    "link": f"{self.base_url}/card/{item['tokenId']}"
-                })
-            except (TypeError, ValueError, KeyError) as e:
-                logger.error(f"Error normalizing card data for item {item.get('id')}: {e}")
-                continue
-        
-        logger.info(f"Successfully normalized {len(normalized_cards)} cards.")
-        return normalized_cards
+        Pages are yielded as soon as they arrive, so the order is not guaranteed.
+        The crawl stops at the first short page, or at the first page that still
+        fails after all retries; in that case CrawlIncomplete is raised once the
+        pages that did arrive have been yielded.
+
+        Args:
+            page_size: Number of cards per page.
+            concurrency: Maximum number of pages in flight.
+            max_pages: Hard cap on the number of pages requested.
+            pages: Fetch only these page numbers instead of walking the catalog,
+                as the hot lane does; a short page does not stop them.
+
+        Yields:
+            (page number, normalized cards) tuples, one per page.
+        """
+        page_size = page_size or config.RENAISS_PAGE_SIZE
+        concurrency = concurrency or config.RENAISS_CRAWL_CONCURRENCY
+        partial = max_pages is not None or pages is not None  # Callers asking for part of the catalog expect to stop early
+        max_pages = max_pages or config.RENAISS_MAX_PAGES
+        targets = iter(sorted(set(pages))) if pages is not None else itertools.count()
+        logger.info(f"Crawling Renaiss listings: page_size={page_size}, concurrency={concurrency}")
+
+        crawl_id = time.time_ns()
+        requested = 0
+        exhausted = False
+        failed: Optional[int] = None  # First page that failed after all retries
+        pending: Dict[asyncio.Task, int] = {}
+
+        def schedule():
+            nonlocal requested, exhausted
+            while not exhausted and len(pending) < concurrency and requested < max_pages:
+                page = next(targets, None)
+                if page is None:
+                    exhausted = True
+                    break
+                task = asyncio.create_task(self._fetch_page_with_retry(page_size, page * page_size, crawl_id))
+                pending[task] = page
+                requested += 1
+
+        try:
+            schedule()
+            while pending:
+                done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    page = pending.pop(task)
+                    result = task.result()
+                    # A short page ends the catalog; count raw items so dropped malformed ones don't end it early
+                    if result is None or result[1] < page_size:
+                        exhausted = True
+                    if result is None and (failed is None or page < failed):
+                        failed = page
+                    if result and result[0]:
+                        yield page, result[0]
+                schedule()
+        finally:
+            for task in pending:
+                task.cancel()
+            # Let the cancelled fetches unwind instead of leaving them unawaited
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if failed is not None:
+            raise CrawlIncomplete(f"Renaiss page {failed} failed after all retries; "
+                                  f"the crawl stopped after {requested} page requests")
+        if requested >= max_pages and not exhausted and not partial:
+            logger.warning(f"Renaiss crawl stopped at the {max_pages}-page cap.")
+        logger.info(f"Renaiss crawl finished after {requested} page requests.")
+
+    def _normalize_card(self, item: Dict[str, Any]) -> Optional[ListedCard]:
+        """Normalizes one raw `collection` item, or returns None if it is malformed."""
+        try:
+            return ListedCard(
+                renaiss_id=item["id"],
+                token_id=item["tokenId"],
+                name=item["name"],
+                grade=item.get("grade"),
+                image_url=item.get("frontImageUrl"),
+                ask_cents=to_cents(item.get("askPriceInUSDT"), _WEI_PER_CENT),
+                fmv_cents=to_cents(item.get("fmvPriceInUSD")),  # Already in cents
+                offer_cents=to_cents(item.get("offerPriceInUSDT"), _WEI_PER_CENT),
+            )
+        except (TypeError, ValueError, ArithmeticError, KeyError, AttributeError) as e:
+            item_id = item.get("id") if isinstance(item, dict) else None
+            logger.error(f"Error normalizing card data for item {item_id}: {e}")
+            return None
@@ -0,0 +1,83 @@
+
+"""
+Local stand-in for the OpenAI-compatible chat completions endpoint.
+
+Intent requests (response_format=json_object) get a scripted classification,
+other requests get a canned reply, streamed token by token when stream=True.
+Latencies are configurable so runs are repeatable.
+"""
+
+import asyncio
+import json
+import time
+from aiohttp import web
+
+_REPLY = ("哇！这张卡可是我的心头好 😍 **喷火龙 (PSA 10)** 现在挂单 *$1234*，FMV 大概 *$1500*，"
+          "算下来有两成左右的空间 🔥 不过市场变化快，下手前记得再确认一下哦！💰")
+
+class FakeLLMServer:
+    """Serves /v1/chat/completions with scripted latencies and token streams."""
+
+    def __init__(self, first_token_ms: float = 300.0, token_interval_ms: float = 15.0,
+                 intent_latency_ms: float = 600.0, tokens: int = 60):
+        self.first_token_ms = first_token_ms
+        self.token_interval_ms = token_interval_ms
+        self.intent_latency_ms = intent_latency_ms
+        self.tokens = tokens
+        self.requests = {"intent": 0, "completion": 0, "stream": 0}
+        self._runner = None
+        self.base_url = ""
+
+    def _chunks(self):
+        size = max(1, len(_REPLY) // self.tokens)
+        return [_REPLY[i:i + size] for i in range(0, len(_REPLY), size)]
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get("model", "fake")
+        if body.get("response_format", {}).get("type") == "json_object":
+            self.requests["intent"] += 1
+            await asyncio.sleep(self.intent_latency_ms / 1000)
+            return web.json_response(_completion(model, json.dumps({"intent": "general_chat", "entities": []})))
+
+        if not body.get("stream"):
+            self.requests["completion"] += 1
+            await asyncio.sleep((self.first_token_ms + self.token_interval_ms * self.tokens) / 1000)
+            return web.json_response(_completion(model, _REPLY))
+
+        self.requests["stream"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(self.first_token_ms / 1000)
+        for chunk in self._chunks():
+            payload = {
+                "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(self.token_interval_ms / 1000)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}/v1"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+def _completion(model: str, content: str) -> dict:
+    return {
+        "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 60, "total_tokens": 160},
+    }
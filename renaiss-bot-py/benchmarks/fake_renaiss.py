@@ -0,0 +1,79 @@
+
+"""
+Local stand-in for the Renaiss `collectible.list` tRPC endpoint.
+
+Generates a deterministic synthetic catalog of N listed cards, with
+configurable per-request latency and error rate.
+"""
+
+import asyncio
+import json
+import random
+from aiohttp import web
+
+_SUBJECTS = ["Charizard", "Pikachu", "Mewtwo", "Umbreon", "Lugia", "Rayquaza", "Gengar", "Luffy", "Zoro", "Shanks"]
+_SETS = ["Base Set", "Evolving Skies", "151", "Crown Zenith", "OP01", "OP05", "Japanese Promo"]
+_GRADES = ["PSA 10", "PSA 9", "BGS 9.5", "CGC 10", "PSA 8"]
+
+class FakeRenaissServer:
+    """Serves a synthetic catalog with the same response shape as the real API."""
+
+    def __init__(self, cards: int = 5000, latency_ms: float = 20.0, error_rate: float = 0.0,
+                 price_drift: float = 0.0, seed: int = 42):
+        self.cards = cards
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.price_drift = price_drift  # Fraction of cards whose ask moves on each generation
+        self.generation = 0
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._runner = None
+        self.url = ""
+
+    def bump_generation(self):
+        """Moves a price_drift fraction of asks, as a market would between refreshes."""
+        self.generation += 1
+
+    def item(self, index: int) -> dict:
+        rng = random.Random(index)
+        fmv_cents = rng.randint(2_000, 500_000)
+        ask_cents = int(fmv_cents * rng.uniform(0.7, 1.25))
+        if self.generation and random.Random(f"{index}:{self.generation}").random() < self.price_drift:
+            ask_cents = int(ask_cents * random.Random(f"{index}:{self.generation}:p").uniform(0.9, 1.1))
+        offer_cents = int(fmv_cents * rng.uniform(0.5, 0.9))
+        return {
+            "id": f"bench-{index}",
+            "tokenId": str(10_000_000 + index),
+            "name": f"{rng.choice(_SETS)} {rng.choice(_SUBJECTS)} #{index}",
+            "grade": rng.choice(_GRADES),
+            "askPriceInUSDT": str(ask_cents * 10 ** 16),
+            "fmvPriceInUSD": str(fmv_cents),
+            "offerPriceInUSDT": str(offer_cents * 10 ** 16),
+            "frontImageUrl": f"https://img.example.com/{index}.png",
+        }
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.latency_ms:
+            await asyncio.sleep(self._random.expovariate(1000 / self.latency_ms))
+        if self._random.random() < self.error_rate:
+            return web.Response(status=503)
+        query = json.loads(request.query["input"])["0"]["json"]
+        offset, limit = query["offset"], query["limit"]
+        collection = [self.item(i) for i in range(offset, min(offset + limit, self.cards))]
+        return web.json_response([{"result": {"data": {"json": {"collection": collection}}}}])
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/api/trpc/collectible.list", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}/api/trpc/collectible.list"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
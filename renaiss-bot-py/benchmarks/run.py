@@ -0,0 +1,265 @@
+
+"""
+Offline benchmark suite for the Renaiss bot.
+
+Runs against local stand-ins for the Renaiss API and the LLM, so it needs no
+Telegram token, network access or API keys, and prints machine-readable JSON.
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --cards 20000 --sizes 1000,100000,1000000 --users 100 --output bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+def _prepare_environment(workdir: str):
+    """Points config at throwaway resources. Must run before any bot module is imported."""
+    os.environ.setdefault("TELEGRAM_TOKEN", "000000:benchmark")
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "p50": round(pick(0.50), 4),
+        "p90": round(pick(0.90), 4),
+        "p99": round(pick(0.99), 4),
+        "max": round(ordered[-1], 4),
+        "mean": round(sum(ordered) / len(ordered), 4),
+    }
+
+async def bench_refresh(args) -> Dict[str, Any]:
+    """Measures full-catalog refresh throughput, cold (all inserts) and warm (mostly unchanged)."""
+    from benchmarks.fake_renaiss import FakeRenaissServer
+    from config import config
+    from models.database import init_db
+    from services.card_info_service import CardInfoService
+    from services.market_snapshot import market_snapshot
+
+    server = FakeRenaissServer(cards=args.cards, latency_ms=args.api_latency_ms,
+                               error_rate=args.api_error_rate, price_drift=args.price_drift)
+    config.RENAISS_API_URL = await server.start()
+    config.RENAISS_RETRY_BASE_DELAY_SECONDS = 0.01
+    await init_db()
+    service = CardInfoService()
+    results = {"cards": args.cards, "api_latency_ms": args.api_latency_ms, "api_error_rate": args.api_error_rate}
+    try:
+        for phase in ("cold", "warm"):
+            started = time.perf_counter()
+            counts = await service.refresh_all_cards()
+            elapsed = time.perf_counter() - started
+            seen = counts["inserted"] + counts["updated"] + counts["unchanged"]
+            results[phase] = {
+                "seconds": round(elapsed, 4),
+                "cards_per_second": round(seen / elapsed, 1) if elapsed else None,
+                "inserted": counts["inserted"],
+                "updated": counts["updated"],
+                "unchanged": counts["unchanged"],
+            }
+            server.bump_generation()
+
+        started = time.perf_counter()
+        snapshot = await market_snapshot.rebuild()
+        results["snapshot_rebuild_seconds"] = round(time.perf_counter() - started, 4)
+        results["snapshot_rows"] = len(snapshot)
+        results["http_requests"] = server.requests
+    finally:
+        await service.close()
+        await server.stop()
+    return results
+
+def bench_arbitrage(args) -> List[Dict[str, Any]]:
+    """Measures threshold scans over synthetic snapshots of increasing size."""
+    import numpy as np
+    from services.market_snapshot import MarketSnapshot
+
+    results = []
+    rng = np.random.default_rng(7)
+    for size in args.sizes:
+        fmv = rng.uniform(20, 5000, size)
+        ask = fmv * rng.uniform(0.7, 1.25, size)
+        started = time.perf_counter()
+        snapshot = MarketSnapshot(
+            version=1, card_ids=np.arange(size, dtype=np.int64), ask_prices=ask, fmv_prices=fmv,
+            offer_prices=fmv * 0.8, names=[f"card {i}" for i in range(size)], grades=["PSA 10"] * size,
+            image_urls=[None] * size, links=[None] * size,
+        )
+        build_seconds = time.perf_counter() - started
+
+        latencies = []
+        for _ in range(args.queries):
+            threshold = random.uniform(0, 40)
+            started = time.perf_counter()
+            snapshot.top_opportunities(threshold, 5)
+            latencies.append((time.perf_counter() - started) * 1000)
+        results.append({
+            "listings": size,
+            "build_seconds": round(build_seconds, 4),
+            "query_ms": _percentiles(latencies),
+        })
+    return results
+
+class _Recorder:
+    """Captures when the first visible reply text reaches the simulated user."""
+
+    def __init__(self, streaming: bool):
+        self.streaming = streaming
+        self.started = time.perf_counter()
+        self.first_text_at = None
+        self.replied = False
+
+    def visible(self, is_placeholder: bool):
+        if not is_placeholder and self.first_text_at is None:
+            self.first_text_at = time.perf_counter()
+
+class _BenchMessage:
+    def __init__(self, text: str, recorder: _Recorder):
+        self.text = text
+        self._recorder = recorder
+
+    async def edit_text(self, text: str, **kwargs):
+        self._recorder.visible(False)
+        return self
+
+class _BenchBot:
+    """Stands in for telegram.Bot behind the outbound queue, routing sends to each user's recorder."""
+
+    def __init__(self):
+        self.recorders: Dict[int, _Recorder] = {}
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        recorder = self.recorders[chat_id]
+        is_placeholder = recorder.streaming and not recorder.replied
+        recorder.replied = True
+        recorder.visible(is_placeholder)
+        return _BenchMessage(text, recorder)
+
+    async def send_photo(self, chat_id: int, photo, **kwargs):
+        # Card photos go out ahead of the reply and do not count as its first visible byte
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"bench-{hash(photo) & 0xffff:x}")])
+
+async def bench_chat(args) -> Dict[str, Any]:
+    """Measures end-to-end ChatHandler.handle_message latency under concurrent simulated users."""
+    from benchmarks.fake_llm import FakeLLMServer
+    from config import config
+
+    llm_server = FakeLLMServer(first_token_ms=args.llm_first_token_ms, token_interval_ms=args.llm_token_ms,
+                               intent_latency_ms=args.llm_intent_ms)
+    os.environ["OPENAI_BASE_URL"] = await llm_server.start()
+    from core.chat_handler import CHAT_ADMISSION, ChatHandler
+    from core.outbound_queue import outbound
+    # Simulated users send back to back; measure the pipeline, not the per-user rate limit
+    config.CHAT_USER_BURST = max(config.CHAT_USER_BURST, args.messages)
+    handler = ChatHandler()
+    bot = _BenchBot()
+    outbound.start(bot)
+
+    scripted = ["喷火龙多少钱", "皮卡丘 PSA 10 啥价", "给我找找套利机会", "路飞和索隆哪个贵", "早上好小R", "最近市场怎么样"]
+    totals, first_text = [], []
+
+    async def simulate_user(user_id: int):
+        for turn in range(args.messages):
+            text = scripted[turn % len(scripted)]
+            if turn % 3 == 2:
+                text = f"{text} #{user_id}-{turn}"  # Unique text that has to go through the LLM tier
+            recorder = bot.recorders[user_id] = _Recorder(config.LLM_STREAMING)
+            message = _BenchMessage(text, recorder)
+            update = SimpleNamespace(
+                message=message,
+                effective_user=SimpleNamespace(id=user_id, first_name="bench", username=None),
+                effective_chat=SimpleNamespace(id=user_id),
+            )
+            await handler.handle_message(update, SimpleNamespace(args=[]))
+            totals.append((time.perf_counter() - recorder.started) * 1000)
+            if recorder.first_text_at is not None:
+                first_text.append((recorder.first_text_at - recorder.started) * 1000)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(simulate_user(user_id) for user_id in range(1, args.users + 1)))
+    finally:
+        await outbound.stop()
+        await llm_server.stop()
+    elapsed = time.perf_counter() - started
+    return {
+        "users": args.users,
+        "messages_per_user": args.messages,
+        "streaming": config.LLM_STREAMING,
+        "wall_seconds": round(elapsed, 4),
+        "messages_per_second": round(len(totals) / elapsed, 2) if elapsed else None,
+        "total_ms": _percentiles(totals),
+        "first_text_ms": _percentiles(first_text),
+        "llm_requests": llm_server.requests,
+        "intent_tier_hit_rates": handler.intent_router.hit_rates(),
+        "admission": {result: CHAT_ADMISSION.value(result=result)
+                      for result in ("admitted", "degraded", "shed", "rate_limited")},
+    }
+
+async def run(args) -> Dict[str, Any]:
+    results: Dict[str, Any] = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "suites": args.suites,
+        }
+    }
+    if "refresh" in args.suites or "chat" in args.suites:
+        # The chat suite answers from the catalog the refresh suite loads
+        results["refresh"] = await bench_refresh(args)
+    if "arbitrage" in args.suites:
+        results["arbitrage"] = bench_arbitrage(args)
+    if "chat" in args.suites:
+        results["chat"] = await bench_chat(args)
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the Renaiss bot.")
+    parser.add_argument("--suites", default="refresh,arbitrage,chat", type=lambda v: v.split(","))
+    parser.add_argument("--cards", type=int, default=5000, help="Synthetic catalog size for the refresh suite")
+    parser.add_argument("--api-latency-ms", type=float, default=20.0)
+    parser.add_argument("--api-error-rate", type=float, default=0.0)
+    parser.add_argument("--price-drift", type=float, default=0.05, help="Share of asks that move between refreshes")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        type=lambda v: [int(size) for size in v.split(",")])
+    parser.add_argument("--queries", type=int, default=200, help="Threshold queries per snapshot size")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=6, help="Messages per simulated user")
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0)
+    parser.add_argument("--llm-token-ms", type=float, default=15.0)
+    parser.add_argument("--llm-intent-ms", type=float, default=600.0)
+    parser.add_argument("--output", default="-", help="Path for the JSON results, '-' for stdout")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="renaiss-bench-") as workdir:
+        _prepare_environment(workdir)
+        from utils.logger import logger
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+        results = asyncio.run(run(args))
+
+    payload = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output == "-":
+        print(payload)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+
+if __name__ == "__main__":
+    main()
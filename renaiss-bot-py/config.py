@@ -7,6 +7,7 @@ Loads environment variables from a .env file.
 """
 
 import os
+import socket
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -20,12 +21,84 @@ class Config:
     if not TELEGRAM_TOKEN:
         raise ValueError("TELEGRAM_TOKEN environment variable not set!")
 
+    # --- Serving Mode ---
+    BOT_MODE = os.getenv("BOT_MODE", "polling").lower()  # 'polling' or 'webhook'
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Public base URL Telegram posts updates to
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+    WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+    WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+    WEBHOOK_QUEUE_SIZE = 100  # Per worker
+    WEBHOOK_REUSE_PORT = os.getenv("WEBHOOK_REUSE_PORT", "true").lower() == "true"  # Lets several processes share the port
+    WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "true").lower() == "true"  # Call setWebhook on startup
+    WEBHOOK_MAX_CONNECTIONS = 40
+    WEBHOOK_DRAIN_TIMEOUT_SECONDS = 10
+    if BOT_MODE == "webhook" and WEBHOOK_REGISTER and not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL environment variable not set!")
+
     # --- API Configuration ---
-    RENAISS_API_URL = "https://www.renaiss.xyz/api/trpc/collectible.list"
+    RENAISS_API_URL = os.getenv("RENAISS_API_URL", "https://www.renaiss.xyz/api/trpc/collectible.list")
+
+    # --- Renaiss Crawler Configuration ---
+    RENAISS_PAGE_SIZE = int(os.getenv("RENAISS_PAGE_SIZE", "100"))
+    RENAISS_CRAWL_CONCURRENCY = int(os.getenv("RENAISS_CRAWL_CONCURRENCY", "4"))
+    RENAISS_MAX_PAGES = int(os.getenv("RENAISS_MAX_PAGES", "1000"))  # Safety cap per crawl
+    RENAISS_MAX_RETRIES = 3
+    RENAISS_RETRY_BASE_DELAY_SECONDS = 0.5
+    RENAISS_REQUEST_TIMEOUT_SECONDS = 20
+    RENAISS_MAX_CONNECTIONS = 8
+    RENAISS_KEEPALIVE_SECONDS = 60
+    # Raw page responses are appended here for offline replay (python -m services.feed_replay); empty disables
+    FEED_RECORD_DIR = os.getenv("FEED_RECORD_DIR", "")
+    FEED_RECORD_SEGMENT_BYTES = int(os.getenv("FEED_RECORD_SEGMENT_BYTES", str(256 * 1024 * 1024)))  # Uncompressed bytes per segment
+    FEED_RECORD_MAX_SEGMENTS = int(os.getenv("FEED_RECORD_MAX_SEGMENTS", "0"))  # Oldest segments beyond this are deleted; 0 keeps all
 
     # --- LLM Configuration ---
     # Using the pre-configured OpenAI compatible environment
     LLM_MODEL_NAME = "gemini-2.5-flash"
+    INTENT_CACHE_SIZE = 2048
+    INTENT_CACHE_TTL_SECONDS = 3600
+    INTENT_STATS_LOG_EVERY = 100  # Log tier hit rates every N messages
+    LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"
+    STREAM_EDIT_INTERVAL_SECONDS = 1.0  # Telegram tolerates roughly one edit per second per chat
+
+    # --- Outbound Message Queue ---
+    # Telegram allows about 30 messages/s per bot, 1/s per private chat and 20/min per group
+    OUTBOUND_GLOBAL_RATE = 30.0
+    OUTBOUND_CHAT_RATE = 1.0
+    OUTBOUND_GROUP_RATE = 20 / 60
+    OUTBOUND_CHAT_BURST = 3
+    OUTBOUND_CHAT_BUCKETS = 100_000  # Rate-limit state kept for at most this many recently active chats
+    OUTBOUND_MAX_IN_FLIGHT = 16
+    OUTBOUND_MAX_ATTEMPTS = 3  # Attempts per message on network errors
+    OUTBOUND_DRAIN_TIMEOUT_SECONDS = 10
+
+    # --- Conversation Memory & Prompt Configuration ---
+    CONVERSATION_MAX_TURNS = 10  # Messages (user and bot) remembered per user
+    CONVERSATION_MAX_USERS = 10_000  # Users kept in memory; the least recently active are evicted first
+    CONVERSATION_SPILL = os.getenv("CONVERSATION_SPILL", "false").lower() == "true"  # Save evicted history to the database
+    PROMPT_HISTORY_TOKEN_BUDGET = 800  # Approximate tokens of history sent with each prompt
+    PROMPT_MAX_TURN_CHARS = 400  # Longer remembered messages are cut to this length
+
+    # --- Chat Admission Control ---
+    CHAT_USER_RATE = float(os.getenv("CHAT_USER_RATE", "0.2"))  # Sustained messages per second per user
+    CHAT_USER_BURST = int(os.getenv("CHAT_USER_BURST", "5"))
+    CHAT_RATE_LIMIT_USERS = 100_000  # Rate-limit state kept for at most this many recently active users
+    CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "8"))  # Longest a message may wait for the LLM in total
+    CHAT_DEGRADE_QUEUE_DEPTH = int(os.getenv("CHAT_DEGRADE_QUEUE_DEPTH", "16"))  # Queued LLM calls at which data replies skip the LLM
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))  # In-flight LLM requests per process
+    LLM_MAX_WAITING = int(os.getenv("LLM_MAX_WAITING", "64"))  # LLM requests queued beyond that; more are shed
+
+    # --- Card Image Configuration ---
+    MEDIA_ENABLED = os.getenv("MEDIA_ENABLED", "true").lower() == "true"  # Send card photos with replies
+    MEDIA_FILE_ID_CACHE_SIZE = 20_000
+    MEDIA_GALLERY_SIZE = 5  # Thumbnails in the /arbitrage media group (Telegram allows 2-10)
+    THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "./data/thumbnails")
+    THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+    THUMBNAIL_MAX_SIDE = 320  # Pixels
+    MEDIA_DOWNLOAD_TIMEOUT_SECONDS = 15
+    MEDIA_MAX_DOWNLOAD_BYTES = 10 * 1024 * 1024
 
     # --- Database Configuration ---
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./renaiss_bot.db")
@@ -44,8 +117,67 @@ class Config:
     OFFICIAL_TWITTER_URL = "https://x.com/renaissxyz?s=21"
     OFFICIAL_DISCORD_URL = "https://discord.gg/renaiss"
 
+    # --- Observability Configuration ---
+    METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 disables the /metrics endpoint
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))  # Share of update traces logged
+    LLM_PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv("LLM_PAYLOAD_LOG_SAMPLE_RATE", "0.0"))  # Share of prompts logged at INFO
+
     # --- Scheduler Configuration ---
-    MONITOR_INTERVAL_SECONDS = 300  # 5 minutes
+    MONITOR_INTERVAL_SECONDS = 300  # 5 minutes; full-sweep interval at the target change rate
+    REFRESH_MIN_INTERVAL_SECONDS = 60  # Floor while the market moves fast
+    REFRESH_MAX_INTERVAL_SECONDS = 1800  # Ceiling while the market is quiet
+    REFRESH_TARGET_CHANGE_RATE = 0.02  # Share of listings changing per sweep that maps to the base interval
+    REFRESH_CHANGE_RATE_SMOOTHING = 0.3  # EWMA weight of the latest sweep's change rate
+    HOT_LANE_INTERVAL_SECONDS = 30
+    HOT_LANE_MAX_PAGES = 10  # Pages holding hot cards re-crawled per fast-lane run, busiest first
+    HOT_CARD_TTL_SECONDS = 1800  # How long a card stays hot after it was last marked
+    HOT_CARD_THRESHOLD_BAND_PERCENT = 2.0  # Cards this close below the lowest alert threshold count as hot
+    HOT_CARD_NEAR_THRESHOLD_LIMIT = 200
+
+    # --- Multi-Instance Coordination ---
+    # Every instance sharing DATABASE_URL elects one leader that crawls and writes; the others only serve chats
+    NODE_ID = os.getenv("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+    LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "30"))
+    LEADER_HEARTBEAT_SECONDS = float(os.getenv("LEADER_HEARTBEAT_SECONDS", "10"))  # Well under the lease, so one missed beat is survivable
+    SNAPSHOT_POLL_SECONDS = float(os.getenv("SNAPSHOT_POLL_SECONDS", "5"))  # How often followers check for a newer market version
+    SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "./data/market_snapshot.bin")  # Memory-mapped market snapshot; empty disables
+
+    # --- Arbitrage Configuration ---
+    ARBITRAGE_CACHE_SIZE = 256
+    ARBITRAGE_PAGE_SIZE = 5  # Opportunities per /arbitrage page
+
+    # --- Price Statistics Configuration ---
+    PRICE_STATS_WINDOW_DAYS = 30  # Rolling window of the median, quantiles and min/max
+    PRICE_STATS_EWMA_ALPHA = 0.2  # Weight of the newest ask in the EWMA and volatility
+    PRICE_STATS_SKETCH_ACCURACY = 0.01  # Relative error of quantiles
+    PRICE_STATS_MIN_OBSERVATIONS = 5  # Asks in the window before the median is trusted for signals
+    MEDIAN_DISCOUNT_PERCENT = float(os.getenv("MEDIAN_DISCOUNT_PERCENT", "20"))  # "Below Median" signal threshold
+
+    # --- Cross-Market Configuration ---
+    # Extra markets compared against Renaiss: comma-separated 'package.module:ClassName'
+    # or 'fixture:path/to/listings.json' entries
+    MARKET_ADAPTERS = [spec.strip() for spec in os.getenv("MARKET_ADAPTERS", "").split(",") if spec.strip()]
+    MARKET_FETCH_TIMEOUT_SECONDS = 120
+    MARKET_STORE_BATCH_SIZE = 500  # Matched listings inserted per statement
+    RENAISS_BUY_FEE_PERCENT = float(os.getenv("RENAISS_BUY_FEE_PERCENT", "0"))
+    RENAISS_SELL_FEE_PERCENT = float(os.getenv("RENAISS_SELL_FEE_PERCENT", "0"))
+
+    # --- Alert Configuration ---
+    ALERT_MAX_OPPORTUNITIES_PER_MESSAGE = 5
+    ALERT_DEFAULT_THRESHOLD_PERCENT = 5.0  # New users' threshold, also the /arbitrage default and the near-threshold baseline
+    ALERT_MIN_THRESHOLD_PERCENT = 1.0
+    ALERT_MAX_THRESHOLD_PERCENT = 500.0
+    ALERT_DEDUP_WINDOW_SECONDS = 7 * 24 * 3600  # An unchanged opportunity is alerted again after this long
+    ALERT_DEDUP_MAX_CARDS = 100_000  # Cards remembered for deduplication, least recently alerted dropped first
+
+    # --- Price History Configuration ---
+    PRICE_ROLLUP_INTERVAL_SECONDS = 900  # 15 minutes
+    PRICE_ROLLUP_BATCH_SIZE = 500
+    PRICE_TICK_RETENTION_DAYS = 7  # Raw ticks kept after they are rolled up
+    PRICE_HOURLY_RETENTION_DAYS = 90  # Daily buckets are kept forever
+    COMPARE_HISTORY_DAYS = 30  # Daily price history shown when comparing cards
+    COMPARE_MAX_CARDS = 5  # Cards looked up per comparison
 
 # Instantiate config
 config = Config()
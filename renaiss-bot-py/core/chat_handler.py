@@ -1,69 +1,174 @@
 
+from typing import Optional
 from telegram import Update
 from telegram.ext import ContextTypes
-from adapters.llm_adapter import LLMAdapter
+from adapters.llm_adapter import LLMAdapter, llm_gate
+from core.intent_router import IntentRouter
+from core.outbound_queue import outbound
+from core.prompt_builder import PromptBuilder
+from core.streaming_reply import StreamingReply
 from services.card_info_service import CardInfoService
 from services.arbitrage_service import ArbitrageService
+from services.card_search_index import strip_grade
+from services.conversation_memory import conversation_memory
+from services.media_service import media_service
+from services.cross_market_service import cross_market
+from services.price_stats import price_stats
 from config import config
+from utils.cache import TTLCache
+from utils.metrics import metrics
+from utils.rate_limit import KeyedRateLimiter, Overloaded, deadline
+from utils.tracing import span
 from utils.logger import logger
 
+CHAT_ADMISSION = metrics.counter("chat_admission_total", "Chat messages by how admission control handled them.", ["result"])
+
+_RATE_LIMITED_TEXT = "慢点慢点，小R的脑子转不过来啦！🥵 歇几秒再发吧~"
+_BUSY_TEXT = "哎呀，现在找小R聊天的人太多了，排不上号... 😵‍💫 过一会儿再来问我吧！"
+
+def _price(value) -> str:
+    return "-" if value is None else f"${value:g}"
+
+def template_reply(action_data: dict) -> Optional[str]:
+    """Renders fetched data as a fixed Markdown reply, for when the LLM is too busy to write one."""
+    card_info = action_data.get("card_info")
+    if card_info:
+        return (
+            f"*{card_info['name']} ({card_info['grade']})*\n"
+            f"- 售价: {_price(card_info['ask_price'])}\n"
+            f"- FMV: {_price(card_info['fmv_price'])}\n"
+            f"- 最高出价: {_price(card_info['offer_price'])}\n"
+            f"- [直达链接]({card_info['link']})\n\n"
+            "（现在人有点多，小R先把数据甩给你 📋）"
+        )
+    found = [card for card in action_data.get("cards", []) if card]
+    if found:
+        lines = [f"- *{card['name']} ({card['grade']})*: 售价 {_price(card['ask_price'])} / FMV {_price(card['fmv_price'])}"
+                 for card in found]
+        return "📊 *卡牌对比*\n" + "\n".join(lines) + "\n\n（现在人有点多，小R先把数据甩给你 📋）"
+    opportunities = (action_data.get("opportunities", []) + action_data.get("cross_platform_opportunities", [])
+                     + action_data.get("signal_opportunities", []))
+    if opportunities:
+        lines = [f"- {opp['card_name']} ({opp['grade']}): 利润 {_price(opp['profit_usd'])} ({opp['profit_percent']}%)"
+                 for opp in opportunities]
+        return "🔥 *当前套利机会*\n" + "\n".join(lines) + "\n\n（现在人有点多，详情请用 /arbitrage 查看 📋）"
+    return None
+
 class ChatHandler:
     """Handles all non-command text messages for natural language interaction."""
 
     def __init__(self):
         self.llm = LLMAdapter()
+        self.intent_router = IntentRouter(self.llm)
         self.card_service = CardInfoService()
         self.arbitrage_service = ArbitrageService()
+        self.prompt_builder = PromptBuilder()
+        self.rate_limiter = KeyedRateLimiter(config.CHAT_USER_RATE, config.CHAT_USER_BURST, config.CHAT_RATE_LIMIT_USERS)
+        # Users already told to slow down; they are not told again until the entry expires
+        self._warned = TTLCache(maxsize=config.CHAT_RATE_LIMIT_USERS, ttl_seconds=config.CHAT_USER_BURST / config.CHAT_USER_RATE)
 
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Main entry point for handling user messages."""
+        """
+        Main entry point for handling user messages.
+
+        Admission control runs first: a user over their rate limit gets one
+        short notice, and a message that cannot get an LLM slot before its
+        deadline gets a canned or templated reply instead of waiting.
+        """
         user_message = update.message.text
-        logger.info(f"Received message from user {update.effective_user.id}: {user_message}")
+        user_id = str(update.effective_user.id)
+        logger.debug(f"Received message from user {user_id}: {user_message}")
+        if not self.rate_limiter.allow(user_id):
+            CHAT_ADMISSION.inc(result="rate_limited")
+            if self._warned.get(user_id) is None:
+                self._warned.set(user_id, True)
+                await outbound.reply(update, _RATE_LIMITED_TEXT)
+            return
+
+        action_data: dict = {}
+        try:
+            with deadline(config.CHAT_DEADLINE_SECONDS):
+                await self._respond(update, user_id, user_message, action_data)
+        except Overloaded as e:
+            CHAT_ADMISSION.inc(result="shed")
+            logger.warning(f"Shed message from user {user_id}: {e}")
+            await outbound.reply(update, template_reply(action_data) or _BUSY_TEXT, parse_mode='Markdown',
+                                 disable_web_page_preview=True)
+
+    async def _respond(self, update: Update, user_id: str, user_message: str, action_data: dict):
+        """Runs the chat pipeline; action_data is filled in as soon as it is fetched."""
+        conversation = await conversation_memory.get(user_id)
 
         # 1. Parse Intent
-        intent_data = await self.llm.parse_intent(user_message)
+        with span("intent"):
+            intent_data = await self.intent_router.parse_intent(user_message, last_card=conversation.last_card)
         intent = intent_data.get("intent", "general_chat")
         entities = intent_data.get("entities", [])
 
         # 2. Execute Action based on Intent
-        action_data = await self._execute_action(intent, entities)
+        with span("action"):
+            action_data.update(await self._execute_action(intent, entities))
 
         # 3. Generate Response
-        response_text = await self._generate_response(user_message, intent, action_data)
-        
-        await update.message.reply_text(response_text, parse_mode='Markdown')
+        card_info = action_data.get("card_info")
+        if card_info:
+            # Queued before the reply, so the photo arrives first while the LLM is still writing
+            await media_service.send_card_photo(update.effective_chat.id, card_info,
+                                                caption=f"{card_info['name']} ({card_info['grade']})")
+        with span("response"):
+            system_prompt, user_prompt, history = self.prompt_builder.build(
+                user_message, intent, action_data, conversation.turns)
+            templated = template_reply(action_data) if llm_gate.waiting >= config.CHAT_DEGRADE_QUEUE_DEPTH else None
+            if templated:
+                # The LLM queue is deep: answer data questions directly rather than add to it
+                CHAT_ADMISSION.inc(result="degraded")
+                response_text = templated
+                await outbound.reply(update, response_text, parse_mode='Markdown', disable_web_page_preview=True)
+            elif config.LLM_STREAMING:
+                placeholder = await outbound.reply(update, "小R正在组织语言... ✍️", mergeable=False)
+                reply = StreamingReply(placeholder)
+                try:
+                    async for chunk in self.llm.stream_response(system_prompt, user_prompt, history):
+                        await reply.push(chunk)
+                except Overloaded:
+                    # The placeholder is already out, so the fallback replaces it rather than following it
+                    CHAT_ADMISSION.inc(result="shed")
+                    await reply.push(template_reply(action_data) or _BUSY_TEXT)
+                    await reply.finish()
+                    return
+                response_text = await reply.finish()
+            else:
+                response_text = await self.llm.generate_response(system_prompt, user_prompt, history)
+                await outbound.reply(update, response_text, parse_mode='Markdown')
+
+        # Remember the card in the user's own words, so a follow-up in another grade searches as broadly
+        card_name = strip_grade(action_data["card_name"]).strip() if action_data.get("card_info") else None
+        await conversation_memory.append(user_id, user_message, response_text, card_name=card_name)
+        if not templated:
+            CHAT_ADMISSION.inc(result="admitted")
 
     async def _execute_action(self, intent: str, entities: list) -> dict:
         """Executes the corresponding service based on the parsed intent."""
-        if intent == "query_card" and entities:
+        if intent == "query_card" and len(entities) == 1:
             card_info = await self.card_service.get_card_info_by_name(entities[0])
+            if card_info:
+                card_info["stats"] = price_stats.describe(card_info["card_id"])
             return {"card_info": card_info, "card_name": entities[0]}
-        
+
+        if intent in ("query_card", "compare_cards") and entities:
+            names = list(dict.fromkeys(entities))[:config.COMPARE_MAX_CARDS]
+            cards = await self.card_service.get_cards_by_names(names)
+            for card in cards:
+                if card:
+                    card["stats"] = price_stats.describe(card["card_id"])
+            return {"cards": cards, "card_names": names}
+
         if intent == "find_arbitrage":
-            opportunities = await self.arbitrage_service.find_opportunities()
-            return {"opportunities": opportunities[:3]} # Return top 3
+            opportunities = await self.arbitrage_service.find_opportunities(limit=3) # Return top 3
+            cross_platform = await cross_market.find_opportunities(limit=3)
+            signals = await self.arbitrage_service.find_signal_opportunities(limit=3)
+            return {"opportunities": opportunities, "cross_platform_opportunities": cross_platform,
+                    "signal_opportunities": signals}
 
-        # For compare_cards and general_chat, we might not need to fetch data beforehand
+        # For general_chat, we don't need to fetch data beforehand
         return {}
-
-    async def _generate_response(self, user_message: str, intent: str, data: dict) -> str:
-        """Generates a fun and informative response using the LLM."""
-        system_prompt = config.BOT_PERSONALITY
-        
-        # Craft a detailed prompt for the LLM
-        user_prompt = f"""
-        You are responding to a user in a Telegram chat. Here is the context:
-
-        User's original message: "{user_message}"
-        Your analysis of their intent: {intent}
-        Data you fetched from the database: {data}
-
-        Based on this, craft a fun, engaging, and helpful response in character as '小R'.
-        - If you have card data, format it nicely using Markdown.
-        - If you found arbitrage opportunities, present them clearly.
-        - If you don't have specific data, just have a fun, on-brand conversation.
-        - Always be helpful and embody your personality traits.
-        - Keep it concise and use emojis! 😜
-        """
-        
-        return await self.llm.generate_response(system_prompt, user_prompt)
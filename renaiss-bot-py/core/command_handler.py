@@ -1,8 +1,99 @@
+import base64
+import struct
+from typing import Any, Dict, List, Optional, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 from config import config
+from core.outbound_queue import outbound
+from services.media_service import media_service
+from services.user_service import UserService
 from utils.logger import logger
 
+# Callback data of the /arbitrage page buttons: "arb|<n or p>|<cursor>|<filters>".
+# Everything needed to fetch the page is in the button itself, so a click works
+# on any instance and after restarts.
+ARBITRAGE_CALLBACK_PREFIX = "arb|"
+_CURSOR = struct.Struct("<dI")  # Exact profit_percent and card id of the boundary row
+_FILTER_KEYS = {"grade": "grade", "评级": "grade", "price": "price", "价格": "price", "usd": "usd", "利润": "usd"}
+_ARBITRAGE_USAGE = (
+    "用法：`/arbitrage [最低利润率] [grade=PSA10] [price=100-500] [usd=50]`\n"
+    "例如 `/arbitrage 10 grade=PSA10 price=-300` 表示利润率 ≥ 10%、PSA 10、售价不超过 $300。"
+)
+
+def parse_arbitrage_args(args: List[str]) -> Dict[str, Any]:
+    """Parses `/arbitrage` arguments into find_opportunities_page keyword arguments. Raises ValueError."""
+    filters: Dict[str, Any] = {"min_profit_percent": config.ALERT_DEFAULT_THRESHOLD_PERCENT}
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if not value:
+            filters["min_profit_percent"] = float(arg.rstrip("%"))
+            continue
+        key = _FILTER_KEYS.get(key.lower())
+        if key == "grade":
+            filters["grade"] = value
+        elif key == "price":
+            low, _, high = value.partition("-")
+            filters["min_price"] = float(low.lstrip("$")) if low else None
+            filters["max_price"] = float(high.lstrip("$")) if high else None
+        elif key == "usd":
+            filters["min_profit_usd"] = float(value.lstrip("$"))
+        else:
+            raise ValueError(f"Unknown filter '{arg}'")
+    return filters
+
+def _number(value: Optional[float]) -> str:
+    if value is None:
+        return ""
+    short = f"{value:.15g}"
+    return short if float(short) == value else repr(value)
+
+def pack_page_data(backward: bool, cursor: Tuple[float, int], filters: Dict[str, Any]) -> str:
+    """Encodes a page request into button callback data. Raises ValueError past Telegram's 64-byte limit."""
+    packed = base64.urlsafe_b64encode(_CURSOR.pack(*cursor)).decode().rstrip("=")
+    fields = ",".join([_number(filters.get("min_profit_percent")), filters.get("grade") or "",
+                       _number(filters.get("min_price")), _number(filters.get("max_price")),
+                       _number(filters.get("min_profit_usd"))])
+    data = f"{ARBITRAGE_CALLBACK_PREFIX}{'p' if backward else 'n'}|{packed}|{fields}"
+    if len(data.encode("utf-8")) > 64:
+        raise ValueError("Filters too long for callback data")
+    return data
+
+def unpack_page_data(data: str) -> Tuple[bool, Tuple[float, int], Dict[str, Any]]:
+    """Decodes pack_page_data output. Raises ValueError on malformed data."""
+    try:
+        _, direction, packed, fields = data.split("|")
+        cursor = _CURSOR.unpack(base64.urlsafe_b64decode(packed + "=" * (-len(packed) % 4)))
+        min_profit, grade, min_price, max_price, min_usd = fields.split(",")
+    except (ValueError, struct.error) as e:
+        raise ValueError(f"Malformed arbitrage page data '{data}'") from e
+    number = lambda value: float(value) if value else None
+    filters = {"min_profit_percent": float(min_profit), "grade": grade or None, "min_price": number(min_price),
+               "max_price": number(max_price), "min_profit_usd": number(min_usd)}
+    return direction == "p", cursor, filters
+
+def format_arbitrage_page(page: Dict[str, Any], filters: Dict[str, Any]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Renders one /arbitrage page and its previous / next buttons."""
+    first = page["offset"] + 1
+    last = page["offset"] + len(page["opportunities"])
+    response = f"🎉 发现宝贝了！利润率 ≥ {filters['min_profit_percent']:g}% 的机会，第 {first}–{last} 个 / 共 {page['total']} 个：\n\n"
+    for index, opp in enumerate(page["opportunities"], start=first):
+        response += (
+            f"{index}. **{opp['card_name']} ({opp['grade']})**\n"
+            f"- 售价: *${opp['ask_price']}*\n"
+            f"- FMV: *${opp['fmv_price']}*\n"
+            f"- **潜在利润: ${opp['profit_usd']} ({opp['profit_percent']}%)** 🔥\n"
+            f"- [直达链接]({opp['link']})\n\n"
+        )
+    response += "记住，市场价瞬息万变，下手要快哦！祝你发财！💰"
+
+    buttons = []
+    if page["prev_cursor"] is not None:
+        buttons.append(InlineKeyboardButton("⬅️ 上一页", callback_data=pack_page_data(True, page["prev_cursor"], filters)))
+    if page["next_cursor"] is not None:
+        buttons.append(InlineKeyboardButton("下一页 ➡️", callback_data=pack_page_data(False, page["next_cursor"], filters)))
+    return response, InlineKeyboardMarkup([buttons]) if buttons else None
+
 class CommandHandler:
     """Handles all slash commands for the bot."""
 
@@ -18,7 +109,8 @@ class CommandHandler:
             f"- `给我找找套利机会`\n\n"
             f"或者使用下面的命令来调戏我：\n"
             f"/help - 查看所有命令\n"
-            f"/arbitrage - 主动寻找套利机会\n\n"
+            f"/arbitrage - 主动寻找套利机会\n"
+            f"/subscribe - 订阅套利提醒\n\n"
             f"准备好进入卡牌的奇妙世界了吗？🚀"
         )
         
@@ -29,7 +121,7 @@ class CommandHandler:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
+        await outbound.reply(update, welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
 
     async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handler for the /help command."""
@@ -44,37 +136,125 @@ class CommandHandler:
             f"**命令列表**\n"
             f"/start - 重新认识一下我\n"
             f"/help - 就是你现在看到的这个啦\n"
-            f"/arbitrage - 主动帮你寻找当前市场上的套利机会\n\n"
+            f"/arbitrage - 主动帮你寻找当前市场上的套利机会\n"
+            f"/subscribe - 订阅套利提醒（`/subscribe off` 取消）\n"
+            f"/threshold - 设置提醒的最低利润率，比如 `/threshold 10`\n\n"
             f"**重要链接**\n"
             f"- [作者推特]({config.AUTHOR_URL})\n"
             f"- [官方推特]({config.OFFICIAL_TWITTER_URL})\n"
             f"- [官方Discord]({config.OFFICIAL_DISCORD_URL})\n\n"
             f"有任何问题，随时找我！我24小时在线（除非我在偷偷打牌...）🃏"
         )
-        await update.message.reply_text(help_text, parse_mode='Markdown', disable_web_page_preview=True)
+        await outbound.reply(update, help_text, parse_mode='Markdown', disable_web_page_preview=True)
 
     async def arbitrage(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handler for the /arbitrage command."""
+        """Handler for the /arbitrage command, e.g. `/arbitrage 10 grade=PSA10 price=100-500 usd=50`."""
         from services.arbitrage_service import ArbitrageService # Avoid circular import
+        from services.cross_market_service import cross_market
         logger.info(f"User {update.effective_user.id} triggered /arbitrage command.")
-        await update.message.reply_text("好的，财迷！我这就去帮你扒一扒市场上有没有漏可以捡... 🕵️‍♂️ 请稍等！")
-        
+        try:
+            filters = parse_arbitrage_args(context.args or [])
+            pack_page_data(False, (0.0, 0), filters)  # Reject filters that would not fit in the page buttons
+        except ValueError:
+            await outbound.reply(update, _ARBITRAGE_USAGE, parse_mode='Markdown')
+            return
+        await outbound.reply(update, "好的，财迷！我这就去帮你扒一扒市场上有没有漏可以捡... 🕵️‍♂️ 请稍等！")
+
         arbitrage_service = ArbitrageService()
-        opportunities = await arbitrage_service.find_opportunities()
-        
-        if not opportunities:
-            await update.message.reply_text("唉，今天市场风平浪静，没啥油水可捞。下次再试试吧！🤷‍♂️")
+        page = await arbitrage_service.find_opportunities_page(**filters)
+        cross_platform = await cross_market.find_opportunities(limit=3)
+        signals = await arbitrage_service.find_signal_opportunities(limit=3)
+
+        if not page["opportunities"] and not cross_platform and not signals:
+            await outbound.reply(update, "唉，今天市场风平浪静，没啥油水可捞。下次再试试吧！🤷‍♂️")
             return
 
-        response = "🎉 发现宝贝了！快看这些潜在的套利机会：\n\n"
-        for opp in opportunities[:5]: # Show top 5
+        await media_service.send_gallery(update.effective_chat.id, page["opportunities"] + cross_platform + signals)
+        if page["opportunities"]:
+            response, reply_markup = format_arbitrage_page(page, filters)
+            # Its own message, since the page buttons edit it in place
+            await outbound.reply(update, response, parse_mode='Markdown', mergeable=False,
+                                 disable_web_page_preview=True, reply_markup=reply_markup)
+        response = ""
+        if cross_platform:
+            response += "🔀 **跨平台搬砖机会**\n\n"
+        for opp in cross_platform:
+            response += (
+                f"**{opp['card_name']} ({opp['grade']})**\n"
+                f"- 在 {opp['buy_source']} 买入: *${opp['buy_price']}* ([链接]({opp['buy_link']}))\n"
+                f"- 在 {opp['sell_source']} 卖出: *${opp['sell_price']}*\n"
+                f"- **扣除手续费后利润: ${opp['profit_usd']} ({opp['profit_percent']}%)** 🔥\n\n"
+            )
+        if signals:
+            response += "📉 **价格统计信号**\n\n"
+        for opp in signals:
+            reference = (f"{config.PRICE_STATS_WINDOW_DAYS} 天中位数" if opp["type"] == "Below Median" else "最高出价")
             response += (
                 f"**{opp['card_name']} ({opp['grade']})**\n"
-                f"- 售价: *${opp['ask_price']}*\n"
-                f"- FMV: *${opp['fmv_price']}*\n"
-                f"- **潜在利润: ${opp['profit_usd']} ({opp['profit_percent']}%)** 🔥\n"
+                f"- 售价: *${opp['ask_price']}*，{reference}: *${opp['reference_price']}*\n"
+                f"- **低了 ${opp['profit_usd']} ({opp['profit_percent']}%)** 🔥\n"
                 f"- [直达链接]({opp['link']})\n\n"
             )
-        
-        response += "记住，市场价瞬息万变，下手要快哦！祝你发财！💰"
-        await update.message.reply_text(response, parse_mode='Markdown', disable_web_page_preview=True)
+        if response:
+            await outbound.reply(update, response, parse_mode='Markdown', disable_web_page_preview=True)
+
+    async def arbitrage_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler for the previous / next buttons under /arbitrage results: fetches and shows one page."""
+        from services.arbitrage_service import ArbitrageService # Avoid circular import
+        query = update.callback_query
+        try:
+            backward, cursor, filters = unpack_page_data(query.data)
+        except ValueError as e:
+            logger.warning(str(e))
+            await query.answer()
+            return
+
+        page = await ArbitrageService().find_opportunities_page(cursor=cursor, backward=backward, **filters)
+        if not page["opportunities"]:
+            await query.answer("没有更多了，行情可能刚刚更新过～")
+            return
+        await query.answer()
+        response, reply_markup = format_arbitrage_page(page, filters)
+        try:
+            await query.edit_message_text(response, parse_mode='Markdown', disable_web_page_preview=True,
+                                          reply_markup=reply_markup)
+        except TelegramError as e:
+            logger.error(f"Error showing arbitrage page for user {update.effective_user.id}: {e}")
+
+    async def subscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler for the /subscribe command. `/subscribe off` turns alerts off."""
+        user = update.effective_user
+        subscribed = not (context.args and context.args[0].lower() in ("off", "stop", "0", "关闭", "取消"))
+        logger.info(f"User {user.id} set alert subscription to {subscribed}.")
+
+        db_user = await UserService().set_subscription(str(user.id), subscribed, user.username)
+        if subscribed:
+            await outbound.reply(
+                update,
+                f"订阅成功！🔔 一旦发现利润率 ≥ *{db_user.threshold_percent}%* 的新套利机会，我会第一时间通知你。\n"
+                f"想调整门槛？试试 `/threshold 10`",
+                parse_mode='Markdown'
+            )
+        else:
+            await outbound.reply(update, "好的，已经帮你关掉套利提醒啦。想回来随时发 /subscribe 👋")
+
+    async def threshold(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler for the /threshold command, e.g. `/threshold 10`."""
+        user = update.effective_user
+        try:
+            value = float(context.args[0].rstrip("%"))
+        except (IndexError, ValueError):
+            await outbound.reply(update, "用法：`/threshold 10`，表示利润率 ≥ 10% 才提醒你。", parse_mode='Markdown')
+            return
+
+        if not config.ALERT_MIN_THRESHOLD_PERCENT <= value <= config.ALERT_MAX_THRESHOLD_PERCENT:
+            await outbound.reply(
+                update,
+                f"门槛需要在 {config.ALERT_MIN_THRESHOLD_PERCENT}% 到 {config.ALERT_MAX_THRESHOLD_PERCENT}% 之间哦～"
+            )
+            return
+
+        logger.info(f"User {user.id} set alert threshold to {value}%.")
+        db_user = await UserService().set_threshold(str(user.id), value, user.username)
+        hint = "" if db_user.is_subscribed else "\n（你还没订阅提醒，发送 /subscribe 开启）"
+        await outbound.reply(update, f"搞定！以后只提醒你利润率 ≥ *{value}%* 的机会 💰{hint}", parse_mode='Markdown')
@@ -0,0 +1,129 @@
+
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+from adapters.llm_adapter import LLMAdapter
+from services.card_aliases import CARD_ALIASES
+from services.card_search_index import normalize
+from config import config
+from utils.cache import TTLCache
+from utils.logger import logger
+
+_ARBITRAGE_KEYWORDS = ("套利", "捡漏", "撿漏", "油水", "赚钱机会", "賺錢機會", "arbitrage", "有没有漏")
+_HELP_KEYWORDS = ("帮助", "幫助", "怎么用", "怎麼用", "使用说明", "你能做什么", "你会什么", "help", "指令", "命令")
+_PRICE_KEYWORDS = ("多少钱", "多少錢", "啥价", "啥價", "什么价", "价格", "價格", "报价", "行情", "查询", "查一下",
+                   "查查", "值多少", "price", "how much")
+_COMPARE_KEYWORDS = ("哪个", "哪個", "对比", "對比", "比较", "比較", "相比", " vs ", "还是")
+# Questions about concepts rather than actions are left to the LLM
+_CONCEPT_KEYWORDS = ("是什么", "什么意思", "是啥", "为什么", "為什麼", "原理")
+# No leading \b: CJK characters count as word characters, so "那PSA9呢" has no boundary before "PSA"
+_GRADE_PATTERN = re.compile(r"(?<![a-z])(psa|bgs|cgc|sgc)\s*(\d{1,2}(?:\.5)?)(?!\d)", re.IGNORECASE)
+_FOLLOW_UP_MAX_LENGTH = 24  # "那PSA9呢？" style follow-ups are short; longer messages get full classification
+
+# Every known card name (canonical and aliases), longest first so "月亮伊布" wins over "伊布"
+_CARD_NAMES: List[str] = sorted(
+    {name.lower() for canonical, aliases in CARD_ALIASES.items() for name in (canonical, *aliases)},
+    key=len,
+    reverse=True,
+)
+
+class IntentRouter:
+    """
+    Tiered intent pipeline in front of LLMAdapter.parse_intent.
+
+    Tier one is a local keyword and card-name matcher for the obvious messages,
+    tier two is an LRU+TTL cache keyed by the normalized message, and only what
+    is left goes to the LLM.
+    """
+
+    def __init__(self, llm: Optional[LLMAdapter] = None):
+        self.llm = llm or LLMAdapter()
+        self.cache = TTLCache(maxsize=config.INTENT_CACHE_SIZE, ttl_seconds=config.INTENT_CACHE_TTL_SECONDS)
+        self.stats = Counter()
+
+    async def parse_intent(self, user_message: str, last_card: Optional[str] = None) -> dict:
+        """
+        Returns {"intent": ..., "entities": [...]}, using the cheapest tier that can answer.
+
+        last_card is the card the conversation was last about, so a follow-up
+        such as "那PSA9呢？" resolves to that card in the new grade.
+        """
+        self.stats["total"] += 1
+        try:
+            return await self._resolve(user_message, last_card)
+        finally:
+            # Reported whichever tier answered, so fast-path hits do not skip the report
+            if self.stats["total"] % config.INTENT_STATS_LOG_EVERY == 0:
+                logger.info(f"Intent tier hit rates: {self.hit_rates()}")
+
+    async def _resolve(self, user_message: str, last_card: Optional[str]) -> dict:
+        intent_data = self.resolve_follow_up(user_message, last_card) or self.classify_locally(user_message)
+        if intent_data:
+            self.stats["rules"] += 1
+            logger.debug(f"Intent resolved by rules: {intent_data}")
+            return intent_data
+
+        key = normalize(user_message)
+        intent_data = self.cache.get(key)
+        if intent_data:
+            self.stats["cache"] += 1
+            logger.debug(f"Intent resolved by cache: {intent_data}")
+            return intent_data
+
+        self.stats["llm"] += 1
+        intent_data = await self.llm.parse_intent(user_message)
+        if not intent_data.get("error"):
+            self.cache.set(key, intent_data)
+        return intent_data
+
+    def hit_rates(self) -> Dict[str, float]:
+        """Returns the share of messages resolved by each tier."""
+        total = self.stats["total"] or 1
+        return {tier: round(self.stats[tier] / total, 3) for tier in ("rules", "cache", "llm")}
+
+    def resolve_follow_up(self, user_message: str, last_card: Optional[str]) -> Optional[dict]:
+        """Turns a short grade-only question about the previous card into a query_card intent."""
+        text = f" {(user_message or '').lower().strip()} "
+        grade = _GRADE_PATTERN.search(text)
+        if not last_card or not grade or len(text) > _FOLLOW_UP_MAX_LENGTH or self._find_card_names(text):
+            return None
+        return {"intent": "query_card", "entities": [f"{last_card} {grade.group(1).upper()} {grade.group(2)}"]}
+
+    def classify_locally(self, user_message: str) -> Optional[dict]:
+        """Resolves common query_card / compare_cards / find_arbitrage / ask_help messages without the LLM."""
+        text = f" {(user_message or '').lower().strip()} "
+        if any(keyword in text for keyword in _CONCEPT_KEYWORDS):
+            return None
+
+        cards = self._find_card_names(text)
+        if cards:
+            grade = _GRADE_PATTERN.search(text)
+            if grade:
+                cards = [f"{card} {grade.group(1).upper()} {grade.group(2)}" for card in cards]
+            if len(cards) >= 2 and any(keyword in text for keyword in _COMPARE_KEYWORDS):
+                return {"intent": "compare_cards", "entities": cards}
+            if any(keyword in text for keyword in _PRICE_KEYWORDS):
+                return {"intent": "query_card", "entities": cards}
+            return None
+
+        if any(keyword in text for keyword in _ARBITRAGE_KEYWORDS):
+            return {"intent": "find_arbitrage", "entities": []}
+        if any(keyword in text for keyword in _HELP_KEYWORDS):
+            return {"intent": "ask_help", "entities": []}
+        return None
+
+    def _find_card_names(self, text: str) -> List[str]:
+        """Returns the known card names in the message, in order of appearance, without overlaps."""
+        found, taken = [], []
+        for name in _CARD_NAMES:
+            start = text.find(name)
+            while start != -1:
+                end = start + len(name)
+                # ASCII names must match whole words ("ace" is not a card in "space")
+                bounded = not name.isascii() or (not text[start - 1].isalnum() and not text[end:end + 1].isalnum())
+                if bounded and all(end <= s or start >= e for s, e in taken):
+                    taken.append((start, end))
+                    found.append((start, name))
+                    break
+                start = text.find(name, start + 1)
+        return [name for _, name in sorted(found)]
@@ -0,0 +1,284 @@
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set
+from telegram import Bot, Message
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from core.streaming_reply import TELEGRAM_MAX_MESSAGE_LENGTH, retry_after_seconds
+from config import config
+from utils.cache import TTLCache
+from utils.metrics import metrics
+from utils.rate_limit import TokenBucket
+from utils.logger import logger
+
+# Priority lanes, lowest value first
+INTERACTIVE = 0
+ALERT = 1
+_LANES = ("interactive", "alert")
+
+OUTBOUND_SENT = metrics.counter("outbound_sent_total", "Telegram sends made by the outbound queue.", ["lane"])
+OUTBOUND_MERGED = metrics.counter("outbound_merged_total", "Queued messages folded into an earlier send to the same chat.", ["lane"])
+OUTBOUND_RETRIES = metrics.counter("outbound_retries_total", "Sends retried by the outbound queue.", ["reason"])
+OUTBOUND_FAILED = metrics.counter("outbound_failed_total", "Queued messages that could not be delivered.", ["reason"])
+OUTBOUND_QUEUED = metrics.gauge("outbound_queued", "Messages waiting in the outbound queue.", ["lane"])
+OUTBOUND_WAIT_SECONDS = metrics.histogram("outbound_wait_seconds", "Time from enqueue to delivery.", ["lane"])
+
+class OutboundMessage:
+    """
+    One queued Bot API send and the future its caller awaits.
+
+    `method` is a Bot send method; for media sends `text` is the caption.
+    """
+
+    __slots__ = ("chat_id", "method", "text", "parse_mode", "options", "priority", "mergeable", "future",
+                 "attempts", "queued_at")
+
+    def __init__(self, chat_id: int, method: str, text: str, parse_mode: Optional[str], options: Dict[str, Any],
+                 priority: int, mergeable: bool):
+        self.chat_id = chat_id
+        self.method = method
+        self.text = text
+        self.parse_mode = parse_mode
+        self.options = options
+        self.priority = priority
+        self.mergeable = mergeable
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+
+    def can_merge(self, other: "OutboundMessage") -> bool:
+        return (self.method == other.method == "send_message" and self.mergeable and other.mergeable
+                and self.parse_mode == other.parse_mode
+                and self.options == other.options and "reply_markup" not in self.options)
+
+class OutboundQueue:
+    """
+    Central dispatcher for every outgoing Telegram message.
+
+    Sends respect a global token bucket and one bucket per chat, sized to
+    Telegram's documented limits. Interactive replies are always picked
+    before alerts, messages for one chat go out in order, RetryAfter pauses
+    only the chat that hit it, and messages waiting for the same chat are
+    merged into one send when they fit.
+    """
+
+    def __init__(self):
+        self.bot: Optional[Bot] = None
+        # chat_id -> one deque per lane
+        self._pending: Dict[int, List[Deque[OutboundMessage]]] = {}
+        # Per lane, chats with pending messages in round-robin order
+        self._ready: List["OrderedDict[int, None]"] = [OrderedDict() for _ in _LANES]
+        self._busy: Set[int] = set()
+        self._blocked_until: Dict[int, float] = {}
+        self._global = TokenBucket(config.OUTBOUND_GLOBAL_RATE, config.OUTBOUND_GLOBAL_RATE)
+        # Idle chats fall out after a minute; a fresh bucket starts full, which is what an idle chat has anyway
+        self._chat_buckets = TTLCache(maxsize=config.OUTBOUND_CHAT_BUCKETS, ttl_seconds=60)
+        self._in_flight = asyncio.Semaphore(config.OUTBOUND_MAX_IN_FLIGHT)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sends: Set[asyncio.Task] = set()
+
+    def start(self, bot: Bot):
+        """Starts the dispatch loop. Must be called from the running event loop."""
+        self.bot = bot
+        self._task = asyncio.create_task(self._run())
+        logger.info("Outbound send queue started.")
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Waits up to `timeout` seconds for queued messages to go out, then stops."""
+        deadline = time.monotonic() + (config.OUTBOUND_DRAIN_TIMEOUT_SECONDS if timeout is None else timeout)
+        while (self._pending or self._sends) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for chat_id in list(self._pending):
+            self._fail_chat(chat_id, RuntimeError("Outbound queue stopped"), "shutdown")
+        logger.info("Outbound send queue stopped.")
+
+    def enqueue(self, chat_id: int, text: str, priority: int = INTERACTIVE, parse_mode: Optional[str] = None,
+                mergeable: bool = True, method: str = "send_message", **options) -> asyncio.Future:
+        """
+        Queues a message and returns a future for the sent Message.
+
+        Pass mergeable=False when the caller needs its own message, e.g. to edit it later.
+        `method` selects another Bot send method, such as send_photo with the
+        text as caption; only plain send_message calls are ever merged.
+        Extra keyword arguments are passed to the Bot method.
+        """
+        if self._task is None:
+            raise RuntimeError("Outbound queue is not running")
+        message = OutboundMessage(int(chat_id), method, text, parse_mode, options, priority, mergeable)
+        lanes = self._pending.setdefault(message.chat_id, [deque() for _ in _LANES])
+        lanes[priority].append(message)
+        self._ready[priority][message.chat_id] = None
+        OUTBOUND_QUEUED.inc(1, lane=_LANES[priority])
+        self._wakeup.set()
+        return message.future
+
+    async def send(self, chat_id: int, text: str, priority: int = INTERACTIVE, parse_mode: Optional[str] = None,
+                   mergeable: bool = True, **options) -> Message:
+        """Queues a message and waits until it is sent. Raises the TelegramError of a failed send."""
+        return await self.enqueue(chat_id, text, priority, parse_mode, mergeable, **options)
+
+    async def reply(self, update, text: str, parse_mode: Optional[str] = None, mergeable: bool = True,
+                    **options) -> Message:
+        """Sends an interactive reply to the chat an update came from."""
+        return await self.send(update.effective_chat.id, text, INTERACTIVE, parse_mode, mergeable, **options)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Negative ids are groups and channels, which Telegram holds to 20 messages a minute
+            rate = config.OUTBOUND_GROUP_RATE if chat_id < 0 else config.OUTBOUND_CHAT_RATE
+            bucket = TokenBucket(rate, config.OUTBOUND_CHAT_BURST)
+        self._chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    def _pick(self, now: float):
+        """Returns (chat_id, lane) of the next sendable chat, or (None, seconds to wait)."""
+        wait = 1.0
+        for lane, ready in enumerate(self._ready):
+            for chat_id in ready:
+                if chat_id in self._busy:
+                    continue
+                blocked = self._blocked_until.get(chat_id, 0.0) - now
+                delay = max(blocked, self._bucket(chat_id).delay(now))
+                if delay <= 0:
+                    return chat_id, lane
+                wait = min(wait, delay)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            chat_id, lane_or_wait = self._pick(now)
+            if chat_id is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=lane_or_wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+            await self._in_flight.acquire()
+            self._global.take()
+            self._bucket(chat_id).take()
+            batch = self._take_batch(chat_id, lane_or_wait)
+            self._busy.add(chat_id)
+            task = asyncio.create_task(self._deliver(chat_id, batch))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    def _take_batch(self, chat_id: int, lane: int) -> List[OutboundMessage]:
+        """Pops the head message of a chat's lane plus any following messages it can merge with."""
+        queue = self._pending[chat_id][lane]
+        batch = [queue.popleft()]
+        length = len(batch[0].text)
+        while queue and batch[0].can_merge(queue[0]) and length + 2 + len(queue[0].text) <= TELEGRAM_MAX_MESSAGE_LENGTH:
+            length += 2 + len(queue[0].text)
+            batch.append(queue.popleft())
+        OUTBOUND_QUEUED.inc(-len(batch), lane=_LANES[lane])
+        if len(batch) > 1:
+            OUTBOUND_MERGED.inc(len(batch) - 1, lane=_LANES[lane])
+        self._ready[lane].pop(chat_id, None)
+        self._refresh_ready(chat_id)
+        return batch
+
+    def _refresh_ready(self, chat_id: int):
+        """Re-registers a chat at the back of each lane that still has messages for it."""
+        lanes = self._pending.get(chat_id)
+        if lanes is None:
+            return
+        if not any(lanes):
+            del self._pending[chat_id]
+            return
+        for lane, queue in enumerate(lanes):
+            if queue:
+                self._ready[lane][chat_id] = None
+                self._ready[lane].move_to_end(chat_id)
+
+    def _requeue(self, batch: List[OutboundMessage]):
+        """Puts a batch back at the head of its chat's lane."""
+        head = batch[0]
+        lanes = self._pending.setdefault(head.chat_id, [deque() for _ in _LANES])
+        lanes[head.priority].extendleft(reversed(batch))
+        self._ready[head.priority][head.chat_id] = None
+        OUTBOUND_QUEUED.inc(len(batch), lane=_LANES[head.priority])
+
+    def _fail_chat(self, chat_id: int, error: Exception, reason: str):
+        """Fails every message still queued for a chat."""
+        for lane, queue in enumerate(self._pending.pop(chat_id, [])):
+            self._ready[lane].pop(chat_id, None)
+            OUTBOUND_QUEUED.inc(-len(queue), lane=_LANES[lane])
+            self._fail(list(queue), error, reason)
+
+    def _fail(self, batch: List[OutboundMessage], error: Exception, reason: str):
+        OUTBOUND_FAILED.inc(len(batch), reason=reason)
+        for message in batch:
+            if not message.future.done():
+                message.future.set_exception(error)
+                # Fire-and-forget callers may never await the future
+                message.future.exception()
+
+    async def _deliver(self, chat_id: int, batch: List[OutboundMessage]):
+        head = batch[0]
+        head.attempts += 1
+        try:
+            if head.method == "send_message":
+                text = "\n\n".join(message.text for message in batch)
+                sent = await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=head.parse_mode, **head.options)
+            else:
+                caption = {"caption": head.text, "parse_mode": head.parse_mode} if head.text else {}
+                sent = await getattr(self.bot, head.method)(chat_id=chat_id, **caption, **head.options)
+            OUTBOUND_SENT.inc(lane=_LANES[head.priority])
+            now = time.monotonic()
+            for message in batch:
+                OUTBOUND_WAIT_SECONDS.observe(now - message.queued_at, lane=_LANES[head.priority])
+                if not message.future.done():
+                    message.future.set_result(sent)
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+            logger.warning(f"Flood control for chat {chat_id}, retrying in {delay:.0f}s.")
+            OUTBOUND_RETRIES.inc(reason="retry_after")
+            self._blocked_until[chat_id] = time.monotonic() + delay
+            self._requeue(batch)
+        except Forbidden as e:
+            # The user blocked the bot; nothing else queued for them can be delivered either
+            self._fail(batch, e, "forbidden")
+            self._fail_chat(chat_id, e, "forbidden")
+        except BadRequest as e:
+            if head.parse_mode and "parse" in str(e).lower():
+                # The Markdown does not parse; send the same text plain rather than drop it
+                OUTBOUND_RETRIES.inc(reason="plain_text")
+                for message in batch:
+                    message.parse_mode = None
+                self._requeue(batch)
+            else:
+                logger.error(f"Error sending message to {chat_id}: {e}")
+                self._fail(batch, e, "bad_request")
+        except NetworkError as e:
+            if head.attempts < config.OUTBOUND_MAX_ATTEMPTS:
+                OUTBOUND_RETRIES.inc(reason="network")
+                self._blocked_until[chat_id] = time.monotonic() + 2 ** head.attempts
+                self._requeue(batch)
+            else:
+                logger.error(f"Giving up sending message to {chat_id}: {e}")
+                self._fail(batch, e, "network")
+        except TelegramError as e:
+            logger.error(f"Error sending message to {chat_id}: {e}")
+            self._fail(batch, e, "telegram")
+        finally:
+            self._busy.discard(chat_id)
+            if self._blocked_until.get(chat_id, 0.0) <= time.monotonic():
+                self._blocked_until.pop(chat_id, None)
+            self._in_flight.release()
+            self._wakeup.set()
+
+# Shared by every handler and the alert path in this process
+outbound = OutboundQueue()
@@ -0,0 +1,160 @@
+
+import math
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from config import config
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count without a tokenizer: about one token per CJK
+    character or emoji and one per four characters of other text.
+    """
+    wide = sum(1 for char in text if ord(char) >= 0x2E80)
+    return wide + math.ceil((len(text) - wide) / 4)
+
+def _money(value: Optional[float]) -> str:
+    return "-" if value is None else f"${value:g}"
+
+def _table(header: Sequence[str], rows: Iterable[Sequence[Any]]) -> str:
+    """Pipe-separated table, far cheaper in tokens than a dict repr."""
+    lines = ["|".join(header)]
+    lines.extend("|".join("-" if cell is None else str(cell) for cell in row) for row in rows)
+    return "\n".join(lines)
+
+def format_cards(cards: List[Dict[str, Any]]) -> str:
+    return _table(
+        ("card", "grade", "ask", "fmv", "best_offer"),
+        ((card["name"], card["grade"], _money(card["ask_price"]), _money(card["fmv_price"]),
+          _money(card["offer_price"])) for card in cards),
+    )
+
+def _trend(history: List[Dict[str, Any]]) -> Optional[str]:
+    """Summarizes daily rollups as 'first close -> last close (change%)'."""
+    closes = [bucket["close"] for bucket in history if bucket["close"] is not None]
+    if len(closes) < 2:
+        return None
+    return f"{_money(closes[0])}->{_money(closes[-1])} ({(closes[-1] / closes[0] - 1) * 100:+.1f}%)"
+
+def format_comparison(cards: List[Dict[str, Any]]) -> str:
+    """Cards side by side, with other markets' asks and the price trend when known."""
+    return _table(
+        ("card", "grade", "ask", "fmv", "best_offer", "other_markets", "trend"),
+        ((card["name"], card["grade"], _money(card["ask_price"]), _money(card["fmv_price"]),
+          _money(card["offer_price"]),
+          " ".join(f"{listing['source']}:{_money(listing['ask_price'])}" for listing in card.get("listings", [])) or None,
+          _trend(card.get("price_history", []))) for card in cards),
+    )
+
+def format_opportunities(opportunities: List[Dict[str, Any]]) -> str:
+    return _table(
+        ("card", "grade", "ask", "fmv", "profit"),
+        ((opp["card_name"], opp["grade"], _money(opp["ask_price"]), _money(opp["fmv_price"]),
+          f"{_money(opp['profit_usd'])} ({opp['profit_percent']}%)") for opp in opportunities),
+    )
+
+def format_cross_platform(opportunities: List[Dict[str, Any]]) -> str:
+    return _table(
+        ("card", "grade", "buy", "sell", "profit_after_fees"),
+        ((opp["card_name"], opp["grade"], f"{_money(opp['buy_price'])} @{opp['buy_source']}",
+          f"{_money(opp['sell_price'])} @{opp['sell_source']}",
+          f"{_money(opp['profit_usd'])} ({opp['profit_percent']}%)") for opp in opportunities),
+    )
+
+def format_stats(cards: List[Dict[str, Any]]) -> str:
+    """Rolling ask statistics of each card's own listing and of its card-and-grade market."""
+    rows = []
+    for card in cards:
+        stats = card.get("stats")
+        if not stats:
+            continue
+        for scope in ("card", "market"):
+            series = stats.get(scope)
+            if series:
+                rows.append((card["name"], card["grade"], scope, series["observations"], _money(series["median"]),
+                             f"{_money(series['p10'])}-{_money(series['p90'])}",
+                             f"{_money(series['min'])}-{_money(series['max'])}", _money(series["ewma"]),
+                             f"{series['volatility_percent']}%"))
+    return _table(("card", "grade", "scope", "asks", "median", "p10-p90", "min-max", "ewma", "volatility"), rows)
+
+def format_signals(opportunities: List[Dict[str, Any]]) -> str:
+    return _table(
+        ("card", "grade", "ask", "signal", "reference", "discount"),
+        ((opp["card_name"], opp["grade"], _money(opp["ask_price"]), opp["type"], _money(opp["reference_price"]),
+          f"{_money(opp['profit_usd'])} ({opp['profit_percent']}%)") for opp in opportunities),
+    )
+
+class PromptBuilder:
+    """
+    Assembles the reply prompt from the parsed intent, the fetched data and
+    recent history.
+
+    Data is rendered as small tables with only the fields the model talks
+    about (no ids, image URLs or links), and history is trimmed, newest
+    first, to a token budget.
+    """
+
+    def __init__(self, history_token_budget: Optional[int] = None, max_turn_chars: Optional[int] = None):
+        self.history_token_budget = (config.PROMPT_HISTORY_TOKEN_BUDGET if history_token_budget is None
+                                     else history_token_budget)
+        self.max_turn_chars = config.PROMPT_MAX_TURN_CHARS if max_turn_chars is None else max_turn_chars
+
+    def build(self, user_message: str, intent: str, data: dict,
+              history: Iterable[Tuple[str, str]] = ()) -> Tuple[str, str, List[Dict[str, str]]]:
+        """Returns (system prompt, user prompt, history messages in chat-completions form)."""
+        user_prompt = (
+            f"User message: \"{user_message}\"\n"
+            f"Intent: {intent}\n"
+            f"{self.format_data(data)}\n\n"
+            "Reply in character as '小R' in a Telegram chat: fun, helpful and concise, with emojis. "
+            "Format card data with Markdown and present arbitrage opportunities clearly. "
+            "Use only the prices above; if there is no data, just chat on-brand."
+        )
+        return config.BOT_PERSONALITY, user_prompt, self.trim_history(history)
+
+    def format_data(self, data: dict) -> str:
+        """Renders the action data as compact tables."""
+        sections = []
+        if "card_info" in data:
+            if data["card_info"]:
+                sections.append("Card found:\n" + format_cards([data["card_info"]]))
+                if data["card_info"].get("stats"):
+                    sections.append(self._stats_heading() + format_stats([data["card_info"]]))
+            else:
+                sections.append(f"No listing found for \"{data.get('card_name')}\".")
+        if "cards" in data:
+            found = [card for card in data["cards"] if card]
+            missing = [name for name, card in zip(data["card_names"], data["cards"]) if card is None]
+            if found:
+                sections.append("Cards to compare:\n" + format_comparison(found))
+                if any(card.get("stats") for card in found):
+                    sections.append(self._stats_heading() + format_stats(found))
+            if missing:
+                sections.append("No listing found for: " + ", ".join(f"\"{name}\"" for name in missing) + ".")
+        if data.get("opportunities"):
+            sections.append("FMV arbitrage (buy on Renaiss below fair value):\n"
+                            + format_opportunities(data["opportunities"]))
+        elif "opportunities" in data:
+            sections.append("No FMV arbitrage opportunities right now.")
+        if data.get("cross_platform_opportunities"):
+            sections.append("Cross-platform spreads:\n" + format_cross_platform(data["cross_platform_opportunities"]))
+        if data.get("signal_opportunities"):
+            sections.append("Price-statistics signals (ask below the rolling median or below the best open offer):\n"
+                            + format_signals(data["signal_opportunities"]))
+        return "\n".join(sections) if sections else "No market data fetched."
+
+    def _stats_heading(self) -> str:
+        return (f"Ask statistics over the last {config.PRICE_STATS_WINDOW_DAYS} days "
+                "(card = this listing, market = same card and grade across listings):\n")
+
+    def trim_history(self, history: Iterable[Tuple[str, str]]) -> List[Dict[str, str]]:
+        """Keeps the newest turns that fit the token budget, returned oldest first."""
+        kept, used = [], 0
+        for role, content in reversed(list(history)):
+            if len(content) > self.max_turn_chars:
+                content = content[:self.max_turn_chars] + "…"
+            tokens = estimate_tokens(content) + 4  # Per-message overhead
+            if used + tokens > self.history_token_budget:
+                break
+            kept.append({"role": role, "content": content})
+            used += tokens
+        kept.reverse()
+        return kept
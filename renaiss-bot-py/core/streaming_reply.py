@@ -0,0 +1,94 @@
+
+import asyncio
+import re
+import time
+from typing import Optional
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from config import config
+from utils.logger import logger
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+_CURSOR = " ▌"
+_LINK_TARGET = re.compile(r"\]\([^)]*\)")
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Returns RetryAfter.retry_after in seconds, whether it is an int or a timedelta."""
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+def balance_markdown(text: str) -> str:
+    """
+    Makes a partial Markdown (legacy) text safe to send.
+
+    Drops a link that is still being written and closes any code block,
+    code span, bold or italic marker left open.
+    """
+    if text.count("```") % 2:
+        return text + "\n```"
+    last_bracket = text.rfind("[")
+    if last_bracket != -1 and ")" not in text[last_bracket:]:
+        text = text[:last_bracket]
+    # Link targets may contain underscores that are not markup
+    visible = _LINK_TARGET.sub("]()", text)
+    for marker in ("`", "*", "_"):
+        if visible.count(marker) % 2:
+            text += marker
+    return text
+
+class StreamingReply:
+    """
+    Progressively edits one Telegram message while an LLM response streams in.
+
+    Chunks are coalesced so the message is edited at most once per
+    STREAM_EDIT_INTERVAL_SECONDS, which keeps us under Telegram's edit rate limits.
+    """
+
+    def __init__(self, message: Message, min_interval: Optional[float] = None):
+        self.message = message
+        self.min_interval = config.STREAM_EDIT_INTERVAL_SECONDS if min_interval is None else min_interval
+        self.text = ""
+        self._shown = ""
+        self._next_edit_at = 0.0
+
+    async def push(self, chunk: str):
+        """Appends a chunk and flushes if the edit interval has elapsed."""
+        self.text += chunk
+        if time.monotonic() >= self._next_edit_at:
+            await self._edit(balance_markdown(self.text) + _CURSOR)
+
+    async def finish(self) -> str:
+        """Writes the complete text and returns it."""
+        await self._edit(self.text, final=True)
+        return self.text
+
+    async def _edit(self, text: str, final: bool = False):
+        text = text[:TELEGRAM_MAX_MESSAGE_LENGTH]
+        if not text.strip() or text == self._shown:
+            return
+        self._next_edit_at = time.monotonic() + self.min_interval
+        try:
+            await self.message.edit_text(text, parse_mode='Markdown', disable_web_page_preview=True)
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+            if not final:
+                # Skip this flush; the next chunk after the cool-down carries the text forward
+                self._next_edit_at = time.monotonic() + delay
+                return
+            await asyncio.sleep(delay)
+            await self._edit(text, final=True)
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                # Markdown the model produced does not parse; show it as plain text instead
+                await self._edit_plain(text)
+        except TelegramError as e:
+            logger.error(f"Error editing streamed reply: {e}")
+            return
+        self._shown = text
+
+    async def _edit_plain(self, text: str):
+        try:
+            await self.message.edit_text(text, disable_web_page_preview=True)
+        except TelegramError as e:
+            logger.error(f"Error editing streamed reply as plain text: {e}")
@@ -0,0 +1,115 @@
+
+import asyncio
+import signal
+from typing import List, Optional
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+from config import config
+from utils.logger import logger
+
+class WebhookServer:
+    """
+    Embedded HTTP server that receives Telegram updates and dispatches them to a worker pool.
+
+    Updates are routed to a worker by chat id, so messages from one chat are
+    processed in order while different chats are handled concurrently. Several
+    processes can serve the same port (SO_REUSEPORT) or sit behind a load
+    balancer, sharing one database.
+    """
+
+    def __init__(self, application: Application, workers: Optional[int] = None):
+        self.application = application
+        self.workers = workers or config.WEBHOOK_WORKERS
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        """Starts the workers and the HTTP listener."""
+        self._queues = [asyncio.Queue(maxsize=config.WEBHOOK_QUEUE_SIZE) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+
+        app = web.Application()
+        app.router.add_post(config.WEBHOOK_PATH, self._handle_update)
+        app.router.add_get("/healthz", self._handle_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, config.WEBHOOK_LISTEN, config.WEBHOOK_PORT,
+                           reuse_port=config.WEBHOOK_REUSE_PORT)
+        await site.start()
+        logger.info(f"Webhook server listening on {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH} "
+                    f"with {self.workers} workers.")
+
+    async def stop(self):
+        """Stops accepting updates, lets queued ones finish, then stops the workers."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)),
+                                   timeout=config.WEBHOOK_DRAIN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Timed out draining webhook queues.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if config.WEBHOOK_SECRET_TOKEN and \
+                request.headers.get("X-Telegram-Bot-Api-Secret-Token") != config.WEBHOOK_SECRET_TOKEN:
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            logger.error(f"Invalid webhook payload: {e}")
+            return web.Response(status=400)
+
+        chat = update.effective_chat
+        key = chat.id if chat else update.update_id
+        # Blocks when the worker is saturated, which slows Telegram down instead of dropping updates
+        await self._queues[hash(key) % self.workers].put(update)
+        return web.Response()
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "queued": sum(queue.qsize() for queue in self._queues)})
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.application.process_update(update)
+            except Exception as e:
+                logger.error(f"Error processing update {update.update_id}: {e}")
+            finally:
+                queue.task_done()
+
+async def serve_webhook(application: Application):
+    """Runs the bot in webhook mode until SIGINT/SIGTERM."""
+    server = WebhookServer(application)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        if config.WEBHOOK_REGISTER:
+            await application.bot.set_webhook(
+                url=f"{config.WEBHOOK_URL.rstrip('/')}{config.WEBHOOK_PATH}",
+                secret_token=config.WEBHOOK_SECRET_TOKEN or None,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Webhook registered at {config.WEBHOOK_URL}.")
+        await server.start()
+        await stop_event.wait()
+    finally:
+        logger.info("Stopping webhook server...")
+        await server.stop()
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
@@ -1,27 +1,274 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Set
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from telegram import Bot
 from services.card_info_service import CardInfoService
+from services.alert_service import AlertService
+from services.cross_market_service import cross_market
+from services.hot_cards import hot_cards
+from services.leader_election import LeaderElector, LeaseLost, bump_version, read_version
+from services.market_snapshot import MarketSnapshot, market_snapshot
+from services.price_history_service import PriceHistoryService
+from services.price_stats import price_stats
+from models.database import get_session
 from config import config
+from utils.metrics import metrics
 from utils.logger import logger
 
+REFRESH_SECONDS = metrics.histogram("refresh_duration_seconds", "Duration of market refresh phases.", ["lane", "phase"])
+REFRESH_ROWS = metrics.counter("refresh_rows_total", "Cards seen by market refreshes.", ["lane", "result"])
+REFRESH_CHANGED_ROWS = metrics.gauge("refresh_changed_rows", "Cards whose listing changed in the last refresh.", ["lane"])
+REFRESH_LAST_SUCCESS = metrics.gauge("refresh_last_success_timestamp_seconds", "Unix time of the last completed refresh.", ["lane"])
+REFRESH_INTERVAL = metrics.gauge("refresh_interval_seconds", "Current full-sweep interval.")
+REFRESH_SKIPPED = metrics.counter("refresh_skipped_total", "Refresh runs coalesced into one already in progress.", ["lane"])
+HOT_CARDS = metrics.gauge("hot_cards", "Cards currently tracked as hot.")
+SNAPSHOT_SYNCS = metrics.counter("snapshot_syncs_total", "Market snapshots reloaded after another instance's refresh.", ["source"])
+
+# Data version bumped by the leader after every refresh that changed the market snapshot
+MARKET_VERSION = "market"
+
+class AdaptiveInterval:
+    """
+    Picks the next full-sweep interval from a smoothed change rate: sweeps come
+    faster while many listings move between runs and back off while the
+    market is quiet.
+    """
+
+    def __init__(self, base: float, minimum: float, maximum: float, target_rate: float, smoothing: float):
+        self.base = base
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_rate = target_rate
+        self.smoothing = smoothing
+        self.rate: Optional[float] = None
+        self.current = base
+
+    def update(self, changed: int, seen: int) -> float:
+        """Folds one sweep's change rate into the average and returns the new interval in seconds."""
+        if not seen:
+            return self.current  # A failed crawl says nothing about the market
+        rate = changed / seen
+        self.rate = rate if self.rate is None else self.smoothing * rate + (1 - self.smoothing) * self.rate
+        interval = self.base * self.target_rate / self.rate if self.rate > 0 else self.maximum
+        self.current = min(self.maximum, max(self.minimum, interval))
+        return self.current
+
 class Scheduler:
-    """Manages all scheduled background jobs for the bot."""
+    """
+    Manages all scheduled background jobs for the bot.
+
+    When several instances share one database, only the elected leader runs
+    the refresh and rollup jobs; the others poll the market data version and
+    rebuild their snapshot when the leader has written a new one.
+    """
 
-    def __init__(self):
+    def __init__(self, bot: Optional[Bot] = None):
         self.scheduler = AsyncIOScheduler(timezone="UTC")
+        self.bot = bot
         self.card_service = CardInfoService()
+        self.alert_service = AlertService()
+        self.price_history = PriceHistoryService()
+        self.interval = AdaptiveInterval(
+            base=config.MONITOR_INTERVAL_SECONDS,
+            minimum=config.REFRESH_MIN_INTERVAL_SECONDS,
+            maximum=config.REFRESH_MAX_INTERVAL_SECONDS,
+            target_rate=config.REFRESH_TARGET_CHANGE_RATE,
+            smoothing=config.REFRESH_CHANGE_RATE_SMOOTHING,
+        )
+        # Held by whichever lane is refreshing, so sweeps never overlap each other or the fast lane
+        self._refresh_lock = asyncio.Lock()
+        # Cards the hot lane found changed since the last sweep, which that sweep then sees as unchanged
+        self._hot_changed: Set[int] = set()
+        self.elector = LeaderElector("market_refresh", config.NODE_ID, config.LEADER_LEASE_SECONDS)
 
     def start(self):
         """Starts the scheduler and adds jobs."""
         logger.info("Starting background job scheduler.")
         self.scheduler.add_job(
-            self.card_service.refresh_all_cards,
+            self.elector.heartbeat,
+            'interval',
+            seconds=config.LEADER_HEARTBEAT_SECONDS,
+            next_run_time=datetime.now(timezone.utc),
+            id='leader_heartbeat_job',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
+        self.scheduler.add_job(
+            self.sync_snapshot,
+            'interval',
+            seconds=config.SNAPSHOT_POLL_SECONDS,
+            id='sync_snapshot_job',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
+        # max_instances=1 with coalesce=True: a run that is still going when the next
+        # one is due swallows it instead of stacking up behind it
+        self.scheduler.add_job(
+            self.refresh_market,
             'interval',
-            seconds=config.MONITOR_INTERVAL_SECONDS,
+            seconds=self.interval.current,
             id='refresh_cards_job',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
+        self.scheduler.add_job(
+            self.refresh_hot_cards,
+            'interval',
+            seconds=config.HOT_LANE_INTERVAL_SECONDS,
+            id='refresh_hot_cards_job',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
+        self.scheduler.add_job(
+            self.rollup,
+            'interval',
+            seconds=config.PRICE_ROLLUP_INTERVAL_SECONDS,
+            id='price_rollup_job',
+            max_instances=1,
+            coalesce=True,
             replace_existing=True
         )
         self.scheduler.start()
-        logger.info(f"Card refresh job scheduled to run every {config.MONITOR_INTERVAL_SECONDS} seconds.")
+        REFRESH_INTERVAL.set(self.interval.current)
+        logger.info(f"Card refresh job scheduled to run every {self.interval.current:.0f} seconds, "
+                    f"hot lane every {config.HOT_LANE_INTERVAL_SECONDS} seconds.")
+
+    async def refresh_market(self):
+        """Runs a full sweep, then adapts the sweep interval to the observed change rate."""
+        if not self.elector.is_leader:
+            return
+        async with self._refresh_lock:
+            try:
+                result = await self._refresh("full")
+            except LeaseLost as e:
+                logger.warning(f"Full sweep aborted: {e}")
+                return
+
+        if not result["complete"]:
+            return  # Part of the catalog is missing, so the change rate would be wrong
+        hot_changed, self._hot_changed = self._hot_changed, set()
+        if not result["updated"] and not result["unchanged"]:
+            return  # Initial load into an empty database, not a measure of market churn
+        seen = result["inserted"] + result["updated"] + result["unchanged"]
+        previous = self.interval.current
+        # Changes the hot lane already stored happened since the last sweep too
+        interval = self.interval.update(len(hot_changed.union(result["changed_card_ids"])), seen)
+        REFRESH_INTERVAL.set(interval)
+        if abs(interval - previous) >= 1:
+            self.scheduler.reschedule_job('refresh_cards_job', trigger='interval', seconds=interval)
+            logger.info(f"Change rate {self.interval.rate:.2%}, full sweep interval now {interval:.0f} seconds.")
+
+    async def refresh_hot_cards(self):
+        """Re-crawls the listing pages that hold hot cards, if there are any."""
+        HOT_CARDS.set(len(hot_cards))
+        pages = hot_cards.hot_pages(config.HOT_LANE_MAX_PAGES)
+        if not pages or not self.elector.is_leader:
+            return
+        if self._refresh_lock.locked():
+            # A sweep is already running and will pick up the same listings
+            REFRESH_SKIPPED.inc(lane="hot")
+            return
+        async with self._refresh_lock:
+            try:
+                result = await self._refresh("hot", pages=pages)
+                self._hot_changed.update(result["changed_card_ids"])
+            except LeaseLost as e:
+                logger.warning(f"Hot lane refresh aborted: {e}")
+
+    async def rollup(self):
+        """Runs the price rollup on the leader."""
+        if not self.elector.is_leader:
+            return
+        try:
+            await self.price_history.rollup(fence=self.elector.fence)
+        except LeaseLost as e:
+            logger.warning(f"Price rollup aborted: {e}")
+
+    async def sync_snapshot(self):
+        """
+        On followers, swaps in the leader's newer market snapshot: mapped from
+        the snapshot file when it already holds that version, rebuilt from the
+        database otherwise (e.g. when the leader runs on another host).
+        """
+        if self.elector.is_leader:
+            return
+        try:
+            version = await read_version(MARKET_VERSION)
+        except Exception as e:
+            logger.error(f"Error reading market data version: {e}")
+            return
+        if version == market_snapshot.data_version:
+            return
+        if market_snapshot.file_version() == version and await market_snapshot.load_file() == version:
+            SNAPSHOT_SYNCS.inc(source="file")
+        else:
+            await market_snapshot.rebuild(data_version=version)
+            SNAPSHOT_SYNCS.inc(source="database")
+        price_stats.observe(market_snapshot.current)
+        logger.debug(f"Market snapshot synced to version {version}.")
+
+    async def _publish_market_version(self):
+        """Bumps the market data version and saves the snapshot file so followers reload their snapshots."""
+        async for session in get_session():
+            await bump_version(session, MARKET_VERSION)
+            await self.elector.fence(session)
+            await session.commit()
+        await market_snapshot.save(await read_version(MARKET_VERSION))
+
+    async def _refresh(self, lane: str, pages: Optional[List[int]] = None) -> dict:
+        """Refreshes card data, rebuilds the market snapshot and alerts subscribers about new opportunities."""
+        with REFRESH_SECONDS.time(lane=lane, phase="crawl"):
+            if lane == "full" and cross_market.adapters:
+                # Other markets are fetched alongside the Renaiss crawl and matched once it is stored
+                result, fetched = await asyncio.gather(
+                    self.card_service.refresh_all_cards(pages=pages, fence=self.elector.fence),
+                    cross_market.fetch_all())
+            else:
+                result = await self.card_service.refresh_all_cards(pages=pages, fence=self.elector.fence)
+                fetched = None
+        for outcome in ("inserted", "updated", "unchanged"):
+            REFRESH_ROWS.inc(result[outcome], lane=lane, result=outcome)
+        REFRESH_CHANGED_ROWS.set(len(result["changed_card_ids"]), lane=lane)
+        # An initial load into an empty database "changes" every card and says nothing about which are active
+        initial_load = not result["updated"] and not result["unchanged"]
+        if not initial_load:
+            hot_cards.mark(result["changed_card_ids"], "changed")
+
+        if result["changed_card_ids"] or lane == "full":
+            with REFRESH_SECONDS.time(lane=lane, phase="snapshot"):
+                snapshot = await market_snapshot.rebuild()
+            with REFRESH_SECONDS.time(lane=lane, phase="stats"):
+                price_stats.observe(snapshot)
+            if fetched:
+                with REFRESH_SECONDS.time(lane=lane, phase="cross_market"):
+                    await cross_market.store(fetched, snapshot, fence=self.elector.fence)
+            await self._publish_market_version()
+            if not initial_load:
+                await self._mark_near_threshold(snapshot, result["changed_card_ids"])
+            if self.bot is not None:
+                with REFRESH_SECONDS.time(lane=lane, phase="alerts"):
+                    await self.alert_service.process_refresh(snapshot, result["changed_card_ids"])
+        REFRESH_LAST_SUCCESS.set(time.time(), lane=lane)
+        return result
+
+    async def _mark_near_threshold(self, snapshot: MarketSnapshot, changed_card_ids: List[int]):
+        """
+        Marks changed cards whose profit now sits at or just below the lowest alert
+        threshold as hot. Cards that did not move keep their marks until they expire.
+        """
+        if not changed_card_ids:
+            return
+        thresholds = [threshold for threshold, _ in await self.alert_service.user_service.get_subscriber_thresholds()
+                      if threshold is not None]
+        lowest = min(thresholds + [config.ALERT_DEFAULT_THRESHOLD_PERCENT])
+        near = snapshot.opportunities_for_cards(changed_card_ids, lowest - config.HOT_CARD_THRESHOLD_BAND_PERCENT)
+        hot_cards.mark((opp["card_id"] for opp in near[:config.HOT_CARD_NEAR_THRESHOLD_LIMIT]), "near_threshold")
 
     def shutdown(self):
         """Shuts down the scheduler."""
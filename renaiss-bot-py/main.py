@@ -6,13 +6,23 @@ Main entry point for the Renaiss Telegram Bot.
 """
 
 import asyncio
-from telegram.ext import Application, CommandHandler as TGCommandHandler, MessageHandler, filters
+import re
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler as TGCommandHandler, MessageHandler, filters
 
 from config import config
 from models.database import init_db
-from core.command_handler import CommandHandler
+from core.command_handler import ARBITRAGE_CALLBACK_PREFIX, CommandHandler
 from core.chat_handler import ChatHandler
+from core.webhook_server import serve_webhook
+from core.outbound_queue import outbound
 from jobs.scheduler import Scheduler
+from services.conversation_memory import conversation_memory
+from services.cross_market_service import cross_market
+from services.market_snapshot import market_snapshot
+from services.media_service import media_service
+from services.price_stats import price_stats
+from utils.metrics import start_metrics_server
+from utils.tracing import traced
 from utils.logger import logger
 
 def main():
@@ -23,33 +33,72 @@ def main():
     asyncio.run(init_db())
     logger.info("Database initialized.")
 
-    # --- Initialize Scheduler ---
-    scheduler = Scheduler()
-    scheduler.start()
-
     # --- Initialize Telegram Bot Application ---
-    application = Application.builder().token(config.TELEGRAM_TOKEN).build()
+    metrics_runner = None
+
+    async def post_init(_application: Application):
+        nonlocal metrics_runner
+        # The scheduler and the outbound queue must start inside the running event loop
+        outbound.start(_application.bot)
+        # Maps the saved snapshot file when there is one, so the first requests are served warm
+        snapshot = await market_snapshot.get()
+        # Price statistics start from the last window of daily closes, then follow every snapshot
+        await price_stats.seed()
+        price_stats.observe(snapshot)
+        scheduler.start()
+        if config.METRICS_PORT:
+            metrics_runner = await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+
+    async def post_shutdown(_application: Application):
+        scheduler.shutdown()
+        # Lets another instance take over the refresh right away instead of after the lease expires
+        await scheduler.elector.release()
+        await outbound.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        # Close the pooled HTTP session used by the refresh job
+        await scheduler.card_service.close()
+        await cross_market.close()
+        await conversation_memory.flush()
+        await media_service.close()
+
+    application = (
+        Application.builder()
+        .token(config.TELEGRAM_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    # --- Initialize Scheduler ---
+    scheduler = Scheduler(application.bot)
 
     # --- Register Handlers ---
     command_handler = CommandHandler()
     chat_handler = ChatHandler()
 
-    application.add_handler(TGCommandHandler("start", command_handler.start))
-    application.add_handler(TGCommandHandler("help", command_handler.help))
-    application.add_handler(TGCommandHandler("arbitrage", command_handler.arbitrage))
+    application.add_handler(TGCommandHandler("start", traced("start", command_handler.start)))
+    application.add_handler(TGCommandHandler("help", traced("help", command_handler.help)))
+    application.add_handler(TGCommandHandler("arbitrage", traced("arbitrage", command_handler.arbitrage)))
+    application.add_handler(TGCommandHandler("subscribe", traced("subscribe", command_handler.subscribe)))
+    application.add_handler(TGCommandHandler("threshold", traced("threshold", command_handler.threshold)))
+    application.add_handler(CallbackQueryHandler(traced("arbitrage_page", command_handler.arbitrage_page),
+                                                 pattern=f"^{re.escape(ARBITRAGE_CALLBACK_PREFIX)}"))
 
     # Add a handler for all non-command text messages
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, chat_handler.handle_message))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, traced("chat", chat_handler.handle_message)))
 
-    logger.info("Telegram handlers registered. Starting polling...")
-    
     # --- Start the Bot ---
     try:
-        application.run_polling()
+        if config.BOT_MODE == "webhook":
+            logger.info("Telegram handlers registered. Starting webhook server...")
+            asyncio.run(serve_webhook(application))
+        else:
+            logger.info("Telegram handlers registered. Starting polling...")
+            application.run_polling()
     except Exception as e:
-        logger.error(f"Bot polling failed: {e}")
+        logger.error(f"Bot {config.BOT_MODE} failed: {e}")
     finally:
-        scheduler.shutdown()
         logger.info("Bot has been shut down.")
 
 if __name__ == "__main__":
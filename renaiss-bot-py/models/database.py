@@ -5,17 +5,40 @@
 SQLAlchemy ORM models for the database.
 """
 
-from sqlalchemy import (Column, Integer, String, Float, Boolean, DateTime, 
-                        create_async_engine, ForeignKey)
-from sqlalchemy.ext.asyncio import AsyncSession
+import time
+from sqlalchemy import (Column, Integer, String, Float, Boolean, DateTime,
+                        ForeignKey, UniqueConstraint, Index, Table, event, inspect, text)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 from datetime import datetime
 
 from config import config
+from utils.logger import logger
+from utils.metrics import metrics
 
 # Create an async engine instance
 engine = create_async_engine(config.DATABASE_URL, echo=False)
 
+DB_STATEMENT_SECONDS = metrics.histogram("db_statement_seconds", "Latency of database statements.", ["statement"])
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    DB_STATEMENT_SECONDS.observe(time.perf_counter() - started, statement=kind)
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def _handle_error(context):
+    # after_cursor_execute does not run for a failed statement; drop its start time here
+    conn = context.connection
+    if conn is not None and context.statement is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
 # Create a sessionmaker for creating async sessions
 AsyncSessionLocal = sessionmaker(
     bind=engine,
@@ -33,7 +56,7 @@ class User(Base):
     telegram_id = Column(String, unique=True, nullable=False)
     username = Column(String, nullable=True)
     is_subscribed = Column(Boolean, default=False)
-    threshold_percent = Column(Float, default=5.0)
+    threshold_percent = Column(Float, default=config.ALERT_DEFAULT_THRESHOLD_PERCENT)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     def __repr__(self):
@@ -59,6 +82,7 @@ class Card(Base):
 class Listing(Base):
     """Listing model to store price information from different markets."""
     __tablename__ = "listings"
+    __table_args__ = (UniqueConstraint("card_id", "source", name="uq_listings_card_source"),)
 
     id = Column(Integer, primary_key=True)
     card_id = Column(Integer, ForeignKey("cards.id"), nullable=False)
@@ -67,6 +91,7 @@ class Listing(Base):
     fmv_price = Column(Float, nullable=True)
     offer_price = Column(Float, nullable=True)
     link = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True)  # Hash of the last refreshed record, used to skip unchanged rows
     recorded_at = Column(DateTime, default=datetime.utcnow)
 
     card = relationship("Card", back_populates="listings")
@@ -82,14 +107,135 @@ class ArbitrageLog(Base):
     card_id = Column(Integer, ForeignKey("cards.id"), nullable=False)
     profit_percent = Column(Float, nullable=False)
     profit_usd = Column(Float, nullable=False)
+    ask_price = Column(Float, nullable=True)
+    fmv_price = Column(Float, nullable=True)
     type = Column(String) # e.g., 'fmv_arbitrage', 'cross_platform'
     details = Column(String) # JSON string with details
     discovered_at = Column(DateTime, default=datetime.utcnow)
 
+class PriceTick(Base):
+    """Append-only price change record, written only when a listing's prices change."""
+    __tablename__ = "price_ticks"
+    __table_args__ = (Index("ix_price_ticks_card_source_time", "card_id", "source", "recorded_at"),)
+
+    id = Column(Integer, primary_key=True)
+    card_id = Column(Integer, ForeignKey("cards.id"), nullable=False)
+    source = Column(String, nullable=False)
+    ask_price = Column(Float, nullable=True)
+    fmv_price = Column(Float, nullable=True)
+    offer_price = Column(Float, nullable=True)
+    recorded_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class PriceRollup(Base):
+    """OHLC-style bucket of ask prices built from price ticks ('1h' or '1d')."""
+    __tablename__ = "price_rollups"
+    __table_args__ = (UniqueConstraint("card_id", "source", "bucket", "bucket_start", name="uq_price_rollups_bucket"),)
+
+    id = Column(Integer, primary_key=True)
+    card_id = Column(Integer, ForeignKey("cards.id"), nullable=False)
+    source = Column(String, nullable=False)
+    bucket = Column(String, nullable=False)  # e.g., '1h', '1d'
+    bucket_start = Column(DateTime, nullable=False)
+    open_price = Column(Float, nullable=True)
+    high_price = Column(Float, nullable=True)
+    low_price = Column(Float, nullable=True)
+    close_price = Column(Float, nullable=True)
+    fmv_price = Column(Float, nullable=True)  # Last FMV seen in the bucket
+    offer_price = Column(Float, nullable=True)  # Last offer seen in the bucket
+    tick_count = Column(Integer, nullable=False, default=0)
+
+class CardMedia(Base):
+    """Telegram file_id of a card image already sent once, so later sends skip the upload."""
+    __tablename__ = "card_media"
+    __table_args__ = (UniqueConstraint("card_id", "variant", name="uq_card_media_variant"),)
+
+    id = Column(Integer, primary_key=True)
+    card_id = Column(Integer, ForeignKey("cards.id"), nullable=False)
+    variant = Column(String, nullable=False)  # 'photo' (full image) or 'thumb' (gallery thumbnail)
+    image_url = Column(String, nullable=False)  # Source the file_id was made from; a new URL invalidates it
+    file_id = Column(String, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ConversationTurn(Base):
+    """Chat history of a user evicted from the in-memory conversation cache."""
+    __tablename__ = "conversation_turns"
+    __table_args__ = (Index("ix_conversation_turns_user", "user_id", "id"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String, nullable=False)
+    role = Column(String, nullable=False)  # 'user' or 'assistant'
+    content = Column(String, nullable=False)
+    card_name = Column(String, nullable=True)  # Card the conversation was last about, kept on the newest turn
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Lease(Base):
+    """A named lease that one process at a time may hold, used for leader election."""
+    __tablename__ = "leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)  # NODE_ID of the current holder
+    token = Column(Integer, nullable=False, default=1)  # Fencing token, bumped every time the lease changes hands
+    expires_at = Column(DateTime, nullable=False)
+
+class DataVersion(Base):
+    """A counter the leader bumps after each write that other processes should reload."""
+    __tablename__ = "data_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+def _add_missing_columns(conn, table: Table, names):
+    """Adds model columns that an older database does not have yet. They must be nullable."""
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    for name in names:
+        if name not in existing:
+            column_type = table.c[name].type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+            logger.info(f"Added column {table.name}.{name}")
+
+def _add_missing_unique(conn, table: Table, name: str, columns):
+    """
+    Creates a unique index an older database does not have yet, first deleting
+    duplicate rows so it can be built; the newest row (highest id) of each key is kept.
+    """
+    inspector = inspect(conn)
+    if any(index["name"] == name for index in inspector.get_indexes(table.name)) or \
+            any(constraint["name"] == name for constraint in inspector.get_unique_constraints(table.name)):
+        return
+    key = ", ".join(columns)
+    removed = conn.execute(text(
+        f"DELETE FROM {table.name} WHERE id NOT IN (SELECT MAX(id) FROM {table.name} GROUP BY {key})"
+    )).rowcount
+    conn.execute(text(f"CREATE UNIQUE INDEX {name} ON {table.name} ({key})"))
+    logger.info(f"Created unique index {name} on {table.name}, removing {removed} duplicate rows")
+
+def _upgrade_schema(conn):
+    """
+    Brings tables created by older versions up to the current models.
+    create_all() only creates missing tables, so columns and constraints added
+    to existing tables since then are applied here; every step is idempotent.
+    """
+    _add_missing_columns(conn, Listing.__table__, ["content_hash"])
+    # The batched refresh upserts on (card_id, source)
+    _add_missing_unique(conn, Listing.__table__, "uq_listings_card_source", ["card_id", "source"])
+    # Alert deduplication compares against the logged prices
+    _add_missing_columns(conn, ArbitrageLog.__table__, ["ask_price", "fmv_price"])
+
 async def init_db():
-    """Initializes the database and creates tables."""
+    """Initializes the database, creates tables and upgrades older ones."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_upgrade_schema)
+
+def dialect_insert(session: AsyncSession):
+    """Returns the dialect-specific insert() that supports ON CONFLICT upserts."""
+    dialect = session.bind.dialect.name
+    if dialect == "sqlite":
+        return sqlite.insert
+    if dialect == "postgresql":
+        return postgresql.insert
+    raise NotImplementedError(f"Upserts are not supported on the '{dialect}' dialect.")
 
 async def get_session() -> AsyncSession:
     """Dependency to get a database session."""
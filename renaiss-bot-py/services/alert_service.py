@@ -0,0 +1,147 @@
+
+from bisect import bisect_right
+from collections import defaultdict
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Iterable, Optional, Set, Tuple
+from sqlalchemy import func
+from sqlalchemy.future import select
+from telegram.error import Forbidden
+from core.outbound_queue import ALERT, outbound
+from models.database import ArbitrageLog, get_session
+from services.arbitrage_service import ArbitrageService
+from services.market_snapshot import MarketSnapshot
+from services.user_service import UserService
+from config import config
+from utils.cache import TTLCache
+from utils.logger import logger
+
+class ThresholdIndex:
+    """Subscribers sorted by alert threshold, so matching an opportunity is one binary search."""
+
+    def __init__(self, subscribers: Iterable[Tuple[float, str]]):
+        default = config.ALERT_DEFAULT_THRESHOLD_PERCENT
+        ordered = sorted((threshold if threshold is not None else default, chat_id) for threshold, chat_id in subscribers)
+        self.thresholds = [threshold for threshold, _ in ordered]
+        self.chat_ids = [chat_id for _, chat_id in ordered]
+
+    def __len__(self) -> int:
+        return len(self.chat_ids)
+
+    @property
+    def min_threshold(self) -> Optional[float]:
+        return self.thresholds[0] if self.thresholds else None
+
+    def match(self, profit_percent: float) -> List[str]:
+        """Returns every subscriber whose threshold is at or below the given profit."""
+        return self.chat_ids[:bisect_right(self.thresholds, profit_percent)]
+
+class AlertService:
+    """Evaluates arbitrage on the cards changed by a refresh and fans alerts out to subscribers."""
+
+    def __init__(self):
+        self.arbitrage_service = ArbitrageService()
+        self.user_service = UserService()
+        # card_id -> (ask, fmv) of the last opportunity already alerted for that card, within the dedup window
+        self._alerted: Optional[TTLCache] = None
+        self._unsubscribes: Set[asyncio.Task] = set()
+
+    async def process_refresh(self, snapshot: MarketSnapshot, changed_card_ids: List[int]) -> int:
+        """
+        Runs the alert pipeline for one refresh.
+
+        Alerts go to the outbound queue's alert lane, so this returns once they
+        are queued rather than after thousands of rate-limited sends.
+
+        Args:
+            snapshot: The snapshot rebuilt after the refresh.
+            changed_card_ids: Cards whose prices are new or moved in this refresh.
+
+        Returns:
+            The number of alert messages queued.
+        """
+        if not changed_card_ids:
+            return 0
+        index = ThresholdIndex(await self.user_service.get_subscriber_thresholds())
+        # Opportunities are still logged without subscribers, at the default threshold
+        min_threshold = min(index.min_threshold or config.ALERT_DEFAULT_THRESHOLD_PERCENT, config.ALERT_DEFAULT_THRESHOLD_PERCENT)
+        opportunities = await self._new_opportunities(snapshot, changed_card_ids, min_threshold)
+        if not opportunities or not len(index):
+            return 0
+
+        per_chat: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for opp in opportunities:
+            for chat_id in index.match(opp["profit_percent"]):
+                per_chat[chat_id].append(opp)
+
+        for chat_id, chat_opportunities in per_chat.items():
+            self._queue_alert(chat_id, chat_opportunities)
+        logger.info(f"Queued {len(per_chat)} arbitrage alerts for {len(opportunities)} new opportunities.")
+        return len(per_chat)
+
+    async def _new_opportunities(self, snapshot: MarketSnapshot, changed_card_ids: List[int],
+                                 min_threshold: float) -> List[Dict[str, Any]]:
+        """Evaluates the changed cards and drops opportunities that were already alerted."""
+        if self._alerted is None:
+            self._alerted = await self._load_alerted()
+        fresh = []
+        for opp in snapshot.opportunities_for_cards(changed_card_ids, min_threshold):
+            state = (opp["ask_price"], opp["fmv_price"])
+            if self._alerted.get(opp["card_id"]) == state:
+                continue
+            self._alerted.set(opp["card_id"], state)
+            fresh.append(opp)
+        await self.arbitrage_service.log_opportunities(fresh)
+        return fresh
+
+    async def _load_alerted(self) -> TTLCache:
+        """Seeds the dedup map with the latest logged opportunity per card inside the dedup window."""
+        window = config.ALERT_DEDUP_WINDOW_SECONDS
+        alerted = TTLCache(maxsize=config.ALERT_DEDUP_MAX_CARDS, ttl_seconds=window)
+        now = datetime.utcnow()
+        latest = (
+            select(ArbitrageLog.card_id, func.max(ArbitrageLog.discovered_at).label("discovered_at"))
+            .where(ArbitrageLog.discovered_at >= now - timedelta(seconds=window))
+            .group_by(ArbitrageLog.card_id)
+            .subquery()
+        )
+        stmt = (
+            select(ArbitrageLog.card_id, ArbitrageLog.ask_price, ArbitrageLog.fmv_price, ArbitrageLog.discovered_at)
+            .join(latest, (ArbitrageLog.card_id == latest.c.card_id)
+                  & (ArbitrageLog.discovered_at == latest.c.discovered_at))
+            .order_by(ArbitrageLog.discovered_at.desc())
+            .limit(config.ALERT_DEDUP_MAX_CARDS)
+        )
+        try:
+            async for session in get_session():
+                # Oldest first, so the LRU order matches the alert order
+                for card_id, ask, fmv, discovered_at in reversed((await session.execute(stmt)).all()):
+                    # Expire each entry when its own window ends, not a full window after startup
+                    alerted.set(card_id, (ask, fmv), ttl_seconds=window - (now - discovered_at).total_seconds())
+        except Exception as e:
+            logger.error(f"Error loading alerted opportunities: {e}")
+        return alerted
+
+    def _queue_alert(self, chat_id: str, opportunities: List[Dict[str, Any]]):
+        shown = opportunities[:config.ALERT_MAX_OPPORTUNITIES_PER_MESSAGE]
+        text = "🚨 套利雷达响了！刚刚发现这些新机会：\n\n"
+        for opp in shown:
+            text += (
+                f"**{opp['card_name']} ({opp['grade']})**\n"
+                f"- 售价: *${opp['ask_price']}* | FMV: *${opp['fmv_price']}*\n"
+                f"- **潜在利润: ${opp['profit_usd']} ({opp['profit_percent']}%)** 🔥\n"
+                f"- [直达链接]({opp['link']})\n\n"
+            )
+        if len(opportunities) > len(shown):
+            text += f"还有 {len(opportunities) - len(shown)} 个机会，发送 /arbitrage 查看更多！\n"
+        text += "不想收到提醒？发送 `/subscribe off` 即可关闭。"
+        future = outbound.enqueue(chat_id, text, ALERT, parse_mode='Markdown', disable_web_page_preview=True)
+        future.add_done_callback(lambda done: self._on_alert_done(chat_id, done))
+
+    def _on_alert_done(self, chat_id: str, future: asyncio.Future):
+        if future.cancelled() or not isinstance(future.exception(), Forbidden):
+            return  # Other failures are counted and logged by the outbound queue
+        logger.warning(f"User {chat_id} blocked the bot, unsubscribing.")
+        task = asyncio.create_task(self.user_service.set_subscription(chat_id, False))
+        self._unsubscribes.add(task)
+        task.add_done_callback(self._unsubscribes.discard)
@@ -1,55 +1,90 @@
 
-from typing import List, Dict, Any
-from sqlalchemy.future import select
-from models.database import Card, Listing, ArbitrageLog, get_session
+from typing import List, Dict, Any, Optional, Tuple
+from models.database import ArbitrageLog, get_session
+from services.market_snapshot import market_snapshot, MarketSnapshot
+from services.price_stats import price_stats
+from config import config
+from utils.cache import TTLCache
+from utils.single_flight import SingleFlight
 from utils.logger import logger
 
+# Shared by every ArbitrageService instance in this process. Keys include the
+# snapshot version, so a refresh invalidates every cached result.
+_result_cache = TTLCache(maxsize=config.ARBITRAGE_CACHE_SIZE, ttl_seconds=config.MONITOR_INTERVAL_SECONDS * 2)
+_single_flight = SingleFlight()
+
 class ArbitrageService:
     """Service to find and log arbitrage opportunities."""
 
-    async def find_opportunities(self, min_profit_percent: float = 5.0) -> List[Dict[str, Any]]:
-        """Finds arbitrage opportunities from the database."""
-        logger.info(f"Finding arbitrage opportunities with min profit >= {min_profit_percent}%")
-        opportunities = []
-        async for session in get_session():
-            # Query for cards and their Renaiss listings
-            stmt = select(Card, Listing).join(Listing).where(Listing.source == "renaiss")
-            result = await session.execute(stmt)
-            
-            for card, listing in result.all():
-                if not listing.ask_price or not listing.fmv_price or listing.ask_price == 0:
-                    continue
-
-                # FMV Arbitrage
-                profit_percent = ((listing.fmv_price - listing.ask_price) / listing.ask_price) * 100
-                if profit_percent >= min_profit_percent:
-                    opp = {
-                        "card_name": card.name,
-                        "grade": card.grade,
-                        "image_url": card.image_url,
-                        "ask_price": listing.ask_price,
-                        "fmv_price": listing.fmv_price,
-                        "profit_percent": round(profit_percent, 2),
-                        "profit_usd": round(listing.fmv_price - listing.ask_price, 2),
-                        "link": listing.link,
-                        "type": "FMV Arbitrage"
-                    }
-                    opportunities.append(opp)
-                    # Log the opportunity
-                    log_entry = ArbitrageLog(
-                        card_id=card.id,
-                        profit_percent=opp["profit_percent"],
-                        profit_usd=opp["profit_usd"],
-                        type=opp["type"],
-                        details=f"Ask: ${listing.ask_price}, FMV: ${listing.fmv_price}"
-                    )
-                    session.add(log_entry)
-
-        # Sort by highest profit percentage
-        opportunities.sort(key=lambda x: x["profit_percent"], reverse=True)
-        
+    async def find_opportunities(self, min_profit_percent: float = 5.0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Finds arbitrage opportunities in the market snapshot, highest profit first.
+
+        Results are cached per (min_profit_percent, limit, snapshot version) and
+        concurrent identical requests share one scan.
+        """
+        snapshot = await market_snapshot.get()
+        key = (min_profit_percent, limit, snapshot.version)
+        opportunities = _result_cache.get(key)
+        if opportunities is None:
+            opportunities = await _single_flight.do(key, lambda: self._scan(snapshot, min_profit_percent, limit))
+        return list(opportunities)
+
+    async def _scan(self, snapshot: MarketSnapshot, min_profit_percent: float,
+                    limit: Optional[int]) -> List[Dict[str, Any]]:
+        logger.info(f"Finding arbitrage opportunities with min profit >= {min_profit_percent}% in snapshot v{snapshot.version}")
+        opportunities = snapshot.top_opportunities(min_profit_percent, limit)
         if opportunities:
-            await session.commit()
             logger.info(f"Found {len(opportunities)} arbitrage opportunities.")
-        
+        _result_cache.set((min_profit_percent, limit, snapshot.version), opportunities)
         return opportunities
+
+    async def find_signal_opportunities(self, min_discount_percent: Optional[float] = None,
+                                        limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Finds opportunities from the price statistics rather than FMV: asks well
+        below the card's rolling median, and asks below the best open offer.
+        Cached per snapshot version like find_opportunities.
+        """
+        min_discount_percent = config.MEDIAN_DISCOUNT_PERCENT if min_discount_percent is None else min_discount_percent
+        snapshot = await market_snapshot.get()
+        key = ("signals", min_discount_percent, limit, snapshot.version)
+        opportunities = _result_cache.get(key)
+        if opportunities is None:
+            opportunities = price_stats.signal_opportunities(snapshot, min_discount_percent, limit)
+            _result_cache.set(key, opportunities)
+        return list(opportunities)
+
+    async def find_opportunities_page(self, min_profit_percent: float = 5.0, limit: Optional[int] = None,
+                                      cursor: Optional[Tuple[float, int]] = None, backward: bool = False,
+                                      **filters) -> Dict[str, Any]:
+        """
+        Returns one keyset-paginated page of opportunities, for browsing past the top few.
+
+        `filters` are grade, min_price, max_price and min_profit_usd; see
+        MarketSnapshot.opportunity_page for the cursor semantics.
+        """
+        snapshot = await market_snapshot.get()
+        page = snapshot.opportunity_page(min_profit_percent, limit or config.ARBITRAGE_PAGE_SIZE, cursor, backward, **filters)
+        logger.debug(f"Arbitrage page at offset {page['offset']} of {page['total']} in snapshot v{snapshot.version}")
+        return page
+
+    async def log_opportunities(self, opportunities: List[Dict[str, Any]]):
+        """Records opportunities in the arbitrage log. Called from the refresh job, not the request path."""
+        if not opportunities:
+            return
+        async for session in get_session():
+            session.add_all([
+                ArbitrageLog(
+                    card_id=opp["card_id"],
+                    profit_percent=opp["profit_percent"],
+                    profit_usd=opp["profit_usd"],
+                    ask_price=opp["ask_price"],
+                    fmv_price=opp["fmv_price"],
+                    type=opp["type"],
+                    details=f"Ask: ${opp['ask_price']}, FMV: ${opp['fmv_price']}"
+                )
+                for opp in opportunities
+            ])
+            await session.commit()
+        logger.info(f"Logged {len(opportunities)} arbitrage opportunities.")
@@ -0,0 +1,42 @@
+
+"""
+Multilingual aliases for popular card subjects.
+
+Keys are the canonical English names used in Renaiss listing titles, values
+are the Chinese, Japanese and shorthand names users and the LLM send us.
+"""
+
+CARD_ALIASES = {
+    # --- Pokémon ---
+    "Charizard": ["喷火龙", "噴火龍", "リザードン", "火恐龙"],
+    "Pikachu": ["皮卡丘", "ピカチュウ"],
+    "Bulbasaur": ["妙蛙种子", "妙蛙種子", "フシギダネ"],
+    "Venusaur": ["妙蛙花", "フシギバナ"],
+    "Blastoise": ["水箭龟", "水箭龜", "カメックス"],
+    "Squirtle": ["杰尼龟", "傑尼龜", "ゼニガメ"],
+    "Charmander": ["小火龙", "小火龍", "ヒトカゲ"],
+    "Mewtwo": ["超梦", "超夢", "ミュウツー"],
+    "Mew": ["梦幻", "夢幻", "ミュウ"],
+    "Gengar": ["耿鬼", "ゲンガー"],
+    "Eevee": ["伊布", "イーブイ"],
+    "Umbreon": ["月亮伊布", "月精灵", "ブラッキー"],
+    "Espeon": ["太阳伊布", "太陽伊布", "エーフィ"],
+    "Sylveon": ["仙子伊布", "ニンフィア"],
+    "Lugia": ["洛奇亚", "洛奇亞", "ルギア"],
+    "Rayquaza": ["烈空坐", "レックウザ"],
+    "Gyarados": ["暴鲤龙", "暴鯉龍", "ギャラドス"],
+    "Dragonite": ["快龙", "快龍", "カイリュー"],
+    "Snorlax": ["卡比兽", "卡比獸", "カビゴン"],
+    "Lucario": ["路卡利欧", "路卡利歐", "ルカリオ"],
+    "Greninja": ["甲贺忍蛙", "甲賀忍蛙", "ゲッコウガ"],
+    # --- One Piece ---
+    "Luffy": ["路飞", "路飛", "ルフィ"],
+    "Zoro": ["索隆", "ゾロ"],
+    "Nami": ["娜美", "ナミ"],
+    "Sanji": ["山治", "サンジ"],
+    "Shanks": ["香克斯", "シャンクス"],
+    "Ace": ["艾斯", "エース"],
+    "Law": ["特拉法尔加", "特拉法爾加", "ロー"],
+    "Yamato": ["大和", "ヤマト"],
+    "Boa Hancock": ["汉库克", "漢考克", "ハンコック"],
+}
@@ -0,0 +1,56 @@
+
+import hashlib
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+from services.card_search_index import normalize, parse_grade, strip_grade
+
+def identity_key(name: str, grade: Optional[str] = None, set_name: Optional[str] = None,
+                 cert: Optional[str] = None) -> str:
+    """
+    Hashes the normalized (name, set, grade, cert) of a listing.
+
+    Name and set are folded into one sorted bag of tokens, so "Base Set
+    Charizard" and name="Charizard", set_name="Base Set" agree. A grade found
+    in the title is used when the grade field is empty.
+    """
+    title = unicodedata.normalize("NFKC", f"{set_name or ''} {name or ''}")
+    company, number = parse_grade(grade) if parse_grade(grade)[1] else parse_grade(title)
+    tokens = " ".join(sorted(set(normalize(strip_grade(title)).split())))
+    cert = normalize(cert) if cert else ""
+    payload = "\x1f".join((tokens, company or "", number or "", cert))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=12).hexdigest()
+
+class CardIdentityIndex:
+    """
+    Hash index from identity keys to snapshot rows.
+
+    Several Renaiss slabs can be the same card in the same grade, so a key
+    maps to every matching row. Resolving a listing from another market is
+    one dict lookup, never a scan over the catalog.
+    """
+
+    def __init__(self, names: Sequence[str], grades: Sequence[Optional[str]],
+                 certs: Optional[Sequence[Optional[str]]] = None):
+        self._rows: Dict[str, List[int]] = defaultdict(list)
+        self.keys: List[str] = []
+        for row, (name, grade) in enumerate(zip(names, grades)):
+            key = identity_key(name, grade)
+            self._rows[key].append(row)
+            self.keys.append(key)
+            if certs and certs[row]:
+                self._rows[identity_key(name, grade, cert=certs[row])].append(row)
+
+    def rows(self, key: str) -> List[int]:
+        return self._rows.get(key, [])
+
+    def resolve(self, listing: Dict) -> Optional[str]:
+        """Returns the key of the Renaiss card matching a listing, or None when there is no match."""
+        name, grade, set_name = listing.get("name"), listing.get("grade"), listing.get("set_name")
+        if listing.get("cert"):
+            # An exact slab match wins over a same-card, same-grade match
+            key = identity_key(name, grade, set_name, listing["cert"])
+            if key in self._rows:
+                return key
+        key = identity_key(name, grade, set_name)
+        return key if key in self._rows else None
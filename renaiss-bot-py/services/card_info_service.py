@@ -1,91 +1,257 @@
 
-from typing import List, Dict, Any, Optional
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Awaitable, Callable, List, Dict, Any, Optional, Tuple
+from sqlalchemy import and_
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from models.database import Card, Listing, get_session
-from adapters.renaiss_adapter import RenaissAdapter
+from models.database import Card, Listing, get_session, dialect_insert
+from adapters.renaiss_adapter import CrawlIncomplete, ListedCard, RenaissAdapter
+from services.price_history_service import PriceHistoryService
+from services.hot_cards import hot_cards
+from services.market_snapshot import market_snapshot
+from config import config
 from utils.logger import logger
 
+_HASHED_FIELDS = ("token_id", "name", "grade", "image_url", "ask_price", "fmv_price", "offer_price", "link")
+
+def _content_hash(card: ListedCard) -> str:
+    """Returns a short stable hash of the fields a refresh can change."""
+    payload = "\x1f".join(str(getattr(card, field)) for field in _HASHED_FIELDS)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
 class CardInfoService:
     """Service to manage card information from various sources."""
 
     def __init__(self):
         self.renaiss_adapter = RenaissAdapter()
+        self.price_history = PriceHistoryService()
 
-    async def refresh_all_cards(self):
-        """Refreshes all card data from the Renaiss API and updates the database."""
-        logger.info("Starting to refresh all card data.")
-        # In a real-world scenario, you might want to handle pagination
-        listed_cards = await self.renaiss_adapter.get_all_listed_cards(limit=200)
-        
-        async for session in get_session():
-            for card_data in listed_cards:
-                # Check if card exists
-                stmt = select(Card).where(Card.renaiss_id == card_data["renaiss_id"])
-                result = await session.execute(stmt)
-                card = result.scalars().first()
-
-                if not card:
-                    # Create new card
-                    card = Card(
-                        renaiss_id=card_data["renaiss_id"],
-                        token_id=card_data["token_id"],
-                        name=card_data["name"],
-                        grade=card_data["grade"],
-                        image_url=card_data["image_url"]
-                    )
-                    session.add(card)
-                    await session.flush() # Flush to get the card ID
-
-                # Update or create listing for Renaiss
-                stmt_listing = select(Listing).where(Listing.card_id == card.id, Listing.source == "renaiss")
-                result_listing = await session.execute(stmt_listing)
-                listing = result_listing.scalars().first()
-
-                if listing:
-                    listing.ask_price = card_data["ask_price"]
-                    listing.fmv_price = card_data["fmv_price"]
-                    listing.offer_price = card_data["offer_price"]
-                else:
-                    listing = Listing(
-                        card_id=card.id,
-                        source="renaiss",
-                        ask_price=card_data["ask_price"],
-                        fmv_price=card_data["fmv_price"],
-                        offer_price=card_data["offer_price"],
-                        link=card_data["link"]
-                    )
-                    session.add(listing)
-            
-            await session.commit()
-            logger.info(f"Database updated with {len(listed_cards)} cards.")
+    async def refresh_all_cards(self, max_pages: Optional[int] = None, pages: Optional[List[int]] = None,
+                                fence: Optional[Callable[[AsyncSession], Awaitable[None]]] = None) -> Dict[str, Any]:
+        """
+        Crawls every listed card from the Renaiss API and upserts it page by page.
+        Records the page each card was seen on, which the hot lane targets.
 
-    async def get_card_info_by_name(self, card_name: str) -> Optional[Dict[str, Any]]:
-        """Retrieves detailed information for a card by its name."""
-        logger.info(f"Querying database for card: {card_name}")
+        Args:
+            max_pages: Only crawl this many newest-first pages.
+            pages: Only crawl these page numbers, as the hot lane does.
+            fence: Awaited inside each page's transaction before it commits;
+                raising aborts the refresh without committing that page.
+
+        Returns:
+            Counters of inserted, updated and unchanged listings, plus
+            "changed_card_ids": the cards whose prices are new or moved, and
+            "complete": False when a page failed and later pages were not crawled.
+        """
+        if pages is not None:
+            logger.info(f"Starting to refresh {len(pages)} pages of card data.")
+        elif max_pages is not None:
+            logger.info(f"Starting to refresh the newest {max_pages} pages of card data.")
+        else:
+            logger.info("Starting to refresh all card data.")
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        changed_card_ids: List[int] = []
+        complete = True
         async for session in get_session():
-            stmt = select(Card).where(Card.name.ilike(f"%{card_name}%"))
-            result = await session.execute(stmt)
-            card = result.scalars().first()
+            try:
+                async for page, listed_cards in self.renaiss_adapter.crawl_listed_cards(max_pages=max_pages, pages=pages):
+                    page_counts, page_changed, page_card_ids = await self._upsert_cards(session, listed_cards)
+                    if fence is not None:
+                        await fence(session)
+                    await session.commit()
+                    hot_cards.locate(page_card_ids, page)
+                    for key, value in page_counts.items():
+                        counts[key] += value
+                    changed_card_ids.extend(page_changed)
+            except CrawlIncomplete as e:
+                # The pages that arrived are committed; the rest wait for the next run
+                logger.warning(f"Incomplete refresh: {e}")
+                complete = False
+            logger.info(
+                f"Database refreshed: {counts['inserted']} inserted, "
+                f"{counts['updated']} updated, {counts['unchanged']} unchanged."
+            )
+        return {**counts, "changed_card_ids": changed_card_ids, "complete": complete}
+
+    async def _upsert_cards(self, session: AsyncSession,
+                            listed_cards: List[ListedCard]) -> Tuple[Dict[str, int], List[int], List[int]]:
+        """
+        Upserts the cards and Renaiss listings of one crawled page in a handful of statements.
 
-            if not card:
-                logger.warning(f"Card ‘{card_name}’ not found in database.")
-                return None
+        Existing ids, content hashes and prices are preloaded in a single query, rows
+        whose hash is unchanged are skipped, and the rest go through INSERT ... ON
+        CONFLICT. Rows whose prices moved also get a price history tick.
 
-            # Fetch its listing
-            stmt_listing = select(Listing).where(Listing.card_id == card.id, Listing.source == "renaiss")
-            result_listing = await session.execute(stmt_listing)
-            listing = result_listing.scalars().first()
+        Returns:
+            The page counters, the ids of cards whose prices are new or moved,
+            and the ids of every card on the page.
+        """
+        # The same card can show up twice in one page if listings shift while crawling
+        batch = {card.renaiss_id: card for card in listed_cards}
+        if not batch:
+            return {"inserted": 0, "updated": 0, "unchanged": 0}, [], []
 
-            if not listing:
-                return None # Should not happen if data is consistent
+        stmt = (
+            select(Card.renaiss_id, Card.id.label("card_id"), Listing.id.label("listing_id"),
+                   Listing.content_hash, Listing.ask_price, Listing.fmv_price, Listing.offer_price)
+            .outerjoin(Listing, and_(Listing.card_id == Card.id, Listing.source == "renaiss"))
+            .where(Card.renaiss_id.in_(batch.keys()))
+        )
+        existing = {row.renaiss_id: row for row in (await session.execute(stmt)).all()}
 
-            return {
+        dirty, hashes, price_changed = [], {}, []
+        inserted = updated = unchanged = 0
+        for renaiss_id, card in batch.items():
+            content_hash = _content_hash(card)
+            known = existing.get(renaiss_id)
+            if known and known.content_hash == content_hash:
+                unchanged += 1
+                continue
+            if known and known.listing_id is not None:
+                updated += 1
+                old_prices = (known.ask_price, known.fmv_price, known.offer_price)
+            else:
+                inserted += 1
+                old_prices = None
+            if old_prices != (card.ask_price, card.fmv_price, card.offer_price):
+                price_changed.append(card)
+            dirty.append(card)
+            hashes[renaiss_id] = content_hash
+
+        if not dirty:
+            return {"inserted": 0, "updated": 0, "unchanged": unchanged}, [], [known.card_id for known in existing.values()]
+
+        insert = dialect_insert(session)
+        now = datetime.utcnow()
+
+        card_stmt = insert(Card).values([
+            {
+                "renaiss_id": card.renaiss_id,
+                "token_id": card.token_id,
                 "name": card.name,
                 "grade": card.grade,
                 "image_url": card.image_url,
-                "ask_price": listing.ask_price,
-                "fmv_price": listing.fmv_price,
-                "offer_price": listing.offer_price,
-                "link": listing.link
+                "last_updated": now,
+            }
+            for card in dirty
+        ])
+        card_stmt = card_stmt.on_conflict_do_update(
+            index_elements=[Card.renaiss_id],
+            set_={
+                "token_id": card_stmt.excluded.token_id,
+                "name": card_stmt.excluded.name,
+                "grade": card_stmt.excluded.grade,
+                "image_url": card_stmt.excluded.image_url,
+                "last_updated": card_stmt.excluded.last_updated,
+            },
+        )
+        await session.execute(card_stmt)
+
+        # Resolve ids for cards that did not exist before this batch
+        card_ids = {renaiss_id: known.card_id for renaiss_id, known in existing.items()}
+        new_ids = [card.renaiss_id for card in dirty if card.renaiss_id not in card_ids]
+        if new_ids:
+            result = await session.execute(select(Card.renaiss_id, Card.id).where(Card.renaiss_id.in_(new_ids)))
+            card_ids.update(result.all())
+
+        listing_stmt = insert(Listing).values([
+            {
+                "card_id": card_ids[card.renaiss_id],
+                "source": "renaiss",
+                "ask_price": card.ask_price,
+                "fmv_price": card.fmv_price,
+                "offer_price": card.offer_price,
+                "link": card.link,
+                "content_hash": hashes[card.renaiss_id],
             }
+            for card in dirty
+        ])
+        listing_stmt = listing_stmt.on_conflict_do_update(
+            index_elements=[Listing.card_id, Listing.source],
+            set_={
+                "ask_price": listing_stmt.excluded.ask_price,
+                "fmv_price": listing_stmt.excluded.fmv_price,
+                "offer_price": listing_stmt.excluded.offer_price,
+                "link": listing_stmt.excluded.link,
+                "content_hash": listing_stmt.excluded.content_hash,
+            },
+        )
+        await session.execute(listing_stmt)
+
+        changed_ids = [card_ids[card.renaiss_id] for card in price_changed]
+        await self.price_history.append_ticks(session, [
+            {
+                "card_id": card_id,
+                "source": "renaiss",
+                "ask_price": card.ask_price,
+                "fmv_price": card.fmv_price,
+                "offer_price": card.offer_price,
+                "recorded_at": now,
+            }
+            for card_id, card in zip(changed_ids, price_changed)
+        ])
+
+        return {"inserted": inserted, "updated": updated, "unchanged": unchanged}, changed_ids, list(card_ids.values())
+
+    async def close(self):
+        """Releases the pooled HTTP session held by the Renaiss adapter."""
+        await self.renaiss_adapter.close()
+
+    async def search_cards(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Returns the best matching cards for a name query, best first. Accepts aliases and grades like 'PSA 10'."""
+        snapshot = await market_snapshot.get()
+        return [snapshot.card_info(row) for row in snapshot.search_index.search(query, limit)]
+
+    async def get_card_info_by_name(self, card_name: str) -> Optional[Dict[str, Any]]:
+        """Retrieves detailed information for the best matching card by its name."""
+        logger.info(f"Searching for card: {card_name}")
+        matches = await self.search_cards(card_name, limit=1)
+        if not matches:
+            logger.warning(f"Card ‘{card_name}’ not found in search index.")
+            return None
+        hot_cards.mark([matches[0]["card_id"]], "queried")
+        return matches[0]
+
+    async def get_cards_by_names(self, card_names: List[str],
+                                 history_days: Optional[int] = None) -> List[Optional[Dict[str, Any]]]:
+        """
+        Resolves several card names at once, e.g. for a comparison.
+
+        Names are matched against the in-memory search index, then the
+        listings of every market and the daily price history of all matched
+        cards are read with one IN query each, run concurrently, so the
+        database cost does not grow with the number of names.
+
+        Returns:
+            One entry per name, in order: the card info dict with "listings"
+            (other markets) and "price_history" added, or None if not found.
+        """
+        snapshot = await market_snapshot.get()
+        matches = [snapshot.search_index.search(name, 1) for name in card_names]
+        cards = [snapshot.card_info(match[0]) if match else None for match in matches]
+        card_ids = list(dict.fromkeys(card["card_id"] for card in cards if card))
+        if not card_ids:
+            return cards
+        hot_cards.mark(card_ids, "queried")
+
+        async def load_listings() -> Dict[int, List[Dict[str, Any]]]:
+            listings: Dict[int, List[Dict[str, Any]]] = {}
+            async for session in get_session():
+                stmt = (select(Listing.card_id, Listing.source, Listing.ask_price, Listing.offer_price, Listing.link)
+                        .where(Listing.card_id.in_(card_ids), Listing.source != "renaiss"))
+                for card_id, source, ask_price, offer_price, link in (await session.execute(stmt)).all():
+                    listings.setdefault(card_id, []).append(
+                        {"source": source, "ask_price": ask_price, "offer_price": offer_price, "link": link})
+            return listings
+
+        listings, trends = await asyncio.gather(
+            load_listings(),
+            self.price_history.get_price_trends(card_ids, days=history_days or config.COMPARE_HISTORY_DAYS, bucket="1d"),
+        )
+        for card in cards:
+            if card:
+                card["listings"] = listings.get(card["card_id"], [])
+                card["price_history"] = trends.get(card["card_id"], [])
+        return cards
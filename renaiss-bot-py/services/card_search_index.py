@@ -0,0 +1,111 @@
+
+import re
+import unicodedata
+from collections import defaultdict
+from typing import List, Dict, Optional, Sequence, Tuple
+from services.card_aliases import CARD_ALIASES
+
+_GRADE_PATTERN = re.compile(r"\b(psa|bgs|cgc|sgc|ace)\s*(\d{1,2}(?:\.5)?)\b", re.IGNORECASE)
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+# Aliases sorted longest first so "月亮伊布" wins over "伊布"
+_ALIASES: List[Tuple[str, str]] = sorted(
+    ((alias.lower(), canonical.lower()) for canonical, aliases in CARD_ALIASES.items() for alias in aliases),
+    key=lambda pair: len(pair[0]),
+    reverse=True,
+)
+
+def normalize(text: str) -> str:
+    """Folds width and case and collapses punctuation to single spaces."""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return _NON_WORD.sub(" ", text).strip()
+
+def parse_grade(text: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Extracts (grading company, grade) from text such as 'PSA 10' or 'bgs9.5'."""
+    if not text:
+        return None, None
+    match = _GRADE_PATTERN.search(unicodedata.normalize("NFKC", text))
+    if match:
+        return match.group(1).lower(), match.group(2)
+    bare = re.fullmatch(r"\s*(\d{1,2}(?:\.5)?)\s*", text)
+    return (None, bare.group(1)) if bare else (None, None)
+
+def strip_grade(text: str) -> str:
+    """Removes grade mentions such as 'PSA 10' from text."""
+    return _GRADE_PATTERN.sub(" ", unicodedata.normalize("NFKC", text or ""))
+
+def expand_aliases(text: str) -> str:
+    """Replaces Chinese/Japanese aliases with the canonical English name used in listings."""
+    for alias, canonical in _ALIASES:
+        if alias in text:
+            text = text.replace(alias, f" {canonical} ")
+    return normalize(text)
+
+def _grams(text: str, size: int) -> List[str]:
+    return [text[i:i + size] for i in range(len(text) - size + 1)]
+
+class CardSearchIndex:
+    """
+    In-memory n-gram index over card names.
+
+    Every name is indexed by character trigrams, plus bigrams for non-ASCII
+    tokens so two-character CJK names still match. A lookup only reads the
+    posting lists of the query's rarest n-grams, so latency does not grow with
+    a scan of the whole catalog.
+    """
+
+    def __init__(self, names: Sequence[str], grades: Sequence[Optional[str]]):
+        self._names = [normalize(name) for name in names]
+        # Fall back to the title when the grade column is empty, e.g. "... PSA 10"
+        self._grades = [parse_grade(grade) if parse_grade(grade)[1] else parse_grade(name)
+                        for name, grade in zip(names, grades)]
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        for row, name in enumerate(self._names):
+            grams = set(_grams(name, 3))
+            for token in name.split():
+                if not token.isascii():
+                    grams.update(_grams(token, 2))
+            for gram in grams:
+                self._postings[gram].append(row)
+
+    def search(self, query: str, limit: int = 5) -> List[int]:
+        """
+        Returns the best matching rows for a query, best first.
+
+        The query may mix aliases and a grade filter, e.g. "喷火龙 PSA 10".
+        """
+        company, grade = parse_grade(query)
+        text = strip_grade(query) if grade else query
+        variants = {expand_aliases(normalize(text)), normalize(text)}
+
+        scores: Dict[int, float] = {}
+        for variant in filter(None, variants):
+            size = 3 if len(variant) >= 3 else 2
+            grams = set(_grams(variant, size))
+            if not grams:
+                continue
+            # A row needs half of the query grams, so it must contain at least one of
+            # the rarest len - need + 1 grams; only their postings are read.
+            need = (len(grams) + 1) // 2
+            rarest = sorted(grams, key=lambda gram: len(self._postings.get(gram, ())))[:len(grams) - need + 1]
+            candidates = set()
+            for gram in rarest:
+                candidates.update(self._postings.get(gram, ()))
+            for row in candidates:
+                name = self._names[row]
+                score = sum(gram in name for gram in grams) / len(grams)
+                if variant in name:
+                    score += 0.5
+                if score >= 0.5 and score > scores.get(row, 0.0):
+                    scores[row] = score
+
+        if grade:
+            scores = {row: score for row, score in scores.items() if self._grade_matches(row, company, grade)}
+        ranked = sorted(scores, key=lambda row: (-scores[row], len(self._names[row])))
+        return ranked[:limit]
+
+    def _grade_matches(self, row: int, company: Optional[str], grade: str) -> bool:
+        card_company, card_grade = self._grades[row]
+        if card_grade != grade:
+            return False
+        return company is None or card_company is None or card_company == company
@@ -0,0 +1,131 @@
+
+import asyncio
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from sqlalchemy import delete
+from sqlalchemy.future import select
+from models.database import ConversationTurn, get_session
+from config import config
+from utils.logger import logger
+
+class UserConversation:
+    """Recent messages of one user, oldest first, plus the card the conversation is about."""
+
+    __slots__ = ("turns", "last_card")
+
+    def __init__(self, max_turns: int):
+        self.turns: Deque[Tuple[str, str]] = deque(maxlen=max_turns)
+        self.last_card: Optional[str] = None
+
+class ConversationMemory:
+    """
+    Bounded per-user chat history.
+
+    Each user keeps a ring buffer of their last `max_turns` messages and at
+    most `max_users` users stay in memory, least recently active evicted
+    first. With `spill` enabled, evicted users are written to the database
+    and reloaded the next time they speak.
+    """
+
+    def __init__(self, max_turns: int, max_users: int, spill: bool = False):
+        self.max_turns = max_turns
+        self.max_users = max_users
+        self.spill = spill
+        self._users: "OrderedDict[str, UserConversation]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}  # Loads in flight, shared by concurrent messages of a user
+        self._spilling: Dict[str, UserConversation] = {}  # Evicted users whose save has not committed yet
+
+    async def get(self, user_id: str) -> UserConversation:
+        """Returns a user's conversation, marking the user as recently active."""
+        conversation = self._users.get(user_id)
+        if conversation is not None:
+            self._users.move_to_end(user_id)
+            return conversation
+
+        if not self.spill:
+            conversation = UserConversation(self.max_turns)
+        elif user_id in self._spilling:
+            # Still being written; the evicted object is newer than anything the database holds
+            conversation = self._spilling[user_id]
+        else:
+            conversation = await self._load_once(user_id)
+            current = self._users.get(user_id)
+            if current is not None:  # Another message of this user finished the same load first
+                self._users.move_to_end(user_id)
+                return current
+        self._users[user_id] = conversation
+        evicted = []
+        while len(self._users) > self.max_users:
+            evicted.append(self._users.popitem(last=False))
+        if evicted and self.spill:
+            self._spilling.update(evicted)
+            try:
+                await self._save(evicted)
+            finally:
+                for evicted_id, evicted_conversation in evicted:
+                    if self._spilling.get(evicted_id) is evicted_conversation:
+                        del self._spilling[evicted_id]
+        return conversation
+
+    async def append(self, user_id: str, user_message: str, reply: str, card_name: Optional[str] = None):
+        """Records one exchange; card_name, when given, becomes the subject of follow-up questions."""
+        conversation = await self.get(user_id)
+        conversation.turns.append(("user", user_message))
+        conversation.turns.append(("assistant", reply))
+        if card_name:
+            conversation.last_card = card_name
+
+    async def flush(self):
+        """Writes every in-memory conversation to the database, e.g. on shutdown."""
+        if self.spill and self._users:
+            await self._save(list(self._users.items()))
+
+    async def _load_once(self, user_id: str) -> UserConversation:
+        """Loads a user's history, sharing one query between concurrent callers."""
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+            loading.add_done_callback(
+                lambda done: self._loading.pop(user_id) if self._loading.get(user_id) is done else None)
+        # Shielded so one cancelled caller does not cancel the load for the others
+        return await asyncio.shield(loading)
+
+    async def _load(self, user_id: str) -> UserConversation:
+        conversation = UserConversation(self.max_turns)
+        async for session in get_session():
+            stmt = (
+                select(ConversationTurn.role, ConversationTurn.content, ConversationTurn.card_name)
+                .where(ConversationTurn.user_id == user_id)
+                .order_by(ConversationTurn.id.desc())
+                .limit(self.max_turns)
+            )
+            rows = (await session.execute(stmt)).all()
+        for role, content, card_name in reversed(rows):
+            conversation.turns.append((role, content))
+            conversation.last_card = card_name or conversation.last_card
+        return conversation
+
+    async def _save(self, conversations: List[Tuple[str, UserConversation]]):
+        """Replaces the stored history of the given users with their in-memory turns."""
+        try:
+            async for session in get_session():
+                user_ids = [user_id for user_id, _ in conversations]
+                await session.execute(delete(ConversationTurn).where(ConversationTurn.user_id.in_(user_ids)))
+                rows = []
+                for user_id, conversation in conversations:
+                    for position, (role, content) in enumerate(conversation.turns, start=1):
+                        last = position == len(conversation.turns)
+                        rows.append({"user_id": user_id, "role": role, "content": content,
+                                     "card_name": conversation.last_card if last else None})
+                if rows:
+                    await session.execute(ConversationTurn.__table__.insert(), rows)
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error saving conversation history: {e}")
+
+# Shared by every chat handler in this process
+conversation_memory = ConversationMemory(
+    max_turns=config.CONVERSATION_MAX_TURNS,
+    max_users=config.CONVERSATION_MAX_USERS,
+    spill=config.CONVERSATION_SPILL,
+)
@@ -0,0 +1,226 @@
+
+import asyncio
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, List, Dict, Any, Optional, Tuple
+from sqlalchemy import delete, insert
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from adapters.market_adapter import MarketAdapter, load_market_adapters
+from models.database import Listing, get_session
+from services.market_snapshot import MarketSnapshot, market_snapshot
+from config import config
+from utils.cache import TTLCache
+from utils.metrics import metrics
+from utils.logger import logger
+
+MARKET_FETCH_SECONDS = metrics.histogram("market_fetch_seconds", "Latency of fetching one market's listings.", ["source"])
+MARKET_LISTINGS = metrics.gauge("market_listings", "Listings fetched per market and how many matched a Renaiss card.", ["source", "result"])
+
+# Keyed by snapshot version, like the FMV arbitrage cache
+_result_cache = TTLCache(maxsize=config.ARBITRAGE_CACHE_SIZE, ttl_seconds=config.MONITOR_INTERVAL_SECONDS * 2)
+
+# (source, card_id, ask incl. buy fee, sale proceeds after sell fee, raw ask, raw sale price, link)
+Quote = Tuple[str, int, Optional[float], Optional[float], Optional[float], Optional[float], Optional[str]]
+
+def _net(price: Optional[float], fee_percent: float, sign: int) -> Optional[float]:
+    return None if price is None or price <= 0 else price * (1 + sign * fee_percent / 100)
+
+def best_spread(quotes: List[Quote]) -> Optional[Tuple[Quote, Quote, float]]:
+    """
+    Returns (buy quote, sell quote, profit) for the widest buy-low/sell-high
+    spread between two different sources, net of fees, or None.
+    """
+    best_buy: Dict[str, Quote] = {}
+    best_sell: Dict[str, Quote] = {}
+    for quote in quotes:
+        source, _, buy, sell = quote[:4]
+        if buy is not None and (source not in best_buy or buy < best_buy[source][2]):
+            best_buy[source] = quote
+        if sell is not None and (source not in best_sell or sell > best_sell[source][3]):
+            best_sell[source] = quote
+
+    best = None
+    for buy_source, buy in best_buy.items():
+        for sell_source, sell in best_sell.items():
+            if buy_source == sell_source:
+                continue
+            profit = sell[3] - buy[2]
+            if best is None or profit > best[2]:
+                best = (buy, sell, profit)
+    return best
+
+class CrossMarketService:
+    """
+    Fetches listings from every configured market, matches them to Renaiss
+    cards by identity hash and finds spreads between markets.
+    """
+
+    def __init__(self, adapters: Optional[List[MarketAdapter]] = None):
+        self._adapters = adapters
+
+    @property
+    def adapters(self) -> List[MarketAdapter]:
+        """Adapters registered in config.MARKET_ADAPTERS, loaded on first use."""
+        if self._adapters is None:
+            self._adapters = load_market_adapters(config.MARKET_ADAPTERS)
+        return self._adapters
+
+    def fees(self) -> Dict[str, Tuple[float, float]]:
+        """Returns source -> (buy fee %, sell fee %), Renaiss included."""
+        fees = {adapter.source: (adapter.buy_fee_percent, adapter.sell_fee_percent) for adapter in self.adapters}
+        fees["renaiss"] = (config.RENAISS_BUY_FEE_PERCENT, config.RENAISS_SELL_FEE_PERCENT)
+        return fees
+
+    async def fetch_all(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Fetches every market concurrently. A market that fails or times out is
+        left out of the result, so its stored listings are kept as they were.
+        """
+        async def fetch(adapter: MarketAdapter):
+            started = time.perf_counter()
+            try:
+                listings = await asyncio.wait_for(adapter.fetch_listings(), config.MARKET_FETCH_TIMEOUT_SECONDS)
+                return adapter.source, listings
+            except Exception as e:
+                logger.error(f"Error fetching listings from {adapter.source}: {e}")
+                return adapter.source, None
+            finally:
+                MARKET_FETCH_SECONDS.observe(time.perf_counter() - started, source=adapter.source)
+
+        results = await asyncio.gather(*(fetch(adapter) for adapter in self.adapters))
+        return {source: listings for source, listings in results if listings is not None}
+
+    async def store(self, fetched: Dict[str, List[Dict[str, Any]]], snapshot: MarketSnapshot,
+                    fence: Optional[Callable[[AsyncSession], Awaitable[None]]] = None) -> Dict[str, int]:
+        """
+        Matches fetched listings to Renaiss cards and replaces each market's stored listings.
+
+        Listings are attached to the first Renaiss card with the same identity.
+        Only the lowest ask and the highest bid per card and market are kept,
+        which is all the spread calculation needs.
+
+        `fence`, if given, is awaited inside the transaction before it commits.
+
+        Returns:
+            Matched listing counts per source.
+        """
+        index = snapshot.identity_index
+        matched_counts = {}
+        async for session in get_session():
+            for source, listings in fetched.items():
+                best: Dict[int, Dict[str, Any]] = {}
+                for listing in listings:
+                    key = index.resolve(listing)
+                    if key is None:
+                        continue
+                    card_id = int(snapshot.card_ids[index.rows(key)[0]])
+                    row = best.setdefault(card_id, {"card_id": card_id, "source": source, "ask_price": None,
+                                                    "offer_price": None, "link": None})
+                    ask, bid = listing.get("ask_price"), listing.get("bid_price")
+                    if ask is not None and (row["ask_price"] is None or ask < row["ask_price"]):
+                        row["ask_price"], row["link"] = ask, listing.get("link")
+                    if bid is not None and (row["offer_price"] is None or bid > row["offer_price"]):
+                        row["offer_price"] = bid
+                        row["link"] = row["link"] or listing.get("link")
+
+                MARKET_LISTINGS.set(len(listings), source=source, result="fetched")
+                MARKET_LISTINGS.set(len(best), source=source, result="matched")
+                matched_counts[source] = len(best)
+
+                # Replace the market's listings inside this transaction, in batches that
+                # stay under the database's bind-parameter limit
+                await session.execute(delete(Listing).where(Listing.source == source))
+                rows = list(best.values())
+                for start in range(0, len(rows), config.MARKET_STORE_BATCH_SIZE):
+                    await session.execute(insert(Listing), rows[start:start + config.MARKET_STORE_BATCH_SIZE])
+            if fence is not None:
+                await fence(session)
+            await session.commit()
+        _result_cache.clear()
+        if matched_counts:
+            logger.info(f"Stored cross-market listings: {matched_counts}")
+        return matched_counts
+
+    async def find_opportunities(self, min_profit_percent: float = 5.0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Finds buy-low/sell-high spreads between markets, highest profit first.
+
+        Other markets' listings are grouped with every Renaiss row of the same
+        identity through the snapshot's hash index.
+        """
+        snapshot = await market_snapshot.get()
+        key = (min_profit_percent, limit, snapshot.version)
+        opportunities = _result_cache.get(key)
+        if opportunities is None:
+            opportunities = await self._scan(snapshot, min_profit_percent, limit)
+            _result_cache.set(key, opportunities)
+        return list(opportunities)
+
+    async def _scan(self, snapshot: MarketSnapshot, min_profit_percent: float,
+                    limit: Optional[int]) -> List[Dict[str, Any]]:
+        if not self.adapters:
+            return []
+        async for session in get_session():
+            stmt = select(Listing.card_id, Listing.source, Listing.ask_price, Listing.offer_price, Listing.link)
+            external = (await session.execute(stmt.where(Listing.source != "renaiss"))).all()
+        if not external:
+            return []
+
+        fees = self.fees()
+        index = snapshot.identity_index
+        row_by_card = {card_id: row for row, card_id in enumerate(snapshot.card_ids.tolist())}
+        groups: Dict[str, List[Quote]] = defaultdict(list)
+        for card_id, source, ask, bid, link in external:
+            row = row_by_card.get(card_id)
+            if row is None or source not in fees:
+                continue
+            buy_fee, sell_fee = fees[source]
+            sale = bid if bid is not None else ask
+            groups[index.keys[row]].append(
+                (source, card_id, _net(ask, buy_fee, 1), _net(sale, sell_fee, -1), ask, sale, link))
+
+        buy_fee, sell_fee = fees["renaiss"]
+        for key, quotes in groups.items():
+            for row in index.rows(key):
+                ask, bid = float(snapshot.ask_prices[row]), float(snapshot.offer_prices[row])
+                ask = None if ask != ask else ask  # NaN marks a missing price
+                bid = None if bid != bid else bid
+                quotes.append(("renaiss", int(snapshot.card_ids[row]), _net(ask, buy_fee, 1),
+                               _net(bid, sell_fee, -1), ask, bid, snapshot.links[row]))
+
+        opportunities = []
+        for quotes in groups.values():
+            spread = best_spread(quotes)
+            if spread is None:
+                continue
+            buy, sell, profit = spread
+            profit_percent = profit / buy[2] * 100
+            if profit_percent < min_profit_percent:
+                continue
+            info = snapshot.card_info(row_by_card[buy[1]] if buy[1] in row_by_card else row_by_card[sell[1]])
+            opportunities.append({
+                "card_id": info["card_id"],
+                "card_name": info["name"],
+                "grade": info["grade"],
+                "image_url": info["image_url"],
+                "buy_source": buy[0],
+                "buy_price": round(buy[4], 2),
+                "buy_link": buy[6],
+                "sell_source": sell[0],
+                "sell_price": round(sell[5], 2),
+                "sell_link": sell[6],
+                "profit_percent": round(profit_percent, 2),
+                "profit_usd": round(profit, 2),
+                "type": "Cross-Platform Arbitrage"
+            })
+        opportunities.sort(key=lambda opp: opp["profit_percent"], reverse=True)
+        return opportunities[:limit] if limit is not None else opportunities
+
+    async def close(self):
+        """Closes every adapter's connections."""
+        for adapter in self._adapters or []:
+            await adapter.close()
+
+# Shared by the refresh job and the /arbitrage handler
+cross_market = CrossMarketService()
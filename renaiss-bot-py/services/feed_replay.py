@@ -0,0 +1,247 @@
+
+"""
+Offline replay of a recorded Renaiss feed, for backtesting arbitrage thresholds.
+
+Pages recorded with config.FEED_RECORD_DIR are normalized by the live adapter
+code, applied to an in-memory copy of the listing table crawl by crawl, and
+each crawl's market is scored with the same MarketSnapshot arithmetic the bot
+uses. The report says, per threshold, how many opportunities would have been
+surfaced, how long they lasted and how much profit sat below the threshold.
+
+Usage:
+    python -m services.feed_replay --dir ./data/feed --thresholds 2,5,10,20
+    python -m services.feed_replay --dir ./data/feed --speed 3600 --output backtest.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from adapters.renaiss_adapter import ListedCard, RenaissAdapter
+from services.market_snapshot import MarketSnapshot
+from utils.feed_log import FeedRecord, read_feed_log
+from utils.logger import logger
+
+class _Episodes:
+    """Tracks, per card row, the runs of consecutive snapshots in which a card reaches one profit level."""
+
+    def __init__(self, level: float):
+        self.level = level
+        self.open_since = np.empty(0)  # Snapshot time the current run started, NaN when not in a run
+        self.peak_percent = np.empty(0)
+        self.peak_usd = np.empty(0)
+        self.seen = np.empty(0, dtype=bool)  # Card ever reached the level
+        self.started = 0
+        self.durations: List[np.ndarray] = []
+        self.peaks_percent: List[np.ndarray] = []
+        self.peaks_usd: List[np.ndarray] = []
+        self.open_total = 0  # Sum over snapshots of the runs open in it
+
+    def _grow(self, rows: int):
+        extra = rows - len(self.open_since)
+        if extra > 0:
+            self.open_since = np.concatenate([self.open_since, np.full(extra, np.nan)])
+            self.peak_percent = np.concatenate([self.peak_percent, np.full(extra, np.nan)])
+            self.peak_usd = np.concatenate([self.peak_usd, np.full(extra, np.nan)])
+            self.seen = np.concatenate([self.seen, np.zeros(extra, dtype=bool)])
+
+    def update(self, at: float, last_at: float, percent: np.ndarray, usd: np.ndarray):
+        self._grow(len(percent))
+        active = percent >= self.level  # NaN compares False, as in MarketSnapshot.count_opportunities
+        running = ~np.isnan(self.open_since)
+        self._close(running & ~active, last_at)
+        new = active & ~running
+        self.open_since[new] = at
+        self.peak_percent[new] = percent[new]
+        self.peak_usd[new] = usd[new]
+        self.peak_percent[active] = np.fmax(self.peak_percent[active], percent[active])
+        self.peak_usd[active] = np.fmax(self.peak_usd[active], usd[active])
+        self.seen |= active
+        self.started += int(np.count_nonzero(new))
+        self.open_total += int(np.count_nonzero(active))
+
+    def finish(self, last_at: float) -> int:
+        """Closes the runs still open after the last snapshot. Returns how many there were."""
+        running = ~np.isnan(self.open_since)
+        self._close(running, last_at)
+        return int(np.count_nonzero(running))
+
+    def _close(self, rows: np.ndarray, last_at: float):
+        if not rows.any():
+            return
+        # A run lasts from the first to the last snapshot it was seen in
+        self.durations.append(last_at - self.open_since[rows])
+        self.peaks_percent.append(self.peak_percent[rows])
+        self.peaks_usd.append(self.peak_usd[rows])
+        self.open_since[rows] = np.nan
+
+    def closed(self, values: List[np.ndarray]) -> np.ndarray:
+        return np.concatenate(values) if values else np.empty(0)
+
+class FeedReplay:
+    """
+    Replays recorded crawls and scores a set of profit thresholds.
+
+    Every crawl's pages are upserted into the in-memory listing table by
+    Renaiss id, exactly as the refresh job upserts them into the database,
+    and the market is scored once the crawl's last page is in. Runs that
+    never reach a threshold but clear `floor` count as missed for it.
+    """
+
+    def __init__(self, thresholds: Sequence[float], floor: float = 0.0, speed: Optional[float] = None):
+        self.thresholds = sorted(thresholds)
+        self.floor = floor
+        self.speed = speed  # Recorded seconds per wall-clock second; None replays as fast as possible
+        self.adapter = RenaissAdapter()
+        self._rows: Dict[str, int] = {}
+        self._cards: List[ListedCard] = []
+        self._asks: List[float] = []
+        self._fmvs: List[float] = []
+        self._levels = {threshold: _Episodes(threshold) for threshold in self.thresholds}
+        self._base = _Episodes(floor)
+        self.pages = 0
+        self.bad_pages = 0
+        self.changes = 0
+        self.snapshots = 0
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+
+    def run(self, directory: str) -> Dict[str, Any]:
+        """Replays every segment in `directory` and returns the report."""
+        started = time.perf_counter()
+        crawl: List[FeedRecord] = []
+        for record in read_feed_log(directory):
+            if crawl and record.crawl_id != crawl[0].crawl_id:
+                self._replay_crawl(crawl, started)
+                crawl = []
+            crawl.append(record)
+        if crawl:
+            self._replay_crawl(crawl, started)
+        return self.report(time.perf_counter() - started)
+
+    def _replay_crawl(self, records: List[FeedRecord], started: float):
+        at = max(record.recorded_at for record in records)
+        if self.first_at is None:
+            self.first_at = at
+        if self.speed:
+            # Scaled wall clock: wait until this crawl is due relative to the first one
+            delay = (at - self.first_at) / self.speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        for record in records:
+            try:
+                self._upsert(self.adapter.parse_page(record.body))
+            except ValueError as e:
+                self.bad_pages += 1
+                logger.warning(f"Skipping recorded page at offset {record.offset}: {e}")
+            self.pages += 1
+        self._score(at)
+
+    def _upsert(self, cards: List[ListedCard]):
+        for card in cards:
+            row = self._rows.get(card.renaiss_id)
+            if row is None:
+                self._rows[card.renaiss_id] = len(self._cards)
+                self._cards.append(card)
+                self._asks.append(np.nan if card.ask_price is None else card.ask_price)
+                self._fmvs.append(np.nan if card.fmv_price is None else card.fmv_price)
+            elif self._cards[row] != card:
+                self._cards[row] = card
+                self._asks[row] = np.nan if card.ask_price is None else card.ask_price
+                self._fmvs[row] = np.nan if card.fmv_price is None else card.fmv_price
+                self.changes += 1
+
+    def _score(self, at: float):
+        asks = np.array(self._asks, dtype=np.float64)
+        fmvs = np.array(self._fmvs, dtype=np.float64)
+        rows = len(asks)
+        snapshot = MarketSnapshot(
+            version=self.snapshots + 1, card_ids=np.arange(rows, dtype=np.int64), ask_prices=asks,
+            fmv_prices=fmvs, offer_prices=np.full(rows, np.nan), names=[], grades=[], image_urls=[], links=[])
+        percent = snapshot.profit_percent
+        usd = fmvs - asks
+        last_at = at if self.last_at is None else self.last_at
+        for episodes in (self._base, *self._levels.values()):
+            episodes.update(at, last_at, percent, usd)
+        self.snapshots += 1
+        self.last_at = at
+
+    def report(self, seconds: float) -> Dict[str, Any]:
+        if self.last_at is None:
+            return {"snapshots": 0, "pages": self.pages, "thresholds": []}
+        self._base.finish(self.last_at)
+        base_percent = self._base.closed(self._base.peaks_percent)
+        base_usd = self._base.closed(self._base.peaks_usd)
+        thresholds = []
+        for threshold, episodes in self._levels.items():
+            open_at_end = episodes.finish(self.last_at)
+            missed = base_percent < threshold
+            thresholds.append({
+                "threshold": threshold,
+                "opportunities": episodes.started,
+                "open_at_end": open_at_end,
+                "distinct_cards": int(np.count_nonzero(episodes.seen)),
+                "mean_open": round(episodes.open_total / self.snapshots, 2),
+                "duration_seconds": _percentiles(episodes.closed(episodes.durations)),
+                "surfaced_profit_usd": round(float(np.nansum(episodes.closed(episodes.peaks_usd))), 2),
+                "missed": {
+                    "opportunities": int(np.count_nonzero(missed)),
+                    "profit_usd": round(float(np.nansum(base_usd[missed])), 2),
+                },
+            })
+        return {
+            "from": _iso(self.first_at),
+            "to": _iso(self.last_at),
+            "snapshots": self.snapshots,
+            "pages": self.pages,
+            "bad_pages": self.bad_pages,
+            "listings": len(self._cards),
+            "listing_changes": self.changes,
+            "floor_percent": self.floor,
+            "floor_opportunities": len(base_percent),
+            "replay_seconds": round(seconds, 3),
+            "pages_per_second": round(self.pages / seconds, 1) if seconds else None,
+            "thresholds": thresholds,
+        }
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _percentiles(samples: np.ndarray) -> Dict[str, float]:
+    if not len(samples):
+        return {}
+    p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+    return {"count": len(samples), "p50": round(float(p50), 1), "p90": round(float(p90), 1),
+            "p99": round(float(p99), 1), "max": round(float(samples.max()), 1), "mean": round(float(samples.mean()), 1)}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest arbitrage thresholds against a recorded Renaiss feed.")
+    parser.add_argument("--dir", required=True, help="Feed directory written with FEED_RECORD_DIR")
+    parser.add_argument("--thresholds", default="2,5,10,20,50", type=lambda v: [float(t) for t in v.split(",")],
+                        help="Comma-separated profit percentages to score")
+    parser.add_argument("--floor", type=float, default=0.0,
+                        help="Profit percentage above which an opportunity below a threshold counts as missed")
+    parser.add_argument("--speed", type=float, default=None,
+                        help="Replay at this multiple of recorded time instead of as fast as possible")
+    parser.add_argument("--output", default="-", help="Path for the JSON report, '-' for stdout")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    report = FeedReplay(args.thresholds, floor=args.floor, speed=args.speed).run(args.dir)
+
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output == "-":
+        print(payload)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+
+if __name__ == "__main__":
+    main()
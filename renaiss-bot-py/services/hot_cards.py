@@ -0,0 +1,56 @@
+
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Set
+from config import config
+
+class HotCardTracker:
+    """
+    Cards worth refreshing on the fast lane: recently changed, close to an
+    arbitrage threshold, or recently queried by users. Each mark expires
+    after a TTL unless the card is marked again.
+
+    The listing API only pages by offset, so the tracker also remembers the
+    page each card was last crawled on; the fast lane re-crawls the pages
+    that hold hot cards.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._expires: Dict[int, float] = {}
+        self._pages: Dict[int, int] = {}  # card_id -> listing page it was last crawled on
+        self.marks = Counter()
+
+    def mark(self, card_ids: Iterable[int], reason: str):
+        """Marks cards as hot for the next ttl_seconds."""
+        expires = time.monotonic() + self.ttl_seconds
+        for card_id in card_ids:
+            self._expires[card_id] = expires
+            self.marks[reason] += 1
+
+    def active(self) -> Set[int]:
+        """Returns the cards that are still hot, dropping expired marks."""
+        now = time.monotonic()
+        expired = [card_id for card_id, expires in self._expires.items() if expires <= now]
+        for card_id in expired:
+            del self._expires[card_id]
+        return set(self._expires)
+
+    def locate(self, card_ids: Iterable[int], page: int):
+        """Records the listing page the cards were just crawled on."""
+        for card_id in card_ids:
+            self._pages[card_id] = page
+
+    def hot_pages(self, limit: int) -> List[int]:
+        """
+        Pages holding hot cards, the ones with the most hot cards first, at most `limit`.
+        Hot cards never seen by a crawl have no page and are left to the full sweep.
+        """
+        counts = Counter(self._pages[card_id] for card_id in self.active() if card_id in self._pages)
+        return [page for page, _ in counts.most_common(limit)]
+
+    def __len__(self) -> int:
+        return len(self.active())
+
+# Shared by the scheduler and the handlers that record user interest
+hot_cards = HotCardTracker(config.HOT_CARD_TTL_SECONDS)
@@ -0,0 +1,129 @@
+
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import case, or_, update
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.database import DataVersion, Lease, get_session, dialect_insert
+from utils.metrics import metrics
+from utils.logger import logger
+
+LEADER = metrics.gauge("leader", "1 while this process holds the named lease.", ["lease"])
+LEADER_CHANGES = metrics.counter("leader_changes_total", "Times this process gained or lost a lease.", ["lease", "change"])
+
+class LeaseLost(Exception):
+    """Raised by LeaderElector.fence when this process no longer holds the lease."""
+
+class LeaderElector:
+    """
+    Lease-based leader election on a database row.
+
+    Every process calls heartbeat() periodically. It renews the lease when
+    this process holds it, or takes it over when it is free or expired; each
+    takeover bumps the fencing token. The leader calls fence() inside its
+    write transactions, so a process that lost the lease (e.g. after a long
+    pause) cannot commit writes on top of the new leader's.
+    """
+
+    def __init__(self, name: str, node_id: str, lease_seconds: float):
+        self.name = name
+        self.node_id = node_id
+        self.lease_seconds = lease_seconds
+        self.token: Optional[int] = None
+        # Local monotonic deadline; we stop acting as leader at the latest when the lease would lapse
+        self._valid_until = 0.0
+
+    @property
+    def is_leader(self) -> bool:
+        return self.token is not None and time.monotonic() < self._valid_until
+
+    async def heartbeat(self) -> bool:
+        """Renews or tries to take the lease. Returns whether this process is the leader afterwards."""
+        was_leader = self.token is not None
+        started = time.monotonic()
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        token = None
+        try:
+            async for session in get_session():
+                result = await session.execute(
+                    update(Lease)
+                    .where(Lease.name == self.name, or_(Lease.holder == self.node_id, Lease.expires_at < now))
+                    .values(token=case((Lease.holder == self.node_id, Lease.token), else_=Lease.token + 1),
+                            holder=self.node_id, expires_at=expires_at)
+                )
+                if result.rowcount == 0:
+                    # No row yet: the first process to insert it wins
+                    stmt = dialect_insert(session)(Lease).values(
+                        name=self.name, holder=self.node_id, token=1, expires_at=expires_at)
+                    await session.execute(stmt.on_conflict_do_nothing(index_elements=[Lease.name]))
+                token = await session.scalar(
+                    select(Lease.token).where(Lease.name == self.name, Lease.holder == self.node_id))
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Lease '{self.name}' heartbeat failed: {e}")
+            return self.is_leader  # Keep acting until the current lease runs out, then step down
+
+        self.token = token
+        self._valid_until = started + self.lease_seconds if token is not None else 0.0
+        if (token is not None) != was_leader:
+            change = "gained" if self.is_leader else "lost"
+            LEADER_CHANGES.inc(lease=self.name, change=change)
+            logger.info(f"Node {self.node_id} {change} lease '{self.name}'"
+                        + (f" (fencing token {token})." if token is not None else "."))
+        LEADER.set(1 if self.is_leader else 0, lease=self.name)
+        return self.is_leader
+
+    async def fence(self, session: AsyncSession):
+        """
+        Checks, inside the caller's transaction, that this process still holds
+        the lease with its current token. Raises LeaseLost otherwise.
+
+        The check is a no-op UPDATE of the lease row, so it also locks the row
+        until the caller commits and a takeover cannot slip in between.
+        """
+        if self.token is None:
+            raise LeaseLost(f"Node {self.node_id} does not hold lease '{self.name}'")
+        result = await session.execute(
+            update(Lease)
+            .where(Lease.name == self.name, Lease.holder == self.node_id, Lease.token == self.token,
+                   Lease.expires_at > datetime.utcnow())
+            .values(holder=self.node_id)
+        )
+        if result.rowcount != 1:
+            self.token = None
+            LEADER.set(0, lease=self.name)
+            raise LeaseLost(f"Node {self.node_id} lost lease '{self.name}'")
+
+    async def release(self):
+        """Gives the lease up, e.g. on shutdown, so another process can take over without waiting for it to expire."""
+        if self.token is None:
+            return
+        try:
+            async for session in get_session():
+                await session.execute(
+                    update(Lease)
+                    .where(Lease.name == self.name, Lease.holder == self.node_id, Lease.token == self.token)
+                    .values(expires_at=datetime.utcnow())
+                )
+                await session.commit()
+            logger.info(f"Node {self.node_id} released lease '{self.name}'.")
+        except Exception as e:
+            logger.error(f"Error releasing lease '{self.name}': {e}")
+        self.token = None
+        LEADER.set(0, lease=self.name)
+
+async def bump_version(session: AsyncSession, name: str):
+    """Increments a data version inside the caller's transaction."""
+    result = await session.execute(
+        update(DataVersion).where(DataVersion.name == name).values(version=DataVersion.version + 1))
+    if result.rowcount == 0:
+        stmt = dialect_insert(session)(DataVersion).values(name=name, version=1)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[DataVersion.name], set_={"version": DataVersion.version + 1}))
+
+async def read_version(name: str) -> int:
+    """Returns the current data version, 0 if it was never bumped."""
+    async for session in get_session():
+        return await session.scalar(select(DataVersion.version).where(DataVersion.name == name)) or 0
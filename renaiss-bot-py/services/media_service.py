@@ -0,0 +1,297 @@
+
+import asyncio
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+import aiohttp
+from sqlalchemy import and_
+from sqlalchemy.future import select
+from telegram import InputMediaPhoto
+from core.outbound_queue import INTERACTIVE, outbound
+from models.database import CardMedia, get_session, dialect_insert
+from config import config
+from utils.cache import TTLCache
+from utils.metrics import metrics
+from utils.single_flight import SingleFlight
+from utils.logger import logger
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; thumbnails are then stored as downloaded
+    Image = None
+
+MEDIA_SENDS = metrics.counter("media_sends_total", "Card images sent, by whether a cached file_id was reused.", ["variant", "source"])
+THUMBNAIL_LOOKUPS = metrics.counter("thumbnail_lookups_total", "Thumbnail store lookups.", ["result"])
+
+def _make_thumbnail(data: bytes, max_side: int) -> bytes:
+    """Downscales an image to fit max_side and re-encodes it as JPEG."""
+    if Image is None:
+        return data
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((max_side, max_side))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=85, optimize=True)
+        return output.getvalue()
+
+class ThumbnailStore:
+    """
+    On-disk cache of downscaled card images, capped at `max_bytes` in total.
+
+    The least recently used files are evicted first. File mtimes are bumped on
+    every hit, so the LRU order survives restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_side: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self._files: "OrderedDict[str, int]" = OrderedDict()  # path -> size, least recently used first
+        self._total = 0
+        self._loaded = False
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._single_flight = SingleFlight()
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._files[path] = size
+            self._total += size
+        self._loaded = True
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.blake2b(url.encode("utf-8"), digest_size=16).hexdigest() + ".jpg")
+
+    async def get(self, url: str) -> Optional[bytes]:
+        """Returns the thumbnail for an image URL, downloading and scaling it on a miss."""
+        if not self._loaded:
+            await asyncio.to_thread(self._load)
+        path = self._path(url)
+        if path in self._files:
+            self._files.move_to_end(path)
+            try:
+                data = await asyncio.to_thread(_read_and_touch, path)
+                THUMBNAIL_LOOKUPS.inc(result="hit")
+                return data
+            except OSError:
+                self._drop(path)
+        THUMBNAIL_LOOKUPS.inc(result="miss")
+        # Concurrent galleries showing the same card share one download
+        return await self._single_flight.do(url, lambda: self._fetch(url, path))
+
+    async def _fetch(self, url: str, path: str) -> Optional[bytes]:
+        try:
+            if self._session is None or self._session.closed:
+                self._session = aiohttp.ClientSession(
+                    timeout=aiohttp.ClientTimeout(total=config.MEDIA_DOWNLOAD_TIMEOUT_SECONDS))
+            async with self._session.get(url) as response:
+                response.raise_for_status()
+                limit = config.MEDIA_MAX_DOWNLOAD_BYTES
+                if response.content_length is not None and response.content_length > limit:
+                    raise ValueError(f"image larger than {limit} bytes")
+                # content.read(n) returns what is buffered so far, so read the body chunk by chunk up to the cap
+                chunks, size = [], 0
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > limit:
+                        raise ValueError(f"image larger than {limit} bytes")
+                    chunks.append(chunk)
+                data = b"".join(chunks)
+            thumbnail = await asyncio.to_thread(_make_thumbnail, data, self.max_side)
+            await asyncio.to_thread(_write, path, thumbnail)
+        except Exception as e:
+            logger.warning(f"Could not build thumbnail for {url}: {e}")
+            return None
+        self._files[path] = len(thumbnail)
+        self._total += len(thumbnail)
+        self._evict()
+        return thumbnail
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._files:
+            path, _ = next(iter(self._files.items()))
+            self._drop(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _drop(self, path: str):
+        self._total -= self._files.pop(path, 0)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+def _read_and_touch(path: str) -> bytes:
+    with open(path, "rb") as f:
+        data = f.read()
+    os.utime(path)
+    return data
+
+def _write(path: str, data: bytes):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _file_id(message) -> Optional[str]:
+    """Returns the file_id of the largest size of a sent photo."""
+    return message.photo[-1].file_id if getattr(message, "photo", None) else None
+
+class MediaService:
+    """
+    Sends card images through the outbound queue.
+
+    The first send of an image lets Telegram fetch the URL (or uploads a local
+    thumbnail); the resulting file_id is stored per card and reused for every
+    later send until the card's image URL changes.
+    """
+
+    def __init__(self):
+        self.thumbnails = ThumbnailStore(config.THUMBNAIL_DIR, config.THUMBNAIL_CACHE_MAX_BYTES,
+                                         config.THUMBNAIL_MAX_SIDE)
+        # (card_id, variant) -> (image_url, file_id); a negative lookup is cached as None
+        self._file_ids = TTLCache(maxsize=config.MEDIA_FILE_ID_CACHE_SIZE, ttl_seconds=24 * 3600)
+        self._tasks = set()
+
+    async def send_card_photo(self, chat_id: int, card: Dict[str, Any], caption: Optional[str] = None,
+                              priority: int = INTERACTIVE) -> Optional[asyncio.Future]:
+        """
+        Queues a card's photo and returns without waiting for delivery.
+
+        Messages queued afterwards for the same chat are sent after it.
+        """
+        image_url = card.get("image_url")
+        if not config.MEDIA_ENABLED or not image_url:
+            return None
+        cached = (await self._cached_file_ids([card["card_id"]], "photo")).get(card["card_id"])
+        photo = cached[1] if cached and cached[0] == image_url else image_url
+        future = outbound.enqueue(chat_id, caption or "", priority, mergeable=False, method="send_photo", photo=photo)
+        MEDIA_SENDS.inc(variant="photo", source="file_id" if photo != image_url else "url")
+        future.add_done_callback(lambda done: self._after_send(done, [(card["card_id"], image_url, photo == image_url)],
+                                                               "photo"))
+        return future
+
+    async def send_gallery(self, chat_id: int, opportunities: List[Dict[str, Any]],
+                           priority: int = INTERACTIVE) -> Optional[asyncio.Future]:
+        """Queues a media group of card thumbnails with short captions for an opportunity list."""
+        unique: Dict[int, Dict[str, Any]] = {}
+        for opp in opportunities:
+            if opp.get("image_url"):
+                unique.setdefault(opp["card_id"], opp)  # A card can show up under several opportunity types
+        cards = list(unique.values())[:config.MEDIA_GALLERY_SIZE]
+        if not config.MEDIA_ENABLED or len(cards) < 2:
+            return None  # Telegram media groups need at least two items
+        cached = await self._cached_file_ids([opp["card_id"] for opp in cards], "thumb")
+
+        async def media_for(opp) -> Tuple[Dict[str, Any], Optional[Any], bool]:
+            entry = cached.get(opp["card_id"])
+            if entry and entry[0] == opp["image_url"]:
+                return opp, entry[1], False
+            return opp, await self.thumbnails.get(opp["image_url"]), True
+
+        items = [item for item in await asyncio.gather(*(media_for(opp) for opp in cards)) if item[1] is not None]
+        if len(items) < 2:
+            return None
+        media = [InputMediaPhoto(media, caption=f"{opp['card_name']} +{opp['profit_percent']}%")
+                 for opp, media, _ in items]
+        future = outbound.enqueue(chat_id, "", priority, mergeable=False, method="send_media_group", media=media)
+        sent = [(opp["card_id"], opp["image_url"], fresh) for opp, _, fresh in items]
+        for _, _, fresh in items:
+            MEDIA_SENDS.inc(variant="thumb", source="upload" if fresh else "file_id")
+        future.add_done_callback(lambda done: self._after_send(done, sent, "thumb"))
+        return future
+
+    def _after_send(self, future: asyncio.Future, cards: List[Tuple[int, str, bool]], variant: str):
+        """
+        Records the file_ids of freshly sent images, or forgets cached ones after a failed send.
+
+        `cards` holds (card_id, image_url, fresh) per sent item, fresh meaning it was
+        sent from the URL or a thumbnail rather than a cached file_id. A media group
+        fails as a whole without saying which item was rejected, so every cached
+        file_id in it is forgotten and the next send uploads those images once again.
+        """
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.warning(f"Could not send card {variant}: {future.exception()}")
+            for card_id, _, fresh in cards:
+                if not fresh:
+                    self._file_ids.pop((card_id, variant))
+                    self._spawn(self._forget(card_id, variant))
+            return
+        messages = future.result()
+        messages = messages if isinstance(messages, (list, tuple)) else [messages]
+        entries = []
+        for (card_id, image_url, fresh), message in zip(cards, messages):  # A media group returns one message per item, in order
+            file_id = _file_id(message)
+            if fresh and file_id:
+                entries.append((card_id, variant, image_url, file_id))
+        if entries:
+            for card_id, _, image_url, file_id in entries:
+                self._file_ids.set((card_id, variant), (image_url, file_id))
+            self._spawn(self._remember(entries))
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _cached_file_ids(self, card_ids: List[int], variant: str) -> Dict[int, Tuple[str, str]]:
+        """Returns card_id -> (image_url, file_id), reading the database only for cards not cached in memory."""
+        found, missing = {}, []
+        for card_id in card_ids:
+            entry = self._file_ids.get((card_id, variant), default=False)
+            if entry is False:
+                missing.append(card_id)
+            elif entry is not None:
+                found[card_id] = entry
+        if missing:
+            async for session in get_session():
+                stmt = select(CardMedia.card_id, CardMedia.image_url, CardMedia.file_id).where(
+                    CardMedia.card_id.in_(missing), CardMedia.variant == variant)
+                rows = {card_id: (image_url, file_id) for card_id, image_url, file_id in (await session.execute(stmt)).all()}
+            for card_id in missing:
+                self._file_ids.set((card_id, variant), rows.get(card_id))
+            found.update(rows)
+        return found
+
+    async def _remember(self, entries: List[Tuple[int, str, str, str]]):
+        try:
+            async for session in get_session():
+                insert = dialect_insert(session)
+                stmt = insert(CardMedia).values([
+                    {"card_id": card_id, "variant": variant, "image_url": image_url, "file_id": file_id}
+                    for card_id, variant, image_url, file_id in entries
+                ])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[CardMedia.card_id, CardMedia.variant],
+                    set_={"image_url": stmt.excluded.image_url, "file_id": stmt.excluded.file_id},
+                )
+                await session.execute(stmt)
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error saving card file_ids: {e}")
+
+    async def _forget(self, card_id: int, variant: str):
+        try:
+            async for session in get_session():
+                await session.execute(CardMedia.__table__.delete().where(
+                    and_(CardMedia.card_id == card_id, CardMedia.variant == variant)))
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error forgetting card file_id: {e}")
+
+    async def close(self):
+        await self.thumbnails.close()
+
+# Shared by the chat and command handlers
+media_service = MediaService()
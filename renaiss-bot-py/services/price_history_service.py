@@ -0,0 +1,146 @@
+
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Dict, Any, Optional, Tuple
+from sqlalchemy import delete, func, insert
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.database import PriceTick, PriceRollup, get_session, dialect_insert
+from config import config
+from utils.logger import logger
+
+BUCKETS = {
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+}
+
+def bucket_floor(moment: datetime, bucket: str) -> datetime:
+    """Truncates a timestamp to the start of its bucket."""
+    if bucket == "1h":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if bucket == "1d":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown bucket size: {bucket}")
+
+class PriceHistoryService:
+    """Service to record price changes and serve price trends from rollups."""
+
+    async def append_ticks(self, session: AsyncSession, ticks: List[Dict[str, Any]]):
+        """Appends price ticks in one statement. Runs inside the caller's refresh transaction."""
+        if ticks:
+            await session.execute(insert(PriceTick), ticks)
+
+    async def rollup(self, fence: Optional[Callable[[AsyncSession], Awaitable[None]]] = None):
+        """
+        Folds new price ticks into 1h and 1d buckets, then applies the retention policy.
+
+        Each bucket size resumes one bucket before its latest existing bucket and
+        rebuilds both: the latest may have been partial, and a refresh transaction
+        that commits late can still add ticks stamped in the one before it. A run
+        therefore only reads recent ticks, and the upsert makes rebuilding safe.
+        `fence`, if given, is awaited inside the transaction before it commits.
+        """
+        async for session in get_session():
+            for bucket in BUCKETS:
+                written = await self._rollup_bucket(session, bucket)
+                logger.info(f"Price rollup '{bucket}': {written} buckets written.")
+            await self._apply_retention(session)
+            if fence is not None:
+                await fence(session)
+            await session.commit()
+
+    async def _rollup_bucket(self, session: AsyncSession, bucket: str) -> int:
+        latest = await session.scalar(select(func.max(PriceRollup.bucket_start)).where(PriceRollup.bucket == bucket))
+        stmt = select(PriceTick.card_id, PriceTick.source, PriceTick.ask_price, PriceTick.fmv_price,
+                      PriceTick.offer_price, PriceTick.recorded_at).order_by(PriceTick.recorded_at, PriceTick.id)
+        if latest is not None:
+            stmt = stmt.where(PriceTick.recorded_at >= latest - BUCKETS[bucket])
+
+        buckets: Dict[Tuple[int, str, datetime], Dict[str, Any]] = {}
+        result = await session.stream(stmt)
+        async for card_id, source, ask_price, fmv_price, offer_price, recorded_at in result:
+            key = (card_id, source, bucket_floor(recorded_at, bucket))
+            row = buckets.get(key)
+            if row is None:
+                row = buckets[key] = {
+                    "card_id": card_id, "source": source, "bucket": bucket, "bucket_start": key[2],
+                    "open_price": None, "high_price": None, "low_price": None, "close_price": None,
+                    "fmv_price": None, "offer_price": None, "tick_count": 0,
+                }
+            row["tick_count"] += 1
+            row["fmv_price"] = fmv_price
+            row["offer_price"] = offer_price
+            if ask_price is not None:
+                if row["open_price"] is None:
+                    row["open_price"] = row["high_price"] = row["low_price"] = ask_price
+                row["high_price"] = max(row["high_price"], ask_price)
+                row["low_price"] = min(row["low_price"], ask_price)
+                row["close_price"] = ask_price
+
+        rows = list(buckets.values())
+        upsert = dialect_insert(session)
+        for start in range(0, len(rows), config.PRICE_ROLLUP_BATCH_SIZE):
+            stmt = upsert(PriceRollup).values(rows[start:start + config.PRICE_ROLLUP_BATCH_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[PriceRollup.card_id, PriceRollup.source, PriceRollup.bucket, PriceRollup.bucket_start],
+                set_={column: stmt.excluded[column] for column in (
+                    "open_price", "high_price", "low_price", "close_price", "fmv_price", "offer_price", "tick_count")},
+            )
+            await session.execute(stmt)
+        return len(rows)
+
+    async def _apply_retention(self, session: AsyncSession):
+        """Drops raw ticks that are already covered by daily rollups, and old hourly buckets."""
+        now = datetime.utcnow()
+        latest_daily = await session.scalar(select(func.max(PriceRollup.bucket_start)).where(PriceRollup.bucket == "1d"))
+        if latest_daily is not None:
+            # Keep the ticks of the daily bucket the next run rebuilds
+            tick_cutoff = min(now - timedelta(days=config.PRICE_TICK_RETENTION_DAYS), latest_daily - BUCKETS["1d"])
+            result = await session.execute(delete(PriceTick).where(PriceTick.recorded_at < tick_cutoff))
+            if result.rowcount:
+                logger.info(f"Compacted {result.rowcount} raw price ticks older than {tick_cutoff}.")
+        hourly_cutoff = now - timedelta(days=config.PRICE_HOURLY_RETENTION_DAYS)
+        await session.execute(delete(PriceRollup).where(PriceRollup.bucket == "1h", PriceRollup.bucket_start < hourly_cutoff))
+
+    async def get_price_trend(self, card_id: int, days: int = 30, source: str = "renaiss",
+                              bucket: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the price trend of a card from rollups, oldest bucket first.
+
+        Args:
+            card_id: The card to look up.
+            days: How far back to look.
+            source: The market the prices come from.
+            bucket: '1h' or '1d'. Defaults to hourly for up to two days, daily otherwise.
+
+        Returns:
+            A list of OHLC bucket dicts.
+        """
+        return (await self.get_price_trends([card_id], days, source, bucket)).get(card_id, [])
+
+    async def get_price_trends(self, card_ids: List[int], days: int = 30, source: str = "renaiss",
+                               bucket: Optional[str] = None) -> Dict[int, List[Dict[str, Any]]]:
+        """Like get_price_trend for several cards in one query. Cards without rollups are left out."""
+        bucket = bucket or ("1h" if days <= 2 else "1d")
+        since = bucket_floor(datetime.utcnow() - timedelta(days=days), bucket)
+        trends: Dict[int, List[Dict[str, Any]]] = {}
+        if not card_ids:
+            return trends
+        async for session in get_session():
+            stmt = (
+                select(PriceRollup)
+                .where(PriceRollup.card_id.in_(card_ids), PriceRollup.source == source,
+                       PriceRollup.bucket == bucket, PriceRollup.bucket_start >= since)
+                .order_by(PriceRollup.card_id, PriceRollup.bucket_start)
+            )
+            for rollup in (await session.execute(stmt)).scalars():
+                trends.setdefault(rollup.card_id, []).append({
+                    "bucket_start": rollup.bucket_start,
+                    "open": rollup.open_price,
+                    "high": rollup.high_price,
+                    "low": rollup.low_price,
+                    "close": rollup.close_price,
+                    "fmv": rollup.fmv_price,
+                    "offer": rollup.offer_price,
+                    "changes": rollup.tick_count,
+                })
+        return trends
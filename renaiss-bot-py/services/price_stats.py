@@ -0,0 +1,315 @@
+
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.future import select
+from models.database import Card, PriceRollup, get_session
+from services.card_identity import identity_key
+from services.market_snapshot import MarketSnapshot
+from config import config
+from utils.metrics import metrics
+from utils.logger import logger
+
+PRICE_STATS_UPDATES = metrics.counter("price_stats_updates_total", "Ask changes folded into the price statistics.")
+PRICE_STATS_SERIES = metrics.gauge("price_stats_series", "Price series tracked by the statistics engine.", ["scope"])
+PRICE_STATS_OBSERVE_SECONDS = metrics.histogram("price_stats_observe_seconds", "Time to fold one snapshot into the price statistics.")
+
+_DAY_SECONDS = 86400
+_GAMMA = (1 + config.PRICE_STATS_SKETCH_ACCURACY) / (1 - config.PRICE_STATS_SKETCH_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+class QuantileSketch:
+    """
+    Relative-error quantile sketch (DDSketch style): values are counted in
+    log-spaced bins, so any quantile it returns is within `accuracy` of the
+    true value, relative to it, whatever the number of values added.
+    """
+
+    __slots__ = ("bins", "count", "min", "max")
+
+    def __init__(self):
+        self.bins: Dict[int, int] = {}
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, count: int = 1):
+        index = math.ceil(math.log(value) / _LOG_GAMMA)
+        self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "QuantileSketch"):
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                # Bin midpoint in relative terms, clamped to the exact extremes
+                return min(self.max, max(self.min, 2 * _GAMMA ** index / (_GAMMA + 1)))
+        return self.max
+
+class PriceSeries:
+    """
+    Running statistics of one ask series, each update O(1).
+
+    EWMA and volatility (EW standard deviation of log returns) weigh every
+    observation by `alpha`. Quantiles, min and max cover a rolling window of
+    days: each day has its own sketch, and a query merges the window's
+    days, so its cost depends on the window, never on the length of history.
+    """
+
+    __slots__ = ("last", "last_at", "ewma", "variance", "count", "days", "_median")
+
+    def __init__(self):
+        self.last: Optional[float] = None
+        self.last_at = 0.0
+        self.ewma = 0.0
+        self.variance = 0.0
+        self.count = 0
+        self.days: Dict[int, QuantileSketch] = {}
+        self._median: Optional[Tuple[int, int, Optional[float]]] = None  # (day, count, median)
+
+    def update(self, price: float, at: float, alpha: float, window_days: int):
+        if self.last is None:
+            self.ewma = price
+        else:
+            self.ewma += alpha * (price - self.ewma)
+            log_return = math.log(price / self.last)
+            self.variance = (1 - alpha) * self.variance + alpha * log_return * log_return
+        self.last, self.last_at = price, at
+        self.count += 1
+
+        day = int(at // _DAY_SECONDS)
+        sketch = self.days.get(day)
+        if sketch is None:
+            sketch = self.days[day] = QuantileSketch()
+            # A new day is the only time old days can fall out of the window
+            for old in [old for old in self.days if old <= day - window_days]:
+                del self.days[old]
+        sketch.add(price)
+
+    def window(self, now: float, window_days: int) -> QuantileSketch:
+        """The window's values merged into one sketch, counting the current ask as seen today."""
+        today = int(now // _DAY_SECONDS)
+        merged = QuantileSketch()
+        for day, sketch in self.days.items():
+            if day > today - window_days:
+                merged.merge(sketch)
+        if self.last is not None and today not in self.days:
+            merged.add(self.last)  # Still listed at its last price
+        return merged
+
+    def median(self, now: float, window_days: int, min_observations: int = 1) -> Optional[float]:
+        """Window median, None below `min_observations`. Cached until the next update or day."""
+        today = int(now // _DAY_SECONDS)
+        if self._median is None or self._median[:2] != (today, self.count):
+            window = self.window(now, window_days)
+            median = window.quantile(0.5) if window.count >= min_observations else None
+            self._median = (today, self.count, median)
+        return self._median[2]
+
+    def describe(self, now: float, window_days: int) -> Dict[str, Any]:
+        window = self.window(now, window_days)
+        return {
+            "observations": window.count,
+            "last": self.last,
+            "ewma": round(self.ewma, 2),
+            "median": _round(window.quantile(0.5)),
+            "p10": _round(window.quantile(0.1)),
+            "p90": _round(window.quantile(0.9)),
+            "min": _round(window.min if window.count else None),
+            "max": _round(window.max if window.count else None),
+            "volatility_percent": round(math.sqrt(self.variance) * 100, 2),
+        }
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 2)
+
+class PriceStatsEngine:
+    """
+    Streaming ask-price statistics per card and per card identity (same card,
+    same grade, across slabs).
+
+    observe() is handed every new market snapshot; it finds the asks that
+    changed since the previous one with a vectorized diff, and folds only
+    those into their series. Nothing is ever recomputed from history, apart
+    from seed(), which warms the series from daily rollups once at startup.
+    """
+
+    def __init__(self, window_days: int, alpha: float, min_observations: int):
+        self.window_days = window_days
+        self.alpha = alpha
+        self.min_observations = min_observations
+        self.cards: Dict[int, PriceSeries] = {}
+        self.identities: List[PriceSeries] = []  # Indexed by identity number
+        self._identity_numbers: Dict[str, int] = {}
+        self._identity_of: Dict[int, int] = {}  # Card id to identity number
+        # Asks of the last observed snapshot, sorted by card id
+        self._card_ids = np.empty(0, dtype=np.int64)
+        self._asks = np.empty(0, dtype=np.float64)
+        self._references: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}  # Reference prices by snapshot version
+
+    def _identity(self, card_id: int, name: str, grade: Optional[str]) -> int:
+        """Identity number of a card, hashing its name and grade only the first time it is seen."""
+        number = self._identity_of.get(card_id)
+        if number is None:
+            number = self._identity_numbers.setdefault(identity_key(name, grade), len(self.identities))
+            if number == len(self.identities):
+                self.identities.append(PriceSeries())
+            self._identity_of[card_id] = number
+        return number
+
+    def update(self, card_id: int, identity: int, price: float, at: float):
+        """Folds one ask observation into the card's and its identity's series."""
+        if not price > 0:
+            return
+        series = self.cards.get(card_id)
+        if series is None:
+            series = self.cards[card_id] = PriceSeries()
+        series.update(price, at, self.alpha, self.window_days)
+        self.identities[identity].update(price, at, self.alpha, self.window_days)
+        PRICE_STATS_UPDATES.inc()
+
+    def observe(self, snapshot: MarketSnapshot) -> int:
+        """Folds the asks that changed since the last observed snapshot. Returns how many did."""
+        started = time.perf_counter()
+        order = np.argsort(snapshot.card_ids, kind="stable")
+        card_ids = snapshot.card_ids[order]
+        asks = snapshot.ask_prices[order]
+        if len(self._card_ids):
+            positions = np.minimum(np.searchsorted(self._card_ids, card_ids), len(self._card_ids) - 1)
+            previous = np.where(self._card_ids[positions] == card_ids, self._asks[positions], np.nan)
+        else:
+            previous = np.full(len(card_ids), np.nan)
+        # New or moved asks; a listing that lost its ask is not an observation
+        changed = order[(asks > 0) & ~(asks == previous)]
+
+        at = snapshot.built_at
+        for row in changed.tolist():
+            card_id = int(snapshot.card_ids[row])
+            identity = self._identity(card_id, snapshot.names[row], snapshot.grades[row])
+            self.update(card_id, identity, float(snapshot.ask_prices[row]), at)
+        self._card_ids, self._asks = card_ids, asks
+        PRICE_STATS_SERIES.set(len(self.cards), scope="card")
+        PRICE_STATS_SERIES.set(len(self.identities), scope="identity")
+        PRICE_STATS_OBSERVE_SECONDS.observe(time.perf_counter() - started)
+        return len(changed)
+
+    async def seed(self, days: Optional[int] = None):
+        """
+        Warms the series with the daily closes of the last window, read once from the rollups.
+
+        Each card's latest close also becomes the baseline of the next observe(),
+        so a current ask the rollups already hold is not counted a second time.
+        """
+        since = datetime.utcnow() - timedelta(days=days or self.window_days)
+        started = time.perf_counter()
+        closes = 0
+        latest: Dict[int, float] = {}
+        try:
+            async for session in get_session():
+                stmt = (
+                    select(PriceRollup.card_id, PriceRollup.bucket_start, PriceRollup.close_price, Card.name, Card.grade)
+                    .join(Card, Card.id == PriceRollup.card_id)
+                    .where(PriceRollup.source == "renaiss", PriceRollup.bucket == "1d",
+                           PriceRollup.bucket_start >= since, PriceRollup.close_price.is_not(None))
+                    .order_by(PriceRollup.bucket_start)
+                )
+                async for card_id, bucket_start, close, name, grade in await session.stream(stmt):
+                    # The close stands for the whole day; place it at noon
+                    at = bucket_start.replace(tzinfo=timezone.utc).timestamp() + _DAY_SECONDS / 2
+                    self.update(card_id, self._identity(card_id, name, grade), close, at)
+                    latest[card_id] = close
+                    closes += 1
+        except Exception as e:
+            logger.error(f"Error seeding price statistics: {e}")
+            return
+        if not len(self._card_ids):
+            card_ids = np.fromiter(latest.keys(), dtype=np.int64, count=len(latest))
+            asks = np.fromiter(latest.values(), dtype=np.float64, count=len(latest))
+            order = np.argsort(card_ids, kind="stable")
+            self._card_ids, self._asks = card_ids[order], asks[order]
+        logger.info(f"Price statistics seeded from {closes} daily closes in "
+                    f"{(time.perf_counter() - started) * 1000:.0f} ms.")
+
+    def describe(self, card_id: int, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Statistics of one card's own asks ("card") and of its card-and-grade market ("market")."""
+        series = self.cards.get(card_id)
+        if series is None:
+            return None
+        now = time.time() if now is None else now
+        return {
+            "window_days": self.window_days,
+            "card": series.describe(now, self.window_days),
+            "market": self.identities[self._identity_of[card_id]].describe(now, self.window_days),
+        }
+
+    def signal_opportunities(self, snapshot: MarketSnapshot, min_discount_percent: float,
+                             limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Opportunities from the statistics, largest discount first:
+        - "Below Median": ask at least `min_discount_percent` below the rolling
+          median ask of the same card and grade;
+        - "Below Best Offer": ask below the best open offer for the same card
+          and grade, so the slab can be bought and sold to that bidder.
+        """
+        medians, best_offers = self._reference_prices(snapshot)
+        asks = snapshot.ask_prices
+        with np.errstate(divide="ignore", invalid="ignore"):
+            discounts = ((medians - asks) / medians * 100, (best_offers - asks) / asks * 100)
+        below_median = np.flatnonzero((asks > 0) & (discounts[0] >= min_discount_percent))
+        below_offer = np.flatnonzero((asks > 0) & (discounts[1] > 0))
+        rows = np.concatenate([below_median, below_offer])
+        kinds = np.concatenate([np.zeros(len(below_median), dtype=np.int8), np.ones(len(below_offer), dtype=np.int8)])
+        found = np.concatenate([discounts[0][below_median], discounts[1][below_offer]])
+        best = np.argsort(-found, kind="stable")[:limit]
+
+        opportunities = []
+        for row, kind in zip(rows[best].tolist(), kinds[best].tolist()):
+            reference = float((medians, best_offers)[kind][row])
+            opportunity = snapshot.opportunity(row)
+            opportunity.update({
+                "type": ("Below Median", "Below Best Offer")[kind],
+                "reference_price": round(reference, 2),
+                "profit_usd": round(reference - float(asks[row]), 2),
+                "profit_percent": round(float(discounts[kind][row]), 2),
+            })
+            opportunities.append(opportunity)
+        return opportunities
+
+    def _reference_prices(self, snapshot: MarketSnapshot) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-row rolling median and best offer of the row's card identity, computed once per snapshot."""
+        cached = self._references.get(snapshot.version)
+        if cached is not None:
+            return cached
+        identities = np.array([
+            self._identity_of[card_id] if card_id in self._identity_of
+            else self._identity(card_id, snapshot.names[row], snapshot.grades[row])
+            for row, card_id in enumerate(snapshot.card_ids.tolist())
+        ], dtype=np.int64)
+        now = snapshot.built_at
+        medians = np.array([series.median(now, self.window_days, self.min_observations) for series in self.identities],
+                           dtype=np.float64)  # None becomes NaN
+        best_offers = np.full(len(self.identities), np.nan)
+        np.fmax.at(best_offers, identities, snapshot.offer_prices)
+        result = (medians[identities], best_offers[identities])
+        self._references = {snapshot.version: result}  # Only the latest snapshot is queried
+        return result
+
+# Shared by the scheduler, which feeds it, and the handlers that read it
+price_stats = PriceStatsEngine(config.PRICE_STATS_WINDOW_DAYS, config.PRICE_STATS_EWMA_ALPHA,
+                               config.PRICE_STATS_MIN_OBSERVATIONS)
@@ -0,0 +1,41 @@
+
+from typing import List, Optional, Tuple
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.database import User, get_session
+from utils.logger import logger
+
+class UserService:
+    """Service to manage user preferences such as alert subscriptions and thresholds."""
+
+    async def set_subscription(self, telegram_id: str, subscribed: bool, username: Optional[str] = None) -> User:
+        """Turns arbitrage alerts on or off for a user."""
+        async for session in get_session():
+            user = await self._load_or_create(session, telegram_id, username)
+            user.is_subscribed = subscribed
+            await session.commit()
+            logger.info(f"User {telegram_id} {'subscribed to' if subscribed else 'unsubscribed from'} alerts.")
+            return user
+
+    async def set_threshold(self, telegram_id: str, threshold_percent: float, username: Optional[str] = None) -> User:
+        """Sets the minimum profit percentage a user wants to be alerted about."""
+        async for session in get_session():
+            user = await self._load_or_create(session, telegram_id, username)
+            user.threshold_percent = threshold_percent
+            await session.commit()
+            logger.info(f"User {telegram_id} set alert threshold to {threshold_percent}%.")
+            return user
+
+    async def get_subscriber_thresholds(self) -> List[Tuple[float, str]]:
+        """Returns (threshold_percent, telegram_id) for every subscribed user."""
+        async for session in get_session():
+            stmt = select(User.threshold_percent, User.telegram_id).where(User.is_subscribed.is_(True))
+            return [(threshold, telegram_id) for threshold, telegram_id in (await session.execute(stmt)).all()]
+
+    async def _load_or_create(self, session: AsyncSession, telegram_id: str, username: Optional[str]) -> User:
+        stmt = select(User).where(User.telegram_id == telegram_id)
+        user = (await session.execute(stmt)).scalars().first()
+        if not user:
+            user = User(telegram_id=telegram_id, username=username)
+            session.add(user)
+        return user
@@ -0,0 +1,94 @@
+
+import gzip
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, List, NamedTuple, Optional
+from utils.logger import logger
+
+# Each record: recorded_at, crawl id, page offset, page limit, body length, then the raw body.
+# Segments are plain gzip streams of records, so `zcat` works on them too.
+_RECORD_HEADER = struct.Struct("<dQIII")
+_SEGMENT_SUFFIX = ".feed.gz"
+
+class FeedRecord(NamedTuple):
+    recorded_at: float
+    crawl_id: int
+    offset: int
+    limit: int
+    body: bytes
+
+class FeedLogWriter:
+    """
+    Appends raw API pages to gzip-compressed, size-rotated segment files.
+
+    Segment names start with the nanosecond time they were opened, so they sort
+    chronologically. Every record is flushed on write; a crash loses at most the
+    record being written, and readers skip the cut-off tail.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int, max_segments: int = 0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments  # 0 keeps every segment
+        self._file: Optional[gzip.GzipFile] = None
+        self._written = 0
+        self._lock = threading.Lock()  # append() runs in worker threads
+
+    def append(self, crawl_id: int, offset: int, limit: int, body: bytes, recorded_at: Optional[float] = None):
+        with self._lock:
+            if self._file is None or self._written >= self.segment_bytes:
+                self._rotate()
+            header = _RECORD_HEADER.pack(time.time() if recorded_at is None else recorded_at,
+                                         crawl_id, offset, limit, len(body))
+            self._file.write(header)
+            self._file.write(body)
+            self._file.flush()
+            self._written += len(header) + len(body)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{time.time_ns():020d}{_SEGMENT_SUFFIX}")
+        self._file = gzip.open(path, "wb", compresslevel=6)
+        self._written = 0
+        logger.info(f"Recording Renaiss feed to {path}")
+        if self.max_segments:
+            for old in list_segments(self.directory)[:-self.max_segments]:
+                try:
+                    os.remove(old)
+                except OSError as e:
+                    logger.warning(f"Could not remove old feed segment {old}: {e}")
+
+def list_segments(directory: str) -> List[str]:
+    """Returns the segment files in a feed directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(_SEGMENT_SUFFIX)]
+
+def read_feed_log(directory: str) -> Iterator[FeedRecord]:
+    """Yields every record of a feed directory in recording order, skipping cut-off segment tails."""
+    for path in list_segments(directory):
+        try:
+            with gzip.open(path, "rb") as segment:
+                while True:
+                    header = segment.read(_RECORD_HEADER.size)
+                    if len(header) < _RECORD_HEADER.size:
+                        break
+                    recorded_at, crawl_id, offset, limit, length = _RECORD_HEADER.unpack(header)
+                    body = segment.read(length)
+                    if len(body) < length:
+                        break
+                    yield FeedRecord(recorded_at, crawl_id, offset, limit, body)
+        except (EOFError, OSError, zlib.error) as e:
+            # A segment that was still being written when the recorder stopped
+            logger.warning(f"Feed segment {path} ends early: {e}")
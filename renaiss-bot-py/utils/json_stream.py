@@ -0,0 +1,92 @@
+
+import codecs
+import json
+from typing import Any, List
+
+_WHITESPACE = " \t\r\n"
+
+class JsonArrayStream:
+    """
+    Incremental decoder for the first array stored under `key` in a JSON document.
+
+    feed() takes raw response chunks as they arrive and returns the array
+    items completed so far. Only the unparsed tail is buffered, so memory
+    stays at about one chunk plus one item whatever the array length, and
+    each item is decoded by the C JSON scanner on its own.
+    """
+
+    def __init__(self, key: str):
+        self._marker = json.dumps(key)
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self.found = False  # The array has started
+        self.done = False  # The array has ended; later input is ignored
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        if self.done:
+            return []
+        self._buffer += self._text.decode(chunk)
+        if not self.found and not self._seek():
+            return []
+        return self._drain()
+
+    def close(self) -> List[Any]:
+        """Flushes the decoder at the end of the body. Raises ValueError if the array was missing or cut off."""
+        items = []
+        if not self.done:
+            self._buffer += self._text.decode(b"", final=True)
+            if self.found or self._seek():
+                items = self._drain()
+        if not self.found:
+            raise ValueError(f"No {self._marker} array in the document")
+        if not self.done:
+            raise ValueError(f"The {self._marker} array ends early")
+        return items
+
+    def _seek(self) -> bool:
+        """Drops everything up to the opening bracket of the array; False if it has not arrived yet."""
+        start = 0
+        while True:
+            index = self._buffer.find(self._marker, start)
+            if index == -1:
+                # Keep a tail long enough to hold a marker split across chunks
+                self._buffer = self._buffer[-len(self._marker):]
+                return False
+            if index and self._buffer[index - 1] == "\\":
+                start = index + 1  # Escaped quote inside a string value, not a key
+                continue
+            position = index + len(self._marker)
+            while position < len(self._buffer) and self._buffer[position] in _WHITESPACE + ":":
+                position += 1
+            if position == len(self._buffer):
+                self._buffer = self._buffer[index:]
+                return False
+            if self._buffer[position] != "[":
+                start = position  # Same name with a non-array value
+                continue
+            self._buffer = self._buffer[position + 1:]
+            self.found = True
+            return True
+
+    def _drain(self) -> List[Any]:
+        items, position, length = [], 0, len(self._buffer)
+        while True:
+            while position < length and self._buffer[position] in _WHITESPACE + ",":
+                position += 1
+            if position == length:
+                break
+            if self._buffer[position] == "]":
+                self.done = True
+                position = length
+                break
+            try:
+                item, end = self._decoder.raw_decode(self._buffer, position)
+            except json.JSONDecodeError:
+                break  # The item is still arriving
+            if not isinstance(item, (dict, list, str)) and (end == length or self._buffer[end] not in _WHITESPACE + ",]"):
+                break  # A number may continue in the next chunk, e.g. "3." + "25"
+            items.append(item)
+            position = end
+        self._buffer = self._buffer[position:]
+        return items
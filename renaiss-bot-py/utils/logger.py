@@ -1,8 +1,9 @@
 
+import os
 import sys
 from loguru import logger
 
-# Configure logger
+# Configure logger. enqueue=True hands records to a background thread so
+# writing to stderr never blocks the event loop.
 logger.remove()
-logger.add(sys.stderr, level="INFO", format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>")
-
+logger.add(sys.stderr, level=os.getenv("LOG_LEVEL", "INFO").upper(), enqueue=True, format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>")
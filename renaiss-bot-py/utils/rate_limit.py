@@ -0,0 +1,120 @@
+
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Hashable, Optional
+from utils.cache import TTLCache
+from utils.metrics import metrics
+
+GATE_IN_FLIGHT = metrics.gauge("gate_in_flight", "Calls holding a slot of a concurrency gate.", ["gate"])
+GATE_WAITING = metrics.gauge("gate_waiting", "Calls queued for a slot of a concurrency gate.", ["gate"])
+GATE_WAIT_SECONDS = metrics.histogram("gate_wait_seconds", "Time spent waiting for a gate slot.", ["gate"])
+GATE_SHED = metrics.counter("gate_shed_total", "Calls rejected by a concurrency gate.", ["gate", "reason"])
+
+# Monotonic time by which the current request must have started its work
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+class Overloaded(Exception):
+    """Raised when a call is shed instead of queued."""
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is available now."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class KeyedRateLimiter:
+    """One token bucket per key (e.g. per user), kept for the `max_keys` most recently seen keys."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        # An idle key's bucket refills completely within burst / rate seconds, so it can be dropped after that
+        self._buckets = TTLCache(maxsize=max_keys, ttl_seconds=burst / rate)
+
+    def allow(self, key: Hashable) -> bool:
+        """Takes a token for `key` if one is available."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+        self._buckets.set(key, bucket)
+        if bucket.delay(time.monotonic()) > 0:
+            return False
+        bucket.take()
+        return True
+
+@contextmanager
+def deadline(seconds: float):
+    """Sets how long gated calls made inside this block may wait for a slot, in total."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+class ConcurrencyGate:
+    """
+    Caps concurrent calls at `limit`, with at most `max_waiting` callers queued.
+
+    Callers are admitted in arrival order. A caller is shed with Overloaded
+    when the queue is already full, or when the current `deadline` (or
+    `default_timeout` outside one) passes before a slot frees up.
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int, default_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.default_timeout = default_timeout
+        self.waiting = 0
+        self.in_flight = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    def _shed(self, reason: str):
+        GATE_SHED.inc(gate=self.name, reason=reason)
+        raise Overloaded(f"{self.name} overloaded ({reason})")
+
+    @asynccontextmanager
+    async def slot(self):
+        """Holds one slot for the duration of the block."""
+        if self._semaphore.locked():
+            expires_at = _deadline.get()
+            timeout = self.default_timeout if expires_at is None else expires_at - time.monotonic()
+            if self.waiting >= self.max_waiting:
+                self._shed("queue_full")
+            if timeout <= 0:
+                self._shed("deadline")
+            started = time.perf_counter()
+            self.waiting += 1
+            GATE_WAITING.set(self.waiting, gate=self.name)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self._shed("deadline")
+            finally:
+                self.waiting -= 1
+                GATE_WAITING.set(self.waiting, gate=self.name)
+                GATE_WAIT_SECONDS.observe(time.perf_counter() - started, gate=self.name)
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        GATE_IN_FLIGHT.set(self.in_flight, gate=self.name)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            GATE_IN_FLIGHT.set(self.in_flight, gate=self.name)
+            self._semaphore.release()
@@ -0,0 +1,75 @@
+
+import functools
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, List, Optional, Tuple
+from config import config
+from utils.metrics import Histogram, metrics
+from utils.logger import logger
+
+HANDLER_SECONDS = metrics.histogram("handler_seconds", "End-to-end latency of Telegram update handlers.", ["handler"])
+HANDLER_ERRORS = metrics.counter("handler_errors_total", "Telegram update handlers that raised.", ["handler"])
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+class Trace:
+    """Lightweight per-update trace: a list of named spans with their durations."""
+
+    def __init__(self, name: str, **attributes):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+
+    def summary(self) -> str:
+        total = (time.perf_counter() - self.started) * 1000
+        spans = " ".join(f"{name}={duration * 1000:.1f}ms" for name, duration in self.spans)
+        attributes = " ".join(f"{key}={value}" for key, value in self.attributes.items())
+        return f"trace={self.trace_id} {self.name} total={total:.1f}ms {spans} {attributes}".strip()
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """Starts a trace for the current update; a sampled share of traces is logged when it ends."""
+    trace = Trace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        if random.random() < config.TRACE_SAMPLE_RATE:
+            logger.info(trace.summary())
+
+@contextmanager
+def span(name: str, histogram: Optional[Histogram] = None, **labels):
+    """
+    Times a block as a span of the current trace, if any, and optionally
+    observes the same duration into a histogram.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        if histogram is not None:
+            histogram.observe(duration, **labels)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((name, duration))
+
+def traced(name: str, handler: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """Wraps a Telegram handler so each update gets a trace and a handler_seconds observation."""
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        chat = getattr(update, "effective_chat", None)
+        with start_trace(name, chat=getattr(chat, "id", None)):
+            try:
+                with span(name, HANDLER_SECONDS, handler=name):
+                    return await handler(update, context)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+    return wrapper